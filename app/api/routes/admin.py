@@ -0,0 +1,79 @@
+"""Admin endpoints for diagnosing live workers"""
+
+import secrets
+from typing import Any, Dict, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+
+from core.config import settings
+from core.logging import get_logger
+from services.profiler import WorkerProfiler
+
+logger = get_logger()
+router = APIRouter()
+
+
+def get_admin_key(x_admin_key: str = Header(..., alias="X-Admin-Key")):
+    if not settings.ADMIN_API_KEY or not secrets.compare_digest(
+        x_admin_key, settings.ADMIN_API_KEY
+    ):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin key")
+    return x_admin_key
+
+
+def get_profiler(request: Request) -> WorkerProfiler:
+    """Dependency to get the worker profiler from app state"""
+    profiler = getattr(request.app.state, "profiler", None)
+    if not profiler:
+        raise HTTPException(status_code=404, detail="Profiler not enabled")
+    return profiler
+
+
+@router.post(
+    "/profile",
+    summary="Profile the worker",
+    description=(
+        "Capture CPU samples (or a cProfile trace) of the worker serving this call "
+        "for a number of seconds or of prediction requests, with an optional "
+        "tracemalloc allocation diff"
+    ),
+)
+async def profile_worker(
+    seconds: Optional[float] = Query(None, gt=0),
+    requests: Optional[int] = Query(None, gt=0),
+    mode: Literal["sampling", "cprofile"] = "sampling",
+    interval_ms: float = Query(10, ge=1, le=1000),
+    trace_allocations: bool = False,
+    top: int = Query(30, ge=1, le=500),
+    output: Literal["json", "collapsed"] = "json",
+    _admin_key: str = Depends(get_admin_key),
+    profiler: WorkerProfiler = Depends(get_profiler),
+) -> Dict[str, Any]:
+    """Profile the worker and return the top functions and collapsed stacks"""
+    if output == "collapsed" and mode != "sampling":
+        raise HTTPException(
+            status_code=400, detail="Collapsed stacks need the sampling mode"
+        )
+    if seconds is None and requests is None:
+        seconds = 10
+    try:
+        logger.info(f"Profile capture ({mode}) requested")
+        result = await profiler.capture(
+            seconds=seconds,
+            requests=requests,
+            mode=mode,
+            interval_ms=interval_ms,
+            trace_allocations=trace_allocations,
+            top=top,
+        )
+    except ValueError as _e:
+        raise HTTPException(status_code=400, detail=str(_e)) from _e
+    except RuntimeError as _e:
+        raise HTTPException(status_code=409, detail=str(_e)) from _e
+
+    if output == "collapsed":
+        return PlainTextResponse(
+            result["collapsed"],
+            headers={"Content-Disposition": "attachment; filename=profile.collapsed"},
+        )
+    return result
@@ -2,7 +2,6 @@
 Prediction API endpoints
 """
 
-import time
 from typing import Dict, Any
 from fastapi import APIRouter, HTTPException, Request, Depends, Header
 
@@ -21,7 +20,8 @@ from schemas.prediction import (
     SingleStationPredictionResponse,
     BatchPredictionRequest,
     BatchPredictionResponse,
-    ErrorResponse,
+    DelayIngestRequest,
+    FastJSONResponse,
 )
 from services.model_service import ModelService
 
@@ -53,7 +53,7 @@ async def predict_single_station(
         logger.info(f"Single station prediction request for train {request.train_id}")
         result = await model_service.predict_single_station(request)
         logger.info(f"Single station prediction completed for train {request.train_id}")
-        return result
+        return FastJSONResponse(result)
 
     except Exception as _e:
         logger.error(f"Single station prediction failed: {_e}")
@@ -74,56 +74,14 @@ async def predict_batch(
     model_service: ModelService = Depends(get_model_service),
 ) -> BatchPredictionResponse:
     """Process batch predictions"""
-    start_time = time.perf_counter()
-    successful_predictions = 0
-    failed_predictions = 0
-    results = []
-
     try:
         logger.info(f"Batch prediction request with {len(request.predictions)} items")
-
-        for i, pred_data in enumerate(request.predictions):
-            try:
-                if request.prediction_type == "single_station":
-                    pred_request = SingleStationPredictionRequest(
-                        train_id=pred_data.get("train_id"),
-                        scheduled_departure_time=pred_data.get(
-                            "scheduled_departure_time"
-                        ),
-                        trip_date=pred_data.get("trip_date"),
-                    )
-                    logger.info(f"Processing batch item {i}: {pred_request}")
-                    result = await model_service.predict_single_station(pred_request)
-
-                else:
-                    raise ValueError(
-                        f"Unknown prediction type: {request.prediction_type}"
-                    )
-
-                results.append(result)
-                successful_predictions += 1
-
-            except Exception as _e:
-                logger.error(f"Batch prediction item {i} failed: {_e}")
-                error_response = ErrorResponse(
-                    error=str(_e),
-                    error_code="PREDICTION_FAILED",
-                    details={"item_index": i},
-                )
-                results.append(error_response)
-                failed_predictions += 1
-
-        total_time = (time.perf_counter() - start_time) * 1000
-
+        content = await model_service.predict_batch(request.predictions)
         logger.info(
-            f"Batch prediction completed: {successful_predictions} successful, {failed_predictions} failed"
-        )
-        return BatchPredictionResponse(
-            predictions=results,
-            total_processing_time_ms=total_time,
-            successful_predictions=successful_predictions,
-            failed_predictions=failed_predictions,
+            f"Batch prediction completed: {content['successful_predictions']} "
+            f"successful, {content['failed_predictions']} failed"
         )
+        return FastJSONResponse(content)
 
     except Exception as _e:
         logger.error(f"Batch prediction failed: {_e}")
@@ -132,6 +90,29 @@ async def predict_batch(
         ) from _e
 
 
+@router.post(
+    "/delays/ingest",
+    summary="Ingest observed delays",
+    description="Update the online rolling delay aggregates with observed delays",
+)
+async def ingest_delays(
+    request: DelayIngestRequest,
+    _api_key: str = Depends(get_api_key),
+    model_service: ModelService = Depends(get_model_service),
+) -> Dict[str, Any]:
+    """Ingest observed delays into the online aggregates"""
+    if model_service.delay_store is None:
+        raise HTTPException(status_code=503, detail="Delay store not enabled")
+    try:
+        return model_service.ingest_delays(request.observations)
+
+    except Exception as _e:
+        logger.error(f"Delay ingestion failed: {_e}")
+        raise HTTPException(
+            status_code=500, detail=f"Delay ingestion failed: {str(_e)}"
+        ) from _e
+
+
 @router.get(
     "/models/info",
     summary="Get model information",
@@ -3,7 +3,7 @@ Configuration management for the ONCycle API
 """
 
 import json
-from typing import List
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -19,11 +19,24 @@ class Settings(BaseSettings):
     SINGLE_STATION_MODEL_PATH: str
     ENCODER_PATH: str
     METRICS_JSON: str
+    MODEL_REGISTRY_DIR: Optional[str] = None
+    MODEL_MEMORY_BUDGET_MB: Optional[float] = None
+    # Distilled tier of the single model, used when the cascade is enabled
+    CASCADE_MODEL_PATH: Optional[str] = None
+    CASCADE_ENABLED: bool = False
+    DELAY_STORE_PATH: Optional[str] = None
+    WEATHER_STATIONS_PATH: Optional[str] = None
+    WEATHER_API_URL: str = "https://api.open-meteo.com/v1/forecast"
+    WEATHER_REFRESH_SECONDS: int = 3600
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     SUPABASE_URL: str
     SUPABASE_KEY: str
     API_KEY: str
+    # Admin profiler, off unless enabled and given its own key
+    PROFILER_ENABLED: bool = False
+    PROFILER_MAX_SECONDS: int = 60
+    ADMIN_API_KEY: Optional[str] = None
 
     class Config:
         """Pydantic configuration"""
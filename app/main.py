@@ -6,15 +6,15 @@ Supports multiple prediction types: single station, multi-station, recursive, an
 """
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from api.routes import prediction, health
+from api.routes import admin, prediction, health
 from core.config import settings
 from core.logging import setup_logging, get_logger
 from services.model_service import ModelService
-
+from services.profiler import WorkerProfiler
 
 # Setup logging
 setup_logging()
@@ -33,6 +33,9 @@ async def lifespan(app: FastAPI):
         MODEL_SERVICE = ModelService()
         await MODEL_SERVICE.load_models()
         app.state.model_service = MODEL_SERVICE
+        if settings.PROFILER_ENABLED:
+            app.state.profiler = WorkerProfiler(settings.PROFILER_MAX_SECONDS)
+            logger.warning("Admin profiler enabled")
         logger.info("Models loaded successfully")
     except Exception as _e:
         logger.error(f"Failed to load models: {_e}")
@@ -42,6 +45,8 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     logger.info("Shutting down ONCycle Train Delay Prediction API")
+    if MODEL_SERVICE is not None:
+        MODEL_SERVICE.shutdown()
 
 
 # Create FastAPI app
@@ -67,6 +72,18 @@ app.add_middleware(
 app.include_router(health.router, prefix="/health", tags=["Health"])
 app.include_router(prediction.router, prefix="/api/v1", tags=["Predictions"])
 
+if settings.PROFILER_ENABLED:
+    app.include_router(admin.router, prefix="/admin", tags=["Admin"])
+
+    @app.middleware("http")
+    async def count_profiled_requests(request: Request, call_next):
+        """Count prediction requests for captures bounded by requests"""
+        response = await call_next(request)
+        profiler = getattr(request.app.state, "profiler", None)
+        if profiler is not None and request.url.path.startswith("/api/v1/predict"):
+            profiler.request_done()
+        return response
+
 
 @app.get("/")
 async def root():
@@ -2,7 +2,9 @@
 Refactored prediction models for production use
 """
 
-from typing import Any, Dict, List, Optional
+import threading
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 import joblib
 
 import numpy as np
@@ -13,25 +15,58 @@ from xgboost import XGBRegressor
 from supabase import Client, create_client
 from core.config import settings
 from core.logging import get_logger
+from services.delay_store import DelayAggregateStore, departure_hour
+from services.weather_service import WeatherService
+
+if TYPE_CHECKING:
+    from models.registry import ModelRegistry
 
 logger = get_logger()
 
+# Artifact written by experiments/scripts/train_cascade.py
+CASCADE_KEYS = ("fast", "error", "error_threshold", "flagged", "features")
+# Columns identifying the processed_data row of a request
+FEATURE_KEYS = ["train_id", "scheduled_departure_time", "day_of_week"]
+FEATURES_PAGE_SIZE = 1000
+# processed_data row of each (train_id, scheduled_departure_time, day_of_week)
+StoredFeatures = Dict[Tuple[str, str, int], Dict[str, Any]]
+
+
+def _time_key(value: Any) -> str:
+    """HH:MM:SS of a HH:MM[:SS] time, as the database returns it"""
+    parts = str(value).strip().split(" ")[-1].split("T")[-1].split(":")
+    return ":".join(f"{int(float(part)):02d}" for part in (parts + ["0", "0"])[:3])
+
 
 class BasePredictor:
     """Base class for all prediction models"""
 
-    def __init__(self):
-        self.label_encoders: LabelEncoder = joblib.load(settings.ENCODER_PATH)
+    def __init__(self, label_encoders: Optional[Dict[str, LabelEncoder]] = None):
+        if label_encoders is None:
+            label_encoders = joblib.load(settings.ENCODER_PATH)
+        self.label_encoders: Dict[str, LabelEncoder] = label_encoders
         self.features: List[str] = None
         self.model: Optional[XGBRegressor] = None
+        self.delay_store: Optional[DelayAggregateStore] = None
+        self.weather_service: Optional[WeatherService] = None
+        self.supabase_client: Client = create_client(
+            settings.SUPABASE_URL, settings.SUPABASE_KEY
+        )
 
-    def preprocess_single_sample(self, data: Dict[str, Any]) -> pd.DataFrame:
-        """Preprocess a single sample for prediction"""
+    def preprocess_single_sample(
+        self,
+        data: Dict[str, Any],
+        stored: Optional[StoredFeatures] = None,
+    ) -> pd.DataFrame:
+        """
+        Preprocess a single sample for prediction, stored holds the rows
+        fetched for its batch by _fetch_features, fetched here if not given
+        """
         # Convert to DataFrame
         _df = pd.DataFrame([data])
 
         # Get features
-        _df = self._get_features(_df)
+        _df = self._get_features(_df, stored)
 
         # Apply the same preprocessing steps as training
         # _df = self._apply_preprocessing(_df)
@@ -75,41 +110,151 @@ class BasePredictor:
         logger.warning(f"No label encoder found for column: {col}")
         return [str(v) for v in values]
 
-    def _get_features(self, _df: pd.DataFrame) -> pd.DataFrame:
-        """Select features for prediction"""
-        supabase_client: Client = create_client(
-            settings.SUPABASE_URL, settings.SUPABASE_KEY
+    @staticmethod
+    def _feature_key(data: Dict[str, Any]) -> Optional[Tuple[str, str, int]]:
+        """Train, departure time and day of week of a sample, None if incomplete"""
+        values = [data.get(key) for key in ("train_id", "scheduled_departure_time")]
+        if any(value is None for value in values) or data.get("date") is None:
+            return None
+        day_of_week = int(pd.Timestamp(data["date"]).dayofweek)
+        return str(values[0]), _time_key(values[1]), day_of_week
+
+    def _fetch_features(self, samples: List[Dict[str, Any]]) -> StoredFeatures:
+        """
+        Stored features of several samples with one processed_data query,
+        paged until every sample has a row. Rows are ordered by key so that a
+        page boundary cannot skip the rows of a sample.
+        """
+        complete = [sample for sample in samples if self._feature_key(sample)]
+        if not complete:
+            return {}
+        keys = {self._feature_key(sample) for sample in complete}
+        columns = list(
+            dict.fromkeys(
+                self.features + ["current_station", "next_station"] + FEATURE_KEYS
+            )
         )
-        # get additional features from Supabase filter by train_id and scheduled_departure_time
+        train_ids = sorted({str(sample["train_id"]) for sample in complete})
+        times = sorted({str(sample["scheduled_departure_time"]) for sample in complete})
+        # A single sample needs a single row, as the old .limit(1) query
+        page_size = 1 if len(keys) == 1 else FEATURES_PAGE_SIZE
+        stored: StoredFeatures = {}
+        offset = 0
+        while True:
+            rows = (
+                self.supabase_client.table("processed_data")
+                .select(",".join(columns))
+                .in_("train_id", train_ids)
+                .in_("scheduled_departure_time", times)
+                .in_("day_of_week", sorted({key[2] for key in keys}))
+                .order("train_id")
+                .order("scheduled_departure_time")
+                .order("day_of_week")
+                .range(offset, offset + page_size - 1)
+                .execute()
+            ).data
+            for row in rows:
+                key = (
+                    str(row["train_id"]),
+                    _time_key(row["scheduled_departure_time"]),
+                    int(row["day_of_week"]),
+                )
+                stored.setdefault(key, row)
+            if len(rows) < page_size or keys <= stored.keys():
+                return stored
+            offset += page_size
+
+    def _get_features(
+        self,
+        _df: pd.DataFrame,
+        stored: Optional[StoredFeatures] = None,
+    ) -> pd.DataFrame:
+        """Select features for prediction"""
+        # get additional features from processed_data filter by train_id and scheduled_departure_time
         if "train_id" in _df.columns and "scheduled_departure_time" in _df.columns:
-            train_id = _df["train_id"].iloc[0]
+            sample = _df.iloc[0].to_dict()
+            if stored is None:
+                stored = self._fetch_features([sample])
+            key = self._feature_key(sample)
+            if key is None or key not in stored:
+                raise ValueError(
+                    f"Train {sample['train_id']} not found in processed_data for "
+                    f"departure {sample['scheduled_departure_time']} on "
+                    f"{sample.get('date')}"
+                )
             day = pd.to_datetime(_df["date"]).dt.day.iloc[0]
-            day_of_week = pd.to_datetime(_df["date"]).dt.dayofweek.iloc[0]
+            day_of_week = key[2]
             is_weekend = day_of_week >= 5
-            scheduled_departure_time = _df["scheduled_departure_time"].iloc[0]
-            columns = self.features + ["current_station", "next_station"]
-            response = (
-                supabase_client.table("processed_data")
-                .select(",".join(columns))
-                .eq("train_id", train_id)
-                .eq("scheduled_departure_time", scheduled_departure_time)
-                .eq("day_of_week", day_of_week)
-                .limit(1)
-                .execute()
-            )
-
-            if response.data:
-                additional_features = pd.DataFrame(response.data)
-                _df = pd.concat([_df, additional_features], axis=1)
-                _df["day"] = day
-                _df["day_of_week"] = day_of_week
-                _df["is_weekend"] = is_weekend
+            columns = dict.fromkeys(self.features + ["current_station", "next_station"])
+            additional_features = pd.DataFrame([stored[key]])[list(columns)]
+            _df = pd.concat([_df, additional_features], axis=1)
+            _df["day"] = day
+            _df["day_of_week"] = day_of_week
+            _df["is_weekend"] = is_weekend
+            if self.delay_store is not None:
+                _df = self._apply_online_features(_df)
+            if self.weather_service is not None:
+                _df = self._apply_live_weather(_df)
         else:
             logger.warning(
                 "train_id or scheduled_departure_time not found in input data"
             )
         return _df
 
+    def _decoded(self, _df: pd.DataFrame, col: str) -> Optional[str]:
+        """Label of an encoded categorical column, None if missing or unknown"""
+        if col not in _df.columns or pd.isna(_df[col].iloc[0]):
+            return None
+        try:
+            return self._decode_categorical([int(_df[col].iloc[0])], col)[0]
+        except ValueError:
+            logger.warning(f"Unknown category in {col}")
+            return None
+
+    def _apply_online_features(self, _df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replace stored rolling delay features with the online aggregates,
+        only for the keys the store has observed delays of
+        """
+        record = {
+            "train_id": _df["train_id"].iloc[0],
+            "departure_hour": departure_hour(_df["scheduled_departure_time"].iloc[0]),
+            "route": self._decoded(_df, "route"),
+            "current_station": self._decoded(_df, "current_station"),
+        }
+        for name, value in self.delay_store.features(
+            record, observed_only=True
+        ).items():
+            if name in self.features:
+                _df[name] = value
+        return _df
+
+    def _apply_live_weather(self, _df: pd.DataFrame) -> pd.DataFrame:
+        """Replace stored weather features with the cached live forecasts"""
+        current_station = self._decoded(_df, "current_station")
+        hour = departure_hour(_df["scheduled_departure_time"].iloc[0])
+        if current_station is None or hour is None:
+            return _df
+        trip_date = pd.Timestamp(_df["date"].iloc[0]).to_pydatetime()
+        departure = trip_date + timedelta(hours=hour)
+        arrival = None
+        if "arrival_hour" in _df.columns and not pd.isna(_df["arrival_hour"].iloc[0]):
+            arrival_hour = int(_df["arrival_hour"].iloc[0])
+            arrival = trip_date + timedelta(
+                days=int(arrival_hour < hour), hours=arrival_hour
+            )
+
+        features, stale = self.weather_service.features(
+            current_station, departure, self._decoded(_df, "next_station"), arrival
+        )
+        if stale:
+            logger.warning("Weather cache is stale, keeping stored weather features")
+            return _df
+        for name, value in features.items():
+            if name in self.features:
+                _df[name] = value
+        return _df
+
     def load_model(self, path: str):
         """Load a trained model"""
         try:
@@ -129,9 +274,13 @@ class BasePredictor:
 class SingleStationPredictor(BasePredictor):
     """Single station ahead delay prediction"""
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, label_encoders: Optional[Dict[str, LabelEncoder]] = None):
+        super().__init__(label_encoders)
         self.model: Optional[XGBRegressor] = None
+        self.cascade: Optional[Dict[str, Any]] = None
+        self.cascade_stats = {"rows": 0, "escalated": 0}
+        # Predictions run in worker threads (asyncio.to_thread in ModelService)
+        self._stats_lock = threading.Lock()
 
     def predict(self, data: Dict[str, Any]) -> Dict[str, float]:
         """Predict delay for next station"""
@@ -154,25 +303,178 @@ class SingleStationPredictor(BasePredictor):
             "next_station": self._decode_categorical([next_station], "next_station")[0],
         }
 
+    def load_cascade(self, path: str) -> None:
+        """Load the distilled tier answering first in cascade mode"""
+        try:
+            cascade = joblib.load(path)
+            if not isinstance(cascade, dict) or any(
+                key not in cascade for key in CASCADE_KEYS
+            ):
+                raise ValueError(f"Cascade at {path} is missing {CASCADE_KEYS}")
+            if list(cascade["features"]) != list(self.features):
+                raise ValueError(f"Cascade at {path} was trained on other features")
+            self.cascade = cascade
+            logger.info(f"Cascade loaded from {path}")
+        except Exception as _e:
+            logger.error(f"Failed to load cascade from {path}: {_e}")
+            raise
+
+    def cascade_predict(self, features: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Distilled tier predictions, with the rows it is not confident about or
+        that fall into flagged buckets predicted by the full model in one pass
+        """
+        # Arrays in feature order skip the DataFrame conversion of every call
+        values = features.to_numpy(dtype=np.float32)
+        predictions = self.cascade["fast"].predict(values, validate_features=False)
+        escalate = (
+            self.cascade["error"].predict(values, validate_features=False)
+            > self.cascade["error_threshold"]
+        )
+        for col, codes in self.cascade["flagged"].items():
+            if col in features.columns:
+                escalate |= features[col].isin(codes).to_numpy()
+        if escalate.any():
+            predictions[escalate] = self.model.predict(
+                values[escalate], validate_features=False
+            )
+        with self._stats_lock:
+            self.cascade_stats["rows"] += len(features)
+            self.cascade_stats["escalated"] += int(escalate.sum())
+        return np.maximum(predictions, 0), escalate
+
+    def cascade_counters(self) -> Dict[str, int]:
+        """Rows answered in cascade mode and rows escalated to the full model"""
+        with self._stats_lock:
+            return dict(self.cascade_stats)
+
+    def predict_batch(
+        self, data: List[Dict[str, Any]], cascade: bool = False
+    ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Predict delays of several samples with one features query and one
+        model call, the error of a sample that could not be preprocessed is
+        returned in its place
+        """
+        results: List[Union[Dict[str, Any], Exception]] = [None] * len(data)
+        try:
+            stored = self._fetch_features(data)
+        except Exception as _e:
+            logger.error(f"Failed to fetch the features of the batch: {_e}")
+            return [_e] * len(data)
+        indices, frames, current_stations, next_stations = [], [], [], []
+        for i, sample in enumerate(data):
+            try:
+                processed_data, current_station, next_station = (
+                    self.preprocess_single_sample(sample, stored)
+                )
+            except Exception as _e:
+                results[i] = _e
+                continue
+            indices.append(i)
+            frames.append(processed_data)
+            current_stations.append(current_station)
+            next_stations.append(next_station)
+        if not frames:
+            return results
+
+        features = pd.concat(frames, ignore_index=True)
+        escalated = None
+        if cascade and self.cascade is not None:
+            predictions, escalated = self.cascade_predict(features)
+        else:
+            predictions = np.maximum(self.model.predict(features), 0)
+        current_stations = self._decode_categorical(current_stations, "current_station")
+        next_stations = self._decode_categorical(next_stations, "next_station")
+        for row, i in enumerate(indices):
+            results[i] = {
+                "prediction": predictions[row],
+                "current_station": current_stations[row],
+                "next_station": next_stations[row],
+            }
+            # Only the cascade tells which rows the full model answered
+            if escalated is not None:
+                results[i]["escalated"] = bool(escalated[row])
+        return results
+
 
 class ModelEnsemble:
     """Ensemble of multiple prediction models"""
 
-    def __init__(self) -> None:
-        self.single_predictor = SingleStationPredictor()
+    def __init__(self, registry: "ModelRegistry") -> None:
+        self.registry = registry
+
+    @property
+    def single_predictor(self) -> SingleStationPredictor:
+        """Predictor of the default model"""
+        return self.registry.get(self.registry.default)
 
     def predict_ensemble(
-        self, data: Dict[str, Any], prediction_type: str = "single"
+        self,
+        data: Dict[str, Any],
+        prediction_type: str = "single",
+        attributes: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        """Make ensemble predictions"""
+        """
+        Make ensemble predictions with the model routed for the request. The
+        cascade type answers with the distilled tier of the model when it has
+        one, escalating to the full model when it is not confident.
+        """
         try:
+            name = self.registry.route({**data, **(attributes or {})})
             if prediction_type == "single":
-                return self.single_predictor.predict(data)
+                result = self.registry.get(name).predict(data)
+            elif prediction_type == "cascade":
+                result = self.registry.get(name).predict_batch([data], cascade=True)[0]
+                if isinstance(result, Exception):
+                    raise result
+            else:
+                raise ValueError(f"Unknown prediction type: {prediction_type}")
+            result["model"] = name
+            return result
         except Exception as _e:
             logger.error(f"Ensemble prediction failed: {_e}")
             raise
 
-    def load_all_models(self, model_paths: Dict[str, str]) -> None:
-        """Load all models from specified paths"""
-        if "single" in model_paths:
-            self.single_predictor.load_model(model_paths["single"])
+    def predict_ensemble_batch(
+        self,
+        data: List[Dict[str, Any]],
+        prediction_type: str = "single",
+        attributes: Optional[List[Dict[str, Any]]] = None,
+    ) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Make ensemble predictions for a batch, one model call per routed model.
+        Errors of single samples are returned in their place.
+        """
+        if prediction_type not in ("single", "cascade"):
+            raise ValueError(f"Unknown prediction type: {prediction_type}")
+        attributes = attributes or [{} for _ in data]
+        results: List[Union[Dict[str, Any], Exception]] = [None] * len(data)
+        groups: Dict[str, List[int]] = {}
+        for i, (sample, sample_attributes) in enumerate(zip(data, attributes)):
+            try:
+                name = self.registry.route({**sample, **sample_attributes})
+            except Exception as _e:
+                results[i] = _e
+                continue
+            groups.setdefault(name, []).append(i)
+
+        for name, indices in groups.items():
+            try:
+                group_results = self.registry.get(name).predict_batch(
+                    [data[i] for i in indices], cascade=prediction_type == "cascade"
+                )
+            except Exception as _e:
+                logger.error(f"Ensemble batch prediction failed: {_e}")
+                group_results = [_e] * len(indices)
+            for i, result in zip(indices, group_results):
+                if isinstance(result, dict):
+                    result["model"] = name
+                results[i] = result
+        return results
+
+    def load_all_models(self, names: Optional[List[str]] = None) -> None:
+        """Load models ahead of their first use, the default one if none given"""
+        for name in names or [self.registry.default]:
+            if name is not None:
+                self.registry.get(name)
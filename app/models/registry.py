@@ -0,0 +1,290 @@
+"""
+Registry of prediction models with lazy loading and memory-bounded eviction
+
+Models are described by manifest files (``*.manifest.json``) in a directory:
+
+    {
+        "name": "tnr-v3",
+        "version": "3",
+        "model_path": "TripsDelayXGBoostModel_3.joblib",
+        "encoders_path": "label_encoders_3.joblib",
+        "metrics_path": "TripsDelayXGBoostModel_metrics_3.json",
+        "cascade_path": "TripsDelayXGBoostModel_cascade_3.joblib",
+        "match": {"train_type": ["TNR"]},
+        "priority": 0,
+        "default": false
+    }
+
+Paths are relative to the manifest, the cascade (distilled tier) is
+optional. A request is served by the model whose ``match`` rules all hold
+for the request attributes (highest priority, then most rules first), by the
+model it names explicitly, or by the default model.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import joblib
+
+from core.logging import get_logger
+from models.predictors import SingleStationPredictor
+from services.profiler import rss_bytes
+
+logger = get_logger()
+
+MANIFEST_PATTERN = "*.manifest.json"
+
+
+def read_metrics(path: Optional[str]) -> Dict[str, Any]:
+    """Version, accuracy (r2) and error (MAE) from a model metrics file"""
+    metrics = {}
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as _f:
+                metrics = json.load(_f)
+        except (json.JSONDecodeError, FileNotFoundError, IOError):
+            metrics = {}
+    return {
+        "version": str(metrics.get("version", "1.0.0")),
+        "accuracy": round(metrics.get("r2", 0.0), 2),
+        "error": round(metrics.get("mae", 0.0), 2),
+    }
+
+
+@dataclass
+class ModelManifest:
+    """Artifacts and routing rules of one model"""
+
+    name: str
+    model_path: str
+    encoders_path: str
+    metrics_path: Optional[str] = None
+    cascade_path: Optional[str] = None
+    version: Optional[str] = None
+    # Request attribute -> accepted values, all rules must hold
+    match: Dict[str, List[str]] = field(default_factory=dict)
+    priority: int = 0
+    default: bool = False
+    accuracy: float = field(default=0.0, init=False)
+    error: float = field(default=0.0, init=False)
+
+    def __post_init__(self) -> None:
+        metrics = read_metrics(self.metrics_path)
+        self.version = str(self.version or metrics["version"])
+        self.accuracy = metrics["accuracy"]
+        self.error = metrics["error"]
+
+    @classmethod
+    def from_file(cls, path: str) -> "ModelManifest":
+        """Read a manifest, resolving artifact paths against its directory"""
+        with open(path, "r", encoding="utf-8") as _f:
+            data = json.load(_f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+
+        def resolve(value: Optional[str]) -> Optional[str]:
+            return os.path.normpath(os.path.join(base_dir, value)) if value else None
+
+        try:
+            return cls(
+                name=data["name"],
+                model_path=resolve(data["model_path"]),
+                encoders_path=resolve(data["encoders_path"]),
+                metrics_path=resolve(data.get("metrics_path")),
+                cascade_path=resolve(data.get("cascade_path")),
+                version=data.get("version"),
+                match={
+                    attribute: [
+                        str(v)
+                        for v in (values if isinstance(values, list) else [values])
+                    ]
+                    for attribute, values in data.get("match", {}).items()
+                },
+                priority=int(data.get("priority", 0)),
+                default=bool(data.get("default", False)),
+            )
+        except KeyError as _e:
+            raise ValueError(f"Manifest {path} is missing {_e}") from _e
+
+    def matches(self, attributes: Dict[str, Any]) -> bool:
+        """Whether every routing rule holds for the request attributes"""
+        return bool(self.match) and all(
+            attributes.get(attribute) is not None
+            and str(attributes[attribute]) in values
+            for attribute, values in self.match.items()
+        )
+
+
+@dataclass
+class ModelStats:
+    """Usage counters of one model"""
+
+    hits: int = 0
+    loads: int = 0
+    evictions: int = 0
+    load_seconds: Optional[float] = None
+    memory_bytes: int = 0
+    last_used: Optional[float] = None
+
+
+class ModelRegistry:
+    """Prediction models loaded on first use and evicted by least recent use"""
+
+    def __init__(
+        self,
+        manifests: List[ModelManifest],
+        memory_budget_bytes: Optional[int] = None,
+    ) -> None:
+        if not manifests:
+            raise ValueError("No model manifests given")
+        self.manifests: Dict[str, ModelManifest] = {}
+        for manifest in manifests:
+            if manifest.name in self.manifests:
+                raise ValueError(f"Duplicate model name: {manifest.name}")
+            self.manifests[manifest.name] = manifest
+
+        defaults = [m.name for m in manifests if m.default]
+        if len(defaults) > 1:
+            raise ValueError(f"Several default models: {', '.join(defaults)}")
+        if defaults:
+            self.default: Optional[str] = defaults[0]
+        else:
+            self.default = manifests[0].name if len(manifests) == 1 else None
+
+        self._rules = sorted(
+            (m for m in manifests if m.match),
+            key=lambda m: (-m.priority, -len(m.match), m.name),
+        )
+        self.memory_budget_bytes = memory_budget_bytes
+        self.shared: Dict[str, Any] = {}
+        # Encoders are small and shared by most models, they are never evicted
+        self._encoders: Dict[str, Any] = {}
+        self._loaded: "OrderedDict[str, SingleStationPredictor]" = OrderedDict()
+        self._stats = {name: ModelStats() for name in self.manifests}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @classmethod
+    def from_directory(
+        cls, path: str, memory_budget_bytes: Optional[int] = None
+    ) -> "ModelRegistry":
+        """Registry of the manifests found in a directory"""
+        files = sorted(glob.glob(os.path.join(path, MANIFEST_PATTERN)))
+        if not files:
+            raise FileNotFoundError(f"No model manifests found in {path}")
+        return cls([ModelManifest.from_file(f) for f in files], memory_budget_bytes)
+
+    def route(self, attributes: Dict[str, Any]) -> str:
+        """Name of the model serving a request"""
+        name = attributes.get("model")
+        if name:
+            if name not in self.manifests:
+                raise KeyError(f"Unknown model: {name}")
+            return name
+        for manifest in self._rules:
+            if manifest.matches(attributes):
+                return manifest.name
+        if self.default is None:
+            raise ValueError("No model matches the request and no default is set")
+        return self.default
+
+    def share(self, **attributes: Any) -> None:
+        """Set attributes on every loaded and future predictor"""
+        with self._lock:
+            self.shared.update(attributes)
+            for predictor in self._loaded.values():
+                for name, value in attributes.items():
+                    setattr(predictor, name, value)
+
+    def get(self, name: str) -> SingleStationPredictor:
+        """Predictor of a model, loaded on first use"""
+        if name not in self.manifests:
+            raise KeyError(f"Unknown model: {name}")
+        with self._lock:
+            if name in self._loaded:
+                return self._touch(name, hit=True)
+
+        # Loads are serialized so that the RSS delta belongs to one model
+        with self._load_lock:
+            with self._lock:
+                if name in self._loaded:
+                    return self._touch(name, hit=True)
+            predictor, seconds, memory = self._load(self.manifests[name])
+            with self._lock:
+                for attribute, value in self.shared.items():
+                    setattr(predictor, attribute, value)
+                stats = self._stats[name]
+                stats.loads += 1
+                stats.load_seconds = round(seconds, 4)
+                stats.memory_bytes = memory
+                self._loaded[name] = predictor
+                self._touch(name, hit=False)
+                self._evict(keep=name)
+        logger.info(
+            f"Model {name} loaded in {seconds:.2f}s ({memory / 1024**2:.1f} MB)"
+        )
+        return predictor
+
+    def _touch(self, name: str, hit: bool) -> SingleStationPredictor:
+        self._loaded.move_to_end(name)
+        stats = self._stats[name]
+        stats.hits += int(hit)
+        stats.last_used = time.time()
+        return self._loaded[name]
+
+    def _load(self, manifest: ModelManifest):
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        if manifest.encoders_path not in self._encoders:
+            self._encoders[manifest.encoders_path] = joblib.load(manifest.encoders_path)
+        predictor = SingleStationPredictor(self._encoders[manifest.encoders_path])
+        predictor.load_model(manifest.model_path)
+        if manifest.cascade_path:
+            predictor.load_cascade(manifest.cascade_path)
+        seconds = time.perf_counter() - start
+        # Other threads allocate too, the file size keeps the estimate sane
+        memory = max(rss_bytes() - rss_before, os.path.getsize(manifest.model_path))
+        return predictor, seconds, memory
+
+    def _evict(self, keep: str) -> None:
+        if self.memory_budget_bytes is None:
+            return
+        while self._resident_bytes() > self.memory_budget_bytes:
+            name = next(iter(self._loaded))
+            if name == keep:
+                break
+            del self._loaded[name]
+            self._stats[name].evictions += 1
+            logger.info(f"Model {name} evicted, memory budget exceeded")
+
+    def _resident_bytes(self) -> int:
+        return sum(self._stats[name].memory_bytes for name in self._loaded)
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded models, memory use and per model counters"""
+        with self._lock:
+            return {
+                "default": self.default,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "loaded": list(self._loaded),
+                "models": {
+                    name: {
+                        "version": manifest.version,
+                        "loaded": name in self._loaded,
+                        **asdict(self._stats[name]),
+                        "cascade": (
+                            self._loaded[name].cascade_counters()
+                            if name in self._loaded
+                            and self._loaded[name].cascade is not None
+                            else None
+                        ),
+                    }
+                    for name, manifest in self.manifests.items()
+                },
+            }
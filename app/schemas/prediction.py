@@ -5,6 +5,9 @@ Pydantic schemas for prediction requests and responses
 from datetime import datetime, date
 from enum import Enum
 from typing import List, Optional, Dict, Any
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
 
@@ -26,6 +29,15 @@ class TripBaseRequest(BaseModel):
         description="Scheduled departure time from the current station in HH:MM format",
     )
     trip_date: date = Field(..., description="Date of the trip in YYYY-MM-DD format")
+    train_type: Optional[str] = Field(
+        None, description="Type of the train, used to route to a specialised model"
+    )
+    route: Optional[str] = Field(
+        None, description="Route of the trip, used to route to a specialised model"
+    )
+    model: Optional[str] = Field(
+        None, description="Name of the model to use instead of the routed one"
+    )
 
 
 class SingleStationPredictionRequest(TripBaseRequest):
@@ -69,6 +81,7 @@ class SingleStationPredictionResponse(BaseModel):
     model_version: str
     model_accuracy: float
     model_error: float
+    model: Optional[str] = Field(None, description="Name of the model used")
 
 
 class BatchPredictionRequest(BaseModel):
@@ -84,12 +97,51 @@ class BatchPredictionRequest(BaseModel):
     )
 
 
+class BatchPredictionItem(BaseModel):
+    """Prediction of one batch item, model details are shared by the batch"""
+
+    train_id: str = Field(..., description="Unique identifier for the train")
+    result: PredictionResult
+    processing_time_ms: float = Field(
+        ..., description="Share of the batch time, items are predicted together"
+    )
+    model: Optional[str] = Field(None, description="Name of the model used")
+
+
+class ModelInfo(BaseModel):
+    """Version and metrics of a model"""
+
+    model_version: str
+    model_accuracy: float
+    model_error: float
+
+
+class ErrorResponse(BaseModel):
+    """Error response schema"""
+
+    error: str = Field(..., description="Error message")
+    error_code: str = Field(..., description="Error code")
+    details: Optional[Dict[str, Any]] = Field(
+        None, description="Additional error details"
+    )
+    timestamp: datetime = Field(
+        default_factory=datetime.now, description="Error timestamp"
+    )
+
+
 class BatchPredictionResponse(BaseModel):
     """Response for batch predictions"""
 
-    predictions: List[SingleStationPredictionResponse] = Field(
+    prediction_type: PredictionType = PredictionType.SINGLE_STATION
+    predictions: List[BatchPredictionItem] = Field(
         ..., description="List of prediction results"
     )
+    models: Dict[str, ModelInfo] = Field(
+        ..., description="Version and metrics of the models used, by model name"
+    )
+    errors: List[ErrorResponse] = Field(
+        default_factory=list, description="Failed items, with their item_index"
+    )
     total_processing_time_ms: float = Field(
         ..., description="Total processing time for batch predictions"
     )
@@ -99,14 +151,114 @@ class BatchPredictionResponse(BaseModel):
     failed_predictions: int = Field(..., description="Number of failed predictions")
 
 
-class ErrorResponse(BaseModel):
-    """Error response schema"""
+class DelayObservation(BaseModel):
+    """Observed delays of a subtrip, ingested into the online aggregates"""
 
-    error: str = Field(..., description="Error message")
-    error_code: str = Field(..., description="Error code")
-    details: Optional[Dict[str, Any]] = Field(
-        None, description="Additional error details"
+    train_id: str = Field(..., description="Unique identifier for the train")
+    route: Optional[str] = Field(None, description="Route of the trip")
+    current_station: Optional[str] = Field(
+        None, description="Station the subtrip departs from"
     )
-    timestamp: datetime = Field(
-        default_factory=datetime.now, description="Error timestamp"
+    scheduled_departure_time: str = Field(
+        ...,
+        description="Scheduled departure time from the current station in HH:MM format",
+    )
+    arrival_delay: Optional[float] = Field(
+        None, description="Observed arrival delay in minutes"
+    )
+    departure_delay: Optional[float] = Field(
+        None, description="Observed departure delay in minutes"
     )
+
+
+class DelayIngestRequest(BaseModel):
+    """Request for ingesting observed delays"""
+
+    observations: List[DelayObservation] = Field(
+        ..., description="Observed delays in chronological order"
+    )
+
+
+def batch_response_content(
+    train_ids: List[str],
+    departure_times: List[str],
+    delays: np.ndarray,
+    start_stations: List[Optional[str]],
+    next_stations: List[Optional[str]],
+    processing_times: np.ndarray,
+    model_names: List[str],
+    models: Dict[str, ModelInfo],
+    errors: List[ErrorResponse],
+    total_processing_time_ms: float,
+) -> Dict[str, Any]:
+    """
+    Batch response in the layout of BatchPredictionResponse, built from the
+    prediction arrays without validating the values computed by the models.
+    Delays are an (n, 2) array of arrival and departure delays.
+    """
+    delays = np.asarray(delays).reshape(-1, 2)
+    predictions = [
+        {
+            "train_id": train_id,
+            "result": {
+                "shcedule_departure_time": departure_time,
+                "arrival_delay": arrival_delay,
+                "departure_delay": departure_delay,
+                "start_station": start_station,
+                "next_station": next_station,
+            },
+            "processing_time_ms": processing_time,
+            "model": model_name,
+        }
+        for (
+            train_id,
+            departure_time,
+            arrival_delay,
+            departure_delay,
+            start_station,
+            next_station,
+            processing_time,
+            model_name,
+        ) in zip(
+            train_ids,
+            departure_times,
+            delays[:, 0].tolist(),
+            delays[:, 1].tolist(),
+            start_stations,
+            next_stations,
+            np.round(processing_times, 2).tolist(),
+            model_names,
+        )
+    ]
+    return {
+        "prediction_type": PredictionType.SINGLE_STATION,
+        "predictions": predictions,
+        "models": models,
+        "errors": errors,
+        "total_processing_time_ms": total_processing_time_ms,
+        "successful_predictions": len(predictions),
+        "failed_predictions": len(errors),
+    }
+
+
+def _encode_default(obj: Any) -> Any:
+    """Fields of trusted models and NumPy scalars, for orjson"""
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dump_json(content: Any) -> bytes:
+    """Serialize responses built with model_construct or from NumPy arrays"""
+    return orjson.dumps(
+        content, default=_encode_default, option=orjson.OPT_SERIALIZE_NUMPY
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response skipping response model validation and jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
@@ -0,0 +1,280 @@
+"""
+Online rolling delay aggregates for real-time features
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+TARGETS = ("arrival_delay", "departure_delay")
+
+# Feature names used by the model selection notebook
+DEFAULT_TEMPLATES = {
+    "avg": "{name}_avg_{window}day_{target}",
+    "median": "{name}_median_{window}day_{target}",
+    "std": "{name}_std_{window}day_{target}",
+    "max": "{name}_max_{window}day_{target}",
+    "min": "{name}_min_{window}day_{target}",
+    "count": "{name}_count_{window}day_{target}",
+    "ewm": "{name}_ewm_{span}days_{target}",
+}
+
+# Decimals of the statistics rounded by experiments/scripts/model_features.py
+ROUNDED_STATS = {"avg": 2, "std": 2, "ewm": 2}
+
+
+@dataclass
+class RollingSpec:
+    """Rolling window over the last delays observed for one key"""
+
+    name: str
+    keys: Tuple[str, ...]
+    window: int = 7
+    # Offset of the newest subtrip in the window (1 = the previous subtrip)
+    lag: int = 1
+    ewm_span: Optional[int] = None
+    stats: Tuple[str, ...] = ("avg", "count", "max")
+    templates: Dict[str, str] = field(default_factory=dict)
+
+    def feature_name(self, stat: str, target: str) -> str:
+        """Name of the feature holding a statistic of a target"""
+        template = self.templates.get(stat, DEFAULT_TEMPLATES[stat])
+        return template.format(
+            name=self.name, window=self.window, span=self.ewm_span, target=target
+        )
+
+
+DEFAULT_SPECS = [
+    # shift(1).rolling(7, closed="left") in the notebook leaves out two rows
+    RollingSpec(
+        "route_station",
+        ("route", "current_station"),
+        lag=2,
+        ewm_span=7,
+        stats=("avg", "median", "std", "max", "min", "count"),
+    ),
+    RollingSpec(
+        "route_hour_pattern",
+        ("route", "departure_hour"),
+        stats=("avg",),
+        templates={"avg": "{name}_rolling_{target}"},
+    ),
+    RollingSpec("station_hour", ("current_station", "departure_hour")),
+    RollingSpec("train_hour", ("train_id", "departure_hour")),
+]
+
+
+def departure_hour(scheduled_departure_time: Any) -> Optional[int]:
+    """Hour of a HH:MM[:SS] time or of a timestamp"""
+    if scheduled_departure_time is None or pd.isna(scheduled_departure_time):
+        return None
+    if hasattr(scheduled_departure_time, "hour"):
+        return int(scheduled_departure_time.hour)
+    text = str(scheduled_departure_time).strip()
+    return int(text.split(" ")[-1].split("T")[-1].split(":")[0])
+
+
+def _normalize(value: Any) -> Any:
+    """Make keys from requests and from history compare equal (8, 8.0, "8")"""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+class _RollingTable:
+    """Ring buffers and EWM state of one RollingSpec, one slot per key"""
+
+    def __init__(self, spec: RollingSpec, capacity: int = 64) -> None:
+        self.spec = spec
+        self.size = spec.window + spec.lag - 1
+        self.slots: Dict[Tuple[str, ...], int] = {}
+        self.buffer = np.full((capacity, len(TARGETS), self.size), np.nan, np.float32)
+        self.observed = np.zeros(capacity, np.int64)
+        self.ewm_num = np.zeros((capacity, len(TARGETS)))
+        self.ewm_den = np.zeros((capacity, len(TARGETS)))
+        self.decay = 1 - 2 / (spec.ewm_span + 1) if spec.ewm_span else None
+
+    def _slot(self, key: Tuple[str, ...]) -> int:
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = len(self.slots)
+            if slot == len(self.observed):
+                self._grow()
+            self.slots[key] = slot
+        return slot
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.observed)
+        buffer = np.full((capacity, len(TARGETS), self.size), np.nan, np.float32)
+        buffer[: len(self.buffer)] = self.buffer
+        self.buffer = buffer
+        self.observed = np.resize(self.observed, capacity)
+        self.observed[len(self.slots) :] = 0
+        for name in ("ewm_num", "ewm_den"):
+            state = np.zeros((capacity, len(TARGETS)))
+            state[: len(self.slots)] = getattr(self, name)[: len(self.slots)]
+            setattr(self, name, state)
+
+    def ingest(self, key: Tuple[str, ...], values: np.ndarray) -> None:
+        slot = self._slot(key)
+        self.buffer[slot, :, self.observed[slot] % self.size] = values
+        self.observed[slot] += 1
+        if self.decay is not None:
+            # pandas ewm(adjust=True, ignore_na=False): missing values still decay
+            present = ~np.isnan(values)
+            self.ewm_num[slot] = self.ewm_num[slot] * self.decay + np.where(
+                present, values, 0
+            )
+            self.ewm_den[slot] = self.ewm_den[slot] * self.decay + present
+
+    def read(self, key: Tuple[str, ...]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """
+        Statistics per target, NaN (count 0) when nothing was observed, and
+        the number of observed delays in the window per target.
+        """
+        stats = {stat: np.full(len(TARGETS), np.nan) for stat in self.spec.stats}
+        if "count" in stats:
+            stats["count"][:] = 0
+        if self.decay is not None:
+            stats["ewm"] = np.full(len(TARGETS), np.nan)
+        counts = np.zeros(len(TARGETS), np.int64)
+
+        slot = self.slots.get(key)
+        if slot is None:
+            return stats, counts
+        if self.decay is not None:
+            den = self.ewm_den[slot]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stats["ewm"] = np.where(den > 0, self.ewm_num[slot] / den, np.nan)
+
+        # Features are read before the delays of the current subtrip are known
+        available = self.observed[slot] - (self.spec.lag - 1)
+        if available <= 0:
+            return stats, counts
+        newest = available - 1
+        positions = np.arange(newest, newest - min(self.spec.window, available), -1)
+        values = self.buffer[slot][:, positions % self.size].astype(np.float64)
+
+        for target in range(len(TARGETS)):
+            window = values[target][~np.isnan(values[target])]
+            counts[target] = len(window)
+            if "count" in stats:
+                stats["count"][target] = len(window)
+            if len(window) == 0:
+                continue
+            for stat in self.spec.stats:
+                if stat == "avg":
+                    stats[stat][target] = window.mean()
+                elif stat == "median":
+                    stats[stat][target] = np.median(window)
+                elif stat == "std" and len(window) > 1:
+                    stats[stat][target] = window.std(ddof=1)
+                elif stat == "max":
+                    stats[stat][target] = window.max()
+                elif stat == "min":
+                    stats[stat][target] = window.min()
+        return stats, counts
+
+
+class DelayAggregateStore:
+    """Rolling delay aggregates per route, station, train and hour"""
+
+    def __init__(self, specs: Optional[List[RollingSpec]] = None) -> None:
+        self.specs = specs or DEFAULT_SPECS
+        self.tables = [_RollingTable(spec) for spec in self.specs]
+        self.ingested = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(spec: RollingSpec, record: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+        values = [record.get(column) for column in spec.keys]
+        if any(value is None or pd.isna(value) for value in values):
+            return None
+        return tuple(_normalize(value) for value in values)
+
+    def ingest(self, record: Dict[str, Any]) -> None:
+        """Add the observed delays of one subtrip"""
+        values = np.array(
+            [
+                np.nan if pd.isna(record.get(target)) else record[target]
+                for target in TARGETS
+            ],
+            dtype=np.float64,
+        )
+        with self._lock:
+            for spec, table in zip(self.specs, self.tables):
+                key = self._key(spec, record)
+                if key is not None:
+                    table.ingest(key, values)
+            self.ingested += 1
+
+    def ingest_frame(self, df: pd.DataFrame) -> None:
+        """Add the observed delays of subtrips, in chronological order"""
+        columns = sorted(
+            {column for spec in self.specs for column in spec.keys} | set(TARGETS)
+        )
+        for record in df[[c for c in columns if c in df.columns]].to_dict("records"):
+            self.ingest(record)
+
+    def features(
+        self, record: Dict[str, Any], observed_only: bool = False
+    ) -> Dict[str, float]:
+        """
+        Current rolling features for the keys of a record.
+
+        Specs whose key columns are missing from the record are skipped, and
+        with observed_only so are the targets without any observed delay in
+        the window (or for the EWM) of the key.
+        """
+        features = {}
+        with self._lock:
+            for spec, table in zip(self.specs, self.tables):
+                key = self._key(spec, record)
+                if key is None:
+                    continue
+                stats, counts = table.read(key)
+                for stat, values in stats.items():
+                    for target, value, count in zip(TARGETS, values, counts):
+                        if observed_only and (
+                            np.isnan(value) if stat == "ewm" else count == 0
+                        ):
+                            continue
+                        if stat in ROUNDED_STATS:
+                            value = np.round(value, ROUNDED_STATS[stat])
+                        features[spec.feature_name(stat, target)] = float(value)
+        return features
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of keys per spec and ingested observations"""
+        return {
+            "ingested": self.ingested,
+            "keys": {
+                spec.name: len(t.slots) for spec, t in zip(self.specs, self.tables)
+            },
+        }
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def save(self, path: str) -> None:
+        """Persist the store with joblib"""
+        with self._lock:
+            joblib.dump(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DelayAggregateStore":
+        """Load a store saved with save()"""
+        store = joblib.load(path)
+        if not isinstance(store, cls):
+            raise ValueError(f"Object at {path} is not a DelayAggregateStore instance")
+        return store
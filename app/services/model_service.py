@@ -2,18 +2,30 @@
 Model service for handling model loading and predictions
 """
 
+import asyncio
 import logging
 import time
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional
 import os
 
+import numpy as np
+
 from models.predictors import ModelEnsemble
+from models.registry import ModelManifest, ModelRegistry
 from core.config import settings
 from schemas.prediction import (
+    DelayObservation,
+    ErrorResponse,
+    ModelInfo,
+    PredictionType,
     SingleStationPredictionRequest,
     SingleStationPredictionResponse,
     PredictionResult,
+    batch_response_content,
 )
+from services.delay_store import DelayAggregateStore, departure_hour
+from services.weather_service import WeatherService, load_stations
 
 logger = logging.getLogger(__name__)
 
@@ -22,34 +34,54 @@ class ModelService:
     """Service for managing ML models and predictions"""
 
     def __init__(self):
-        self.ensemble = ModelEnsemble()
+        self.registry: Optional[ModelRegistry] = None
+        self.ensemble: Optional[ModelEnsemble] = None
         self.models_loaded = False
-        self.model_version = settings.MODEL_VERSION
-        self.model_accuracy = settings.MODEL_ACCURACY
-        self.model_error = settings.MODEL_ERROR
+        self.delay_store = None
+        self.weather_service = None
+        self.prediction_type = "cascade" if settings.CASCADE_ENABLED else "single"
+
+    @property
+    def default_manifest(self) -> Optional[ModelManifest]:
+        """Manifest of the model serving requests without routing attributes"""
+        if self.registry is None or self.registry.default is None:
+            return None
+        return self.registry.manifests[self.registry.default]
+
+    @property
+    def model_version(self) -> str:
+        """Version of the default model, from settings before loading"""
+        manifest = self.default_manifest
+        return manifest.version if manifest else settings.MODEL_VERSION
+
+    @property
+    def model_accuracy(self) -> float:
+        """Accuracy (r2) of the default model, from settings before loading"""
+        manifest = self.default_manifest
+        return manifest.accuracy if manifest else settings.MODEL_ACCURACY
+
+    @property
+    def model_error(self) -> float:
+        """Error (MAE) of the default model, from settings before loading"""
+        manifest = self.default_manifest
+        return manifest.error if manifest else settings.MODEL_ERROR
 
     async def load_models(self):
         """Load all ML models"""
         try:
             logger.info("Starting model loading...")
-            model_paths = {
-                "single": settings.SINGLE_STATION_MODEL_PATH,
-            }
+            self.registry = self._create_registry()
+            self.ensemble = ModelEnsemble(self.registry)
+            # Other models are loaded on their first request
+            self.ensemble.load_all_models()
+            logger.info(
+                f"Registered {len(self.registry.manifests)} models successfully"
+            )
 
-            existing_models = {}
-            for model_type, path in model_paths.items():
-                if os.path.exists(path):
-                    existing_models[model_type] = path
-                    logger.info(f"Found {model_type} model at {path}")
-                else:
-                    logger.warning(f"Model file not found: {path}")
-
-            if existing_models:
-                self.ensemble.load_all_models(existing_models)
-                logger.info(f"Loaded {len(existing_models)} models successfully")
-            else:
-                logger.error("No valid model files found")
-                raise FileNotFoundError("No valid model files found")
+            if settings.DELAY_STORE_PATH:
+                self.load_delay_store(settings.DELAY_STORE_PATH)
+            if settings.WEATHER_STATIONS_PATH:
+                self.start_weather_service(settings.WEATHER_STATIONS_PATH)
 
             self.models_loaded = True
             logger.info("Model loading completed successfully")
@@ -59,6 +91,71 @@ class ModelService:
             self.models_loaded = False
             raise RuntimeError(f"Model loading failed: {_e}")
 
+    def _create_registry(self) -> ModelRegistry:
+        """Registry of the manifest directory, or of the single configured model"""
+        budget = None
+        if settings.MODEL_MEMORY_BUDGET_MB:
+            budget = int(settings.MODEL_MEMORY_BUDGET_MB * 1024**2)
+        if settings.MODEL_REGISTRY_DIR:
+            return ModelRegistry.from_directory(settings.MODEL_REGISTRY_DIR, budget)
+
+        if not os.path.exists(settings.SINGLE_STATION_MODEL_PATH):
+            logger.error("No valid model files found")
+            raise FileNotFoundError("No valid model files found")
+        logger.info(f"Found single model at {settings.SINGLE_STATION_MODEL_PATH}")
+        manifest = ModelManifest(
+            name="single",
+            model_path=settings.SINGLE_STATION_MODEL_PATH,
+            encoders_path=settings.ENCODER_PATH,
+            metrics_path=settings.METRICS_JSON,
+            cascade_path=settings.CASCADE_MODEL_PATH,
+            default=True,
+        )
+        return ModelRegistry([manifest], budget)
+
+    def load_delay_store(self, path: str) -> None:
+        """Load the online delay aggregates, or start an empty store"""
+        if os.path.exists(path):
+            self.delay_store = DelayAggregateStore.load(path)
+            logger.info(f"Delay store loaded from {path}: {self.delay_store.stats()}")
+        else:
+            self.delay_store = DelayAggregateStore()
+            logger.warning(
+                f"Delay store not found at {path}, starting empty: stored rolling "
+                "features are served until delays are ingested"
+            )
+        self.registry.share(delay_store=self.delay_store)
+
+    def start_weather_service(self, stations_path: str) -> None:
+        """Start refreshing live weather forecasts in the background"""
+        self.weather_service = WeatherService(
+            load_stations(stations_path),
+            api_url=settings.WEATHER_API_URL,
+            refresh_seconds=settings.WEATHER_REFRESH_SECONDS,
+        )
+        self.weather_service.start()
+        self.registry.share(weather_service=self.weather_service)
+        logger.info(
+            f"Weather service started for {len(self.weather_service.stations)} stations"
+        )
+
+    def shutdown(self) -> None:
+        """Stop background tasks"""
+        if self.weather_service is not None:
+            self.weather_service.stop()
+
+    def ingest_delays(self, observations: List[DelayObservation]) -> Dict[str, Any]:
+        """Update the online delay aggregates with observed delays"""
+        if self.delay_store is None:
+            raise RuntimeError("Delay store not enabled")
+        for observation in observations:
+            record = observation.model_dump()
+            record["departure_hour"] = departure_hour(
+                observation.scheduled_departure_time
+            )
+            self.delay_store.ingest(record)
+        return {"ingested": len(observations), "store": self.delay_store.stats()}
+
     def _convert_request_to_dict(self, request: Any) -> Dict[str, Any]:
         """Convert Pydantic request to dictionary for model input"""
         try:
@@ -77,6 +174,25 @@ class ModelService:
             logger.error(f"Failed to convert request to dict: {_e}")
             raise ValueError(f"Invalid request format: {_e}")
 
+    def _routing_attributes(self, request: Any) -> Dict[str, Any]:
+        """Request attributes used to pick the serving model"""
+        return {
+            "train_type": getattr(request, "train_type", None),
+            "route": getattr(request, "route", None),
+            "model": getattr(request, "model", None),
+        }
+
+    def _predict(self, request: SingleStationPredictionRequest) -> Dict[str, Any]:
+        """Raw prediction of the model routed for a request"""
+        # Convert request to model input
+        input_data = self._convert_request_to_dict(request)
+        # Make prediction using ensemble
+        if self.ensemble:
+            return self.ensemble.predict_ensemble(
+                input_data, self.prediction_type, self._routing_attributes(request)
+            )
+        raise RuntimeError("Model ensemble not initialized")
+
     async def predict_single_station(
         self, request: SingleStationPredictionRequest
     ) -> SingleStationPredictionResponse:
@@ -85,41 +201,118 @@ class ModelService:
             raise RuntimeError("Models not loaded")
         start_time = time.perf_counter()
         try:
-            # Convert request to model input
-            input_data = self._convert_request_to_dict(request)
-            # Make prediction using ensemble
-            if self.ensemble:
-                prediction_result = self.ensemble.predict_ensemble(input_data, "single")
-            else:
-                raise RuntimeError("Model ensemble not initialized")
+            # Feature queries and model calls run off the event loop
+            prediction_result = await asyncio.to_thread(self._predict, request)
+            manifest = self.registry.manifests[prediction_result["model"]]
+            arrival_delay, departure_delay = prediction_result["prediction"].tolist()
             processing_time = round((time.perf_counter() - start_time) * 1000, 2)
 
-            result = PredictionResult(
+            # Values come from the model, validating them again is pure overhead
+            result = PredictionResult.model_construct(
                 shcedule_departure_time=request.scheduled_departure_time,
-                arrival_delay=prediction_result["prediction"][0],
-                departure_delay=prediction_result["prediction"][1],
+                arrival_delay=arrival_delay,
+                departure_delay=departure_delay,
                 start_station=prediction_result["current_station"],
                 next_station=prediction_result["next_station"],
             )
 
-            return SingleStationPredictionResponse(
-                train_id=request.train_id,
+            return SingleStationPredictionResponse.model_construct(
+                prediction_type=PredictionType.SINGLE_STATION,
                 result=result,
                 processing_time_ms=processing_time,
-                model_version=self.model_version,
-                model_accuracy=self.model_accuracy,
-                model_error=self.model_error,
+                model_version=manifest.version,
+                model_accuracy=manifest.accuracy,
+                model_error=manifest.error,
+                model=manifest.name,
             )
 
         except Exception as _e:
             logger.error(f"Single station prediction failed: {_e}")
             raise RuntimeError(f"Prediction failed: {_e}") from _e
 
+    async def predict_batch(self, predictions: List[dict]) -> Dict[str, Any]:
+        """Predict a batch of requests, failed items are reported as errors"""
+        if not self.models_loaded:
+            raise RuntimeError("Models not loaded")
+        if not self.ensemble:
+            raise RuntimeError("Model ensemble not initialized")
+        start_time = time.perf_counter()
+
+        def error(index: int, _e: Exception) -> ErrorResponse:
+            logger.error(f"Batch prediction item {index} failed: {_e}")
+            return ErrorResponse.model_construct(
+                error=str(_e),
+                error_code="PREDICTION_FAILED",
+                details={"item_index": index},
+                timestamp=datetime.now(),
+            )
+
+        indices, requests, errors = [], [], []
+        for i, item in enumerate(predictions):
+            try:
+                # Inbound items are still validated by the public schema
+                requests.append(SingleStationPredictionRequest.model_validate(item))
+                indices.append(i)
+            except Exception as _e:
+                errors.append(error(i, _e))
+
+        # One model call per routed model for the whole batch
+        outputs = await asyncio.to_thread(
+            self.ensemble.predict_ensemble_batch,
+            [self._convert_request_to_dict(request) for request in requests],
+            self.prediction_type,
+            [self._routing_attributes(request) for request in requests],
+        )
+        results, predicted = [], []
+        for i, request, output in zip(indices, requests, outputs):
+            if isinstance(output, Exception):
+                errors.append(error(i, output))
+            else:
+                results.append(output)
+                predicted.append(request)
+        requests = predicted
+        errors.sort(key=lambda e: e.details["item_index"])
+        total_time = (time.perf_counter() - start_time) * 1000
+        # Items share the model calls, each is given its share of the time
+        processing_times = np.full(len(results), total_time / max(len(predictions), 1))
+
+        model_names = [result["model"] for result in results]
+        models = {}
+        for name in set(model_names):
+            manifest = self.registry.manifests[name]
+            models[name] = ModelInfo.model_construct(
+                model_version=manifest.version,
+                model_accuracy=manifest.accuracy,
+                model_error=manifest.error,
+            )
+        delays = (
+            np.vstack([result["prediction"] for result in results])
+            if results
+            else np.empty((0, 2))
+        )
+        return batch_response_content(
+            train_ids=[request.train_id for request in requests],
+            departure_times=[request.scheduled_departure_time for request in requests],
+            delays=delays,
+            start_stations=[result["current_station"] for result in results],
+            next_stations=[result["next_station"] for result in results],
+            processing_times=np.asarray(processing_times),
+            model_names=model_names,
+            models=models,
+            errors=errors,
+            total_processing_time_ms=total_time,
+        )
+
     async def health_check(self) -> Dict[str, Any]:
         """Check service health"""
-        return {
+        health = {
             "status": "healthy" if self.models_loaded else "unhealthy",
             "models_loaded": self.models_loaded,
             "model_version": self.model_version,
             "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
         }
+        if self.registry is not None:
+            health["models"] = self.registry.stats()
+        if self.weather_service is not None:
+            health["weather"] = self.weather_service.status()
+        return health
@@ -0,0 +1,276 @@
+"""
+On-demand CPU and allocation profiling of the running worker
+"""
+
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+# Leaf frames of threads blocked waiting for work, left out of the samples
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def rss_bytes() -> int:
+    """Resident set size of the process"""
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as _f:
+            return int(_f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # Peak instead of current RSS where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _frame_label(code) -> str:
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of all other threads at a fixed interval"""
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64) -> None:
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                leaf = frame.f_code
+                if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        """Start sampling in a background thread"""
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop sampling"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format of flamegraph.pl and speedscope"""
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        )
+
+    def top_functions(self, limit: int = 30) -> List[Dict[str, Any]]:
+        """Functions with the most samples on top of the stack"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        busy = sum(self.stacks.values()) or 1
+        return [
+            {
+                "function": function,
+                "self_samples": own[function],
+                "total_samples": total[function],
+                "self_pct": round(100 * own[function] / busy, 2),
+                "total_pct": round(100 * total[function] / busy, 2),
+            }
+            for function in sorted(total, key=lambda f: (-own[f], -total[f]))[:limit]
+        ]
+
+
+def cprofile_top_functions(
+    profile: cProfile.Profile, limit: int = 30
+) -> List[Dict[str, Any]]:
+    """Functions with the most own time in a cProfile capture"""
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in pstats.Stats(
+        profile
+    ).stats.items():
+        rows.append(
+            {
+                "function": f"{name} ({os.path.basename(filename)}:{line})",
+                "calls": calls,
+                "self_seconds": round(own, 6),
+                "total_seconds": round(cumulative, 6),
+            }
+        )
+    rows.sort(key=lambda row: -row["self_seconds"])
+    return rows[:limit]
+
+
+def allocation_diff(
+    before: tracemalloc.Snapshot,
+    after: tracemalloc.Snapshot,
+    requests: int,
+    limit: int = 30,
+) -> List[Dict[str, Any]]:
+    """Lines whose allocated memory grew the most between two snapshots"""
+    # Leave out the allocations of the profilers themselves, filtering the
+    # per-line statistics rather than every trace (Snapshot.filter_traces)
+    excluded = {tracemalloc.__file__, cProfile.__file__, pstats.__file__, __file__}
+    diff = [
+        stat
+        for stat in after.compare_to(before, "lineno")
+        if stat.traceback[0].filename not in excluded
+    ]
+    return [
+        {
+            "location": str(stat.traceback),
+            "size_diff_bytes": stat.size_diff,
+            "count_diff": stat.count_diff,
+            "size_diff_per_request_bytes": (
+                round(stat.size_diff / requests, 1) if requests else None
+            ),
+        }
+        for stat in diff[:limit]
+    ]
+
+
+class WorkerProfiler:
+    """Runs one capture at a time on the worker serving the request"""
+
+    def __init__(self, max_seconds: float = 60) -> None:
+        self.max_seconds = max_seconds
+        self.requests = 0
+        self.active = False
+        self._lock = threading.Lock()
+
+    def request_done(self) -> None:
+        """Count a finished prediction request while a capture runs"""
+        if self.active:
+            self.requests += 1
+
+    async def capture(
+        self,
+        seconds: Optional[float] = None,
+        requests: Optional[int] = None,
+        mode: str = "sampling",
+        interval_ms: float = 10,
+        trace_allocations: bool = False,
+        top: int = 30,
+    ) -> Dict[str, Any]:
+        """
+        Profile the worker for a duration or until a number of prediction
+        requests finished, whichever comes first.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        if seconds is not None and seconds > self.max_seconds:
+            raise ValueError(f"Captures are limited to {self.max_seconds} seconds")
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A capture is already running")
+
+        started_tracing = False
+        try:
+            if trace_allocations:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    started_tracing = True
+                # Snapshots and the diff walk the whole heap, they run in a
+                # worker thread and outside the measured window
+                snapshot_start = time.perf_counter()
+                before = await asyncio.to_thread(tracemalloc.take_snapshot)
+                snapshot_seconds = time.perf_counter() - snapshot_start
+
+            sampler, profile = None, None
+            if mode == "sampling":
+                sampler = SamplingProfiler(interval_ms / 1000)
+                sampler.start()
+            else:
+                # Profiles the event loop thread, where the prediction handlers run
+                profile = cProfile.Profile()
+                profile.enable()
+
+            self.requests = 0
+            self.active = True
+            start = time.perf_counter()
+            deadline = start + (seconds or self.max_seconds)
+            try:
+                while time.perf_counter() < deadline and (
+                    requests is None or self.requests < requests
+                ):
+                    await asyncio.sleep(0.05)
+            finally:
+                self.active = False
+                if sampler is not None:
+                    sampler.stop()
+                if profile is not None:
+                    profile.disable()
+            elapsed = time.perf_counter() - start
+
+            result = {
+                "mode": mode,
+                "seconds": round(elapsed, 3),
+                "requests": self.requests,
+            }
+            if sampler is not None:
+                result["interval_ms"] = interval_ms
+                result["samples"] = sampler.samples
+                result["top_functions"] = sampler.top_functions(top)
+                result["collapsed"] = sampler.collapsed()
+            else:
+                result["top_functions"] = cprofile_top_functions(profile, top)
+                result["collapsed"] = None
+
+            if trace_allocations:
+                snapshot_start = time.perf_counter()
+                after = await asyncio.to_thread(tracemalloc.take_snapshot)
+                snapshot_seconds += time.perf_counter() - snapshot_start
+                diff_start = time.perf_counter()
+                result["allocations"] = await asyncio.to_thread(
+                    allocation_diff, before, after, self.requests, top
+                )
+                result["allocation_overhead"] = {
+                    "snapshot_seconds": round(snapshot_seconds, 3),
+                    "diff_seconds": round(time.perf_counter() - diff_start, 3),
+                    "tracemalloc_memory_bytes": tracemalloc.get_tracemalloc_memory(),
+                    "note": (
+                        "Tracing slows every allocation during the capture; "
+                        "snapshots hold the GIL while copying the traces"
+                    ),
+                }
+                del before, after
+            logger.info(
+                f"Profile capture ({mode}) finished: {elapsed:.1f}s, "
+                f"{self.requests} requests"
+            )
+            return result
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self._lock.release()
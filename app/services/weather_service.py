@@ -0,0 +1,267 @@
+"""
+Live weather features cached per station and hour
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Open-Meteo hourly variables requested by experiments/scripts/get_weather.py,
+# mapped to the feature names used in trips_data
+WEATHER_VARIABLES = {
+    "temperature_2m": "temperature",
+    "relative_humidity_2m": "relative_humidity",
+    "dew_point_2m": "dew_point",
+    "apparent_temperature": "apparent_temperature",
+    "precipitation": "precipitation",
+    "visibility": "visibility",
+    "wind_speed_10m": "wind_speed",
+    "wind_direction_10m": "wind_direction",
+    "wind_gusts_10m": "wind_gusts",
+    "uv_index": "uv_index",
+    "cloud_cover": "cloud_cover",
+    "surface_pressure": "surface_pressure",
+}
+
+# Same thresholds as create_weather_features in the model selection notebook
+WEATHER_THRESHOLDS = {
+    "moderate_rain": 2,  # mm
+    "strong_wind": 20,  # km/h
+    "poor_visibility": 1000,  # meters
+    "extreme_temp_low": -5,  # Celsius
+    "extreme_temp_high": 35,  # Celsius
+}
+
+TIMEZONE = "Africa/Casablanca"
+
+
+def load_stations(path: str) -> List[Tuple[str, float, float]]:
+    """Read (name, latitude, longitude) from the stations info.csv"""
+    stations = pd.read_csv(path, encoding="utf-8")
+    return [
+        (
+            row.NomGareFr,
+            float(str(row.Latitude).replace(",", ".")),
+            float(str(row.Longitude).replace(",", ".")),
+        )
+        for row in stations.itertuples()
+    ]
+
+
+def weather_flags(departure: Dict[str, float]) -> Dict[str, int]:
+    """Binary weather condition features from the weather on departure"""
+    temperature = departure["temperature"]
+    return {
+        "moderate_rain": int(
+            departure["precipitation"] > WEATHER_THRESHOLDS["moderate_rain"]
+        ),
+        "strong_wind": int(departure["wind_speed"] > WEATHER_THRESHOLDS["strong_wind"]),
+        "poor_visibility": int(
+            departure["visibility"] < WEATHER_THRESHOLDS["poor_visibility"]
+        ),
+        "extreme_temp": int(
+            temperature < WEATHER_THRESHOLDS["extreme_temp_low"]
+            or temperature > WEATHER_THRESHOLDS["extreme_temp_high"]
+        ),
+    }
+
+
+class WeatherService:
+    """Hourly forecasts of every station in a stations x hours x variables array"""
+
+    def __init__(
+        self,
+        stations: List[Tuple[str, float, float]],
+        api_url: str = "https://api.open-meteo.com/v1/forecast",
+        refresh_seconds: int = 3600,
+        past_days: int = 1,
+        forecast_days: int = 2,
+        batch_size: int = 50,
+        timeout: float = 30.0,
+    ) -> None:
+        self.stations = stations
+        self.station_index = {name: i for i, (name, _, _) in enumerate(stations)}
+        self.variables = list(WEATHER_VARIABLES.values())
+        self.api_url = api_url
+        self.refresh_seconds = refresh_seconds
+        self.past_days = past_days
+        self.forecast_days = forecast_days
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+        # Swapped as a whole on refresh, so reads never see a partial update
+        self._table: Optional[Tuple[datetime, np.ndarray]] = None
+        self.refreshed_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _fetch_batch(
+        self, stations: List[Tuple[str, float, float]]
+    ) -> List[Dict[str, Any]]:
+        params = {
+            "latitude": ",".join(str(latitude) for _, latitude, _ in stations),
+            "longitude": ",".join(str(longitude) for _, _, longitude in stations),
+            "hourly": ",".join(WEATHER_VARIABLES),
+            "timezone": TIMEZONE,
+            "past_days": self.past_days,
+            "forecast_days": self.forecast_days,
+        }
+        with urlopen(
+            f"{self.api_url}?{urlencode(params)}", timeout=self.timeout
+        ) as response:
+            payload = json.loads(response.read())
+        # A single location is returned as an object instead of a list
+        return payload if isinstance(payload, list) else [payload]
+
+    def refresh(self) -> None:
+        """Fetch the forecasts of all stations and swap the table"""
+        start = None
+        values = None
+        for offset in range(0, len(self.stations), self.batch_size):
+            batch = self.stations[offset : offset + self.batch_size]
+            for i, forecast in enumerate(self._fetch_batch(batch)):
+                hourly = forecast["hourly"]
+                times = pd.to_datetime(hourly["time"])
+                if values is None:
+                    start = times[0].to_pydatetime()
+                    values = np.full(
+                        (len(self.stations), len(times), len(self.variables)),
+                        np.nan,
+                        np.float32,
+                    )
+                first = int((times[0].to_pydatetime() - start).total_seconds() // 3600)
+                hours = min(len(times), values.shape[1] - first)
+                for j, variable in enumerate(WEATHER_VARIABLES):
+                    # Missing values come back as null
+                    column = pd.to_numeric(
+                        pd.Series(hourly[variable][:hours], dtype=object),
+                        errors="coerce",
+                    ).to_numpy(dtype=np.float32)
+                    values[offset + i, first : first + hours, j] = column
+        if values is None:
+            raise ValueError("Weather API returned no forecast")
+        self._table = (start, values)
+        self.refreshed_at = time.time()
+        self.last_error = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                logger.info(
+                    f"Weather forecasts refreshed for {len(self.stations)} stations"
+                )
+                wait = self.refresh_seconds
+            except Exception as _e:
+                self.last_error = str(_e)
+                logger.error(f"Weather refresh failed: {_e}")
+                # Retry sooner than the regular schedule
+                wait = min(self.refresh_seconds, 60)
+            self._stop.wait(wait)
+
+    def start(self) -> None:
+        """Refresh in a background thread until stop() is called"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="weather-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background refresh"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        """Seconds since the last successful refresh"""
+        if self.refreshed_at is None:
+            return None
+        return time.time() - self.refreshed_at
+
+    @property
+    def is_stale(self) -> bool:
+        """True when no refresh succeeded within two refresh intervals"""
+        age = self.age_seconds
+        return age is None or age > 2 * self.refresh_seconds
+
+    def get(self, station: str, when: datetime) -> Optional[Dict[str, float]]:
+        """
+        Weather of a station at a local time, None when not available.
+
+        The hour is looked up by offset in the table, so reads are O(1).
+        """
+        table = self._table
+        index = self.station_index.get(station)
+        if table is None or index is None:
+            return None
+        start, values = table
+        hour = int((when - start).total_seconds() // 3600)
+        if hour < 0 or hour >= values.shape[1]:
+            return None
+        row = values[index, hour]
+        if np.isnan(row).all():
+            return None
+        return dict(zip(self.variables, row.tolist()))
+
+    def features(
+        self,
+        current_station: str,
+        departure: datetime,
+        next_station: Optional[str] = None,
+        arrival: Optional[datetime] = None,
+    ) -> Tuple[Dict[str, float], bool]:
+        """
+        Weather features on departure (and arrival) with a staleness flag.
+
+        Returns:
+            The *_on_departure, *_on_arrival and weather condition features
+            found in the cache, and True when the cache is stale.
+        """
+        features = {}
+        on_departure = self.get(current_station, departure)
+        if on_departure is not None:
+            features.update(
+                {f"{name}_on_departure": value for name, value in on_departure.items()}
+            )
+            features.update(weather_flags(on_departure))
+        if next_station is not None and arrival is not None:
+            on_arrival = self.get(next_station, arrival)
+            if on_arrival is not None:
+                features.update(
+                    {f"{name}_on_arrival": value for name, value in on_arrival.items()}
+                )
+        return features, self.is_stale
+
+    def status(self) -> Dict[str, Any]:
+        """Cache coverage and freshness"""
+        table = self._table
+        return {
+            "stations": len(self.stations),
+            "hours": 0 if table is None else int(table[1].shape[1]),
+            "start": None if table is None else table[0].isoformat(),
+            "end": (
+                None
+                if table is None
+                else (table[0] + timedelta(hours=int(table[1].shape[1]))).isoformat()
+            ),
+            "age_seconds": (
+                None if self.age_seconds is None else round(self.age_seconds)
+            ),
+            "stale": self.is_stale,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,539 @@
+"""Benchmark and load test the prediction API without a Supabase project.
+
+Builds a synthetic model, label encoders, metrics.json and processed_data
+table, serves the table with the in-process PostgREST stand-in and points the
+API settings at them. Two kinds of measurements are then taken:
+
+- microbenchmarks of the serving steps, called directly: preprocess_single_sample,
+  SingleStationPredictor.predict, encoder decoding and response serialization,
+- load scenarios through HTTP against the API run by uvicorn in a background
+  thread: single-station requests at several concurrencies, batches of 1 to
+  10k items and the replay of every departure of a whole day.
+
+Every scenario reports p50/p95/p99 latency, throughput and peak RSS to a JSON
+file. With --baseline, results are compared with a stored run and the command
+exits with status 1 when a p95 latency or a throughput regresses by more than
+--tolerance, so it can gate a deploy.
+
+Usage:
+    python benchmark_api.py --output results.json --baseline ../benchmarks/baseline.json
+    python benchmark_api.py --scenarios micro,single --save-baseline ../benchmarks/baseline.json
+    python benchmark_api.py --scenarios batch --batch-sizes 1,10,100,1000,10000
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBRegressor
+
+from model_features import FEATURES
+from postgrest_stub import PostgrestStub
+from train_models import StageProfiler
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "app")
+API_KEY = "benchmark"
+SCENARIO_GROUPS = ["micro", "single", "batch", "replay"]
+# Monday, so that day_of_week of the replayed requests is 0
+REPLAY_DATE = date(2025, 5, 19)
+
+
+def make_synthetic_artifacts(
+    work_dir: str,
+    trains: int = 200,
+    stations: int = 60,
+    n_features: int = 26,
+    n_estimators: int = 300,
+    max_depth: int = 9,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Writes a synthetic model, encoders and metrics.json, returns processed_data.
+
+    Args:
+        work_dir (str): Directory of the artifacts.
+        trains (int): Number of daily trains.
+        stations (int): Number of stations in the network.
+        n_features (int): Number of model features, taken from FEATURES.
+        n_estimators (int): Number of trees of the model.
+        max_depth (int): Depth of the trees.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: One processed_data row per train, departure and weekday.
+    """
+    rng = np.random.default_rng(seed)
+    station_names = [f"Station {i:02d}" for i in range(stations)]
+    routes, rows = set(), []
+    for train in range(trains):
+        stops = rng.choice(stations, size=rng.integers(3, 16), replace=False)
+        route = f"{station_names[stops[0]]} - {station_names[stops[-1]]}"
+        routes.add(route)
+        departure = int(rng.integers(5 * 60, 22 * 60))
+        for sequence, (current, following) in enumerate(zip(stops, stops[1:]), 1):
+            departure += int(rng.integers(10, 40))
+            rows.append(
+                {
+                    "train_id": str(1000 + train),
+                    "scheduled_departure_time": (
+                        f"{departure // 60 % 24:02d}:{departure % 60:02d}"
+                    ),
+                    "route": route,
+                    "current_station": station_names[current],
+                    "next_station": station_names[following],
+                    "sequence": sequence,
+                    "departure_hour": departure // 60 % 24,
+                }
+            )
+
+    label_encoders = {
+        "route": LabelEncoder().fit(sorted(routes)),
+        "current_station": LabelEncoder().fit(station_names),
+        "next_station": LabelEncoder().fit(station_names),
+        "train_type": LabelEncoder().fit(["AL ATLAS", "AL BORAQ", "TNR"]),
+    }
+    schedule = pd.DataFrame(rows)
+    for col in ["route", "current_station", "next_station"]:
+        schedule[col] = label_encoders[col].transform(schedule[col])
+    processed_data = schedule.merge(
+        pd.DataFrame({"day_of_week": range(7)}), how="cross"
+    )
+
+    features = FEATURES[:n_features]
+    for feature in features:
+        if feature not in processed_data.columns:
+            processed_data[feature] = rng.normal(5, 3, len(processed_data)).round(2)
+    X = processed_data[features].astype(float)
+    signal = X.to_numpy() @ rng.uniform(0, 1, len(features)) / len(features)
+    y = np.c_[signal + rng.normal(0, 1, len(X)), 0.8 * signal]
+    model = XGBRegressor(
+        n_estimators=n_estimators, max_depth=max_depth, random_state=seed
+    ).fit(X, y)
+
+    joblib.dump(model, os.path.join(work_dir, "model.joblib"))
+    joblib.dump(label_encoders, os.path.join(work_dir, "label_encoders.joblib"))
+    with open(os.path.join(work_dir, "metrics.json"), "w") as _f:
+        json.dump({"version": "benchmark", "r2": 0.9, "mae": 3.0}, _f)
+    print(
+        f"Synthetic processed_data: {len(processed_data):,} rows, "
+        f"model with {len(features)} features and {n_estimators} trees"
+    )
+    return processed_data
+
+
+def load_app(work_dir: str, supabase_url: str):
+    """Import the API with its settings pointing at the synthetic artifacts"""
+    os.environ.update(
+        SINGLE_STATION_MODEL_PATH=os.path.join(work_dir, "model.joblib"),
+        ENCODER_PATH=os.path.join(work_dir, "label_encoders.joblib"),
+        METRICS_JSON=os.path.join(work_dir, "metrics.json"),
+        SUPABASE_URL=supabase_url,
+        SUPABASE_KEY="benchmark",
+        API_KEY=API_KEY,
+        LOG_LEVEL="WARNING",
+    )
+    sys.path.insert(0, os.path.abspath(APP_DIR))
+    return importlib.import_module("main")
+
+
+def summarize(
+    latencies: List[float], elapsed: float, units: int, errors: int = 0
+) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds and throughput in units per second"""
+    values = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "max_ms": round(float(values.max()), 3),
+        "throughput": round(units / elapsed, 2),
+    }
+
+
+def time_calls(func: Callable[[], Any], repeat: int, warmup: int = 5) -> Dict[str, Any]:
+    """Latencies of repeated calls of a function"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start_time, repeat)
+
+
+def microbenchmarks(
+    api, processed_data: pd.DataFrame, repeat: int
+) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """Serving steps called directly, by scenario name"""
+    from schemas.prediction import (
+        ModelInfo,
+        PredictionResult,
+        PredictionType,
+        SingleStationPredictionResponse,
+        batch_response_content,
+        dump_json,
+    )
+
+    predictor = api.MODEL_SERVICE.ensemble.single_predictor
+    row = processed_data[processed_data["day_of_week"] == 0].iloc[0]
+    sample = {
+        "train_id": row["train_id"],
+        "scheduled_departure_time": row["scheduled_departure_time"],
+        "date": REPLAY_DATE,
+    }
+    station = int(row["current_station"])
+
+    def response() -> SingleStationPredictionResponse:
+        return SingleStationPredictionResponse.model_construct(
+            prediction_type=PredictionType.SINGLE_STATION,
+            result=PredictionResult.model_construct(
+                shcedule_departure_time=sample["scheduled_departure_time"],
+                arrival_delay=4.2,
+                departure_delay=3.1,
+                start_station="Station 01",
+                next_station="Station 02",
+            ),
+            processing_time_ms=1.0,
+            model_version="benchmark",
+            model_accuracy=0.9,
+            model_error=3.0,
+            model="single",
+        )
+
+    def batch_response(size: int) -> Dict[str, Any]:
+        return batch_response_content(
+            train_ids=[sample["train_id"]] * size,
+            departure_times=[sample["scheduled_departure_time"]] * size,
+            delays=np.tile(np.float32([4.2, 3.1]), (size, 1)),
+            start_stations=["Station 01"] * size,
+            next_stations=["Station 02"] * size,
+            processing_times=np.ones(size),
+            model_names=["single"] * size,
+            models={
+                "single": ModelInfo.model_construct(
+                    model_version="benchmark", model_accuracy=0.9, model_error=3.0
+                )
+            },
+            errors=[],
+            total_processing_time_ms=1.0,
+        )
+
+    return {
+        "micro.preprocess": lambda: time_calls(
+            lambda: predictor.preprocess_single_sample(dict(sample)), repeat
+        ),
+        "micro.predict": lambda: time_calls(
+            lambda: predictor.predict(dict(sample)), repeat
+        ),
+        "micro.decode": lambda: time_calls(
+            lambda: predictor._decode_categorical([station], "current_station"),
+            repeat * 10,
+        ),
+        "micro.serialize_single": lambda: time_calls(
+            lambda: dump_json(response()), repeat * 10
+        ),
+        "micro.serialize_batch_1000": lambda: time_calls(
+            lambda: dump_json(batch_response(1000)), max(1, repeat // 10)
+        ),
+    }
+
+
+class ServerThread:
+    """uvicorn running the API in a background thread"""
+
+    def __init__(self, app) -> None:
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "ServerThread":
+        """Start serving and wait for the models to be loaded"""
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("API server failed to start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        """Shut the server down"""
+        self.server.should_exit = True
+        self._thread.join()
+
+
+async def _load(
+    url: str, path: str, payloads: List[Dict[str, Any]], concurrency: int
+) -> Tuple[List[float], int, float]:
+    """Posts payloads with a fixed number of concurrent clients"""
+    import httpx
+
+    latencies, errors = [], 0
+    pending = iter(payloads)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=url, headers={"X-API-Key": API_KEY}, timeout=600, limits=limits
+    ) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            for payload in pending:
+                start_time = time.perf_counter()
+                response = await client.post(path, json=payload)
+                latencies.append(time.perf_counter() - start_time)
+                errors += response.status_code != 200
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - start_time
+
+
+def load_scenarios(
+    url: str,
+    processed_data: pd.DataFrame,
+    requests: int,
+    concurrencies: List[int],
+    batch_sizes: List[int],
+    replay_concurrency: int,
+    groups: List[str],
+) -> Dict[str, Callable[[], Dict[str, Any]]]:
+    """End-to-end HTTP scenarios, by scenario name"""
+    day = processed_data[processed_data["day_of_week"] == REPLAY_DATE.weekday()]
+    day = day.sort_values("scheduled_departure_time")
+    replay = [
+        {
+            "train_id": row.train_id,
+            "scheduled_departure_time": row.scheduled_departure_time,
+            "trip_date": REPLAY_DATE.isoformat(),
+        }
+        for row in day.itertuples()
+    ]
+    rng = np.random.default_rng(0)
+
+    def sample(size: int) -> List[Dict[str, Any]]:
+        return [replay[i] for i in rng.integers(0, len(replay), size)]
+
+    def single(concurrency: int) -> Dict[str, Any]:
+        payloads = sample(requests)
+        latencies, errors, elapsed = asyncio.run(
+            _load(url, "/api/v1/predict/single-station", payloads, concurrency)
+        )
+        return summarize(latencies, elapsed, len(payloads), errors)
+
+    def batch(size: int) -> Dict[str, Any]:
+        # Enough batches for percentiles on small sizes, one on the largest
+        payloads = [
+            {"predictions": sample(size)} for _ in range(max(1, min(20, 200 // size)))
+        ]
+        latencies, errors, elapsed = asyncio.run(
+            _load(url, "/api/v1/predict/batch", payloads, 1)
+        )
+        result = summarize(latencies, elapsed, size * len(payloads), errors)
+        result["unit"] = "items/s"
+        return result
+
+    def whole_day() -> Dict[str, Any]:
+        latencies, errors, elapsed = asyncio.run(
+            _load(url, "/api/v1/predict/single-station", replay, replay_concurrency)
+        )
+        return summarize(latencies, elapsed, len(replay), errors)
+
+    scenarios = {}
+    if "single" in groups:
+        for concurrency in concurrencies:
+            scenarios[f"single.c{concurrency}"] = lambda c=concurrency: single(c)
+    if "batch" in groups:
+        for size in batch_sizes:
+            scenarios[f"batch.{size}"] = lambda s=size: batch(s)
+    if "replay" in groups:
+        scenarios[f"replay.day.c{replay_concurrency}"] = whole_day
+    return scenarios
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """
+    Prints the change of every scenario against a baseline.
+
+    Args:
+        results (dict): Scenario results of this run.
+        baseline (dict): Scenario results of the baseline run.
+        tolerance (float): Relative change allowed before a regression.
+
+    Returns:
+        list: Descriptions of the regressions.
+    """
+    regressions = []
+    print(f"\n{'scenario':<30}{'p95 ms':>12}{'base':>12}{'thr/s':>12}{'base':>12}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(
+                f"{name:<30}{result['p95_ms']:>12.2f}{'-':>12}{result['throughput']:>12.1f}{'-':>12}"
+            )
+            continue
+        flag = ""
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {base['p95_ms']:.2f} -> {result['p95_ms']:.2f} ms"
+            )
+            flag = "  <- regression"
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {base['throughput']:.1f} -> "
+                f"{result['throughput']:.1f}/s"
+            )
+            flag = "  <- regression"
+        print(
+            f"{name:<30}{result['p95_ms']:>12.2f}{base['p95_ms']:>12.2f}"
+            f"{result['throughput']:>12.1f}{base['throughput']:>12.1f}{flag}"
+        )
+    return regressions
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIO_GROUPS),
+        help=f"Comma separated groups among {', '.join(SCENARIO_GROUPS)}",
+    )
+    parser.add_argument("--work-dir", help="Defaults to a temporary directory")
+    parser.add_argument("--trains", type=int, default=200)
+    parser.add_argument("--stations", type=int, default=60)
+    parser.add_argument("--features", type=int, default=26)
+    parser.add_argument("--estimators", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument(
+        "--batch-sizes",
+        type=_int_list,
+        default=[1, 10, 100, 1000],
+        help="Comma separated batch sizes, up to 10000",
+    )
+    parser.add_argument("--replay-concurrency", type=int, default=8)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument(
+        "--save-baseline", help="Also write the results to this baseline file"
+    )
+    args = parser.parse_args()
+    groups = args.scenarios.split(",")
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="oncycle-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    # Paths are resolved before moving to the working directory
+    output = os.path.abspath(args.output)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+    save_baseline = args.save_baseline and os.path.abspath(args.save_baseline)
+    processed_data = make_synthetic_artifacts(
+        work_dir, args.trains, args.stations, args.features, args.estimators
+    )
+    stub = PostgrestStub({"processed_data": processed_data}).start()
+    # The API writes its logs relative to the working directory
+    os.chdir(work_dir)
+    api = load_app(work_dir, stub.url)
+    server = ServerThread(api.app).start()
+
+    profiler = StageProfiler()
+    scenarios: Dict[str, Callable[[], Dict[str, Any]]] = {}
+    if "micro" in groups:
+        scenarios.update(microbenchmarks(api, processed_data, args.repeat))
+    scenarios.update(
+        load_scenarios(
+            server.url,
+            processed_data,
+            args.requests,
+            args.concurrency,
+            args.batch_sizes,
+            args.replay_concurrency,
+            groups,
+        )
+    )
+
+    results: Dict[str, Any] = {}
+    try:
+        for name, scenario in scenarios.items():
+            with profiler.stage(name):
+                result = scenario()
+            result["peak_rss_mb"] = profiler.stages[-1]["peak_rss_mb"]
+            results[name] = result
+            print(
+                f"  p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+                f"p99 {result['p99_ms']:.2f} ms, {result['throughput']:.1f} "
+                f"{result.get('unit', 'req/s')}, {result['errors']} errors"
+            )
+    finally:
+        server.stop()
+        stub.stop()
+
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "pandas": pd.__version__,
+            "xgboost": xgboost.__version__,
+            "settings": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("output", "baseline", "save_baseline")
+            },
+        },
+        "results": results,
+    }
+    for path in filter(None, [output, save_baseline]):
+        with open(path, "w") as _f:
+            json.dump(report, _f, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline_path:
+        with open(baseline_path, "r") as _f:
+            baseline = json.load(_f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
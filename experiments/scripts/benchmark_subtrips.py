@@ -0,0 +1,302 @@
+"""Benchmark the vectorized subtrip pipeline against the notebook implementation.
+
+Usage:
+    python benchmark_subtrips.py --days 180 --trains 200 --reference-days 7
+"""
+
+import argparse
+import hashlib
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from subtrips import (
+    OUTPUT_COLUMNS,
+    add_subtrip_features,
+    build_subtrips,
+    merge_weather,
+    prepare_weather,
+)
+
+WEATHER_VARIABLES = [
+    "temperature",
+    "relative_humidity",
+    "dew_point",
+    "apparent_temperature",
+    "precipitation",
+    "visibility",
+    "wind_speed",
+    "wind_direction",
+    "wind_gusts",
+    "uv_index",
+    "cloud_cover",
+    "surface_pressure",
+]
+
+
+def make_synthetic_data(
+    days: int, trains: int, stations: int = 60, seed: int = 42
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Generates trips, subtrip distances and weather with the shape of the real tables.
+
+    Args:
+        days (int): Number of days of service.
+        trains (int): Number of daily trains.
+        stations (int): Number of stations in the network.
+        seed (int): Random seed.
+
+    Returns:
+        tuple: trips, subtrip_distances and weather DataFrames.
+    """
+    rng = np.random.default_rng(seed)
+    station_names = [f"Station {i:02d}" for i in range(stations)]
+    train_types = ["TNR", "AL BORAQ", "AL ATLAS"]
+    dates = pd.date_range("2025-05-18", periods=days, freq="D")
+
+    timetables = []
+    for train_id in range(trains):
+        stops = rng.choice(stations, size=rng.integers(3, 16), replace=False)
+        start = int(rng.integers(4 * 60, 23 * 60))
+        legs = rng.integers(10, 60, size=len(stops))
+        dwell = rng.integers(1, 5, size=len(stops))
+        arrivals = start + np.concatenate([[0], np.cumsum(legs + dwell)[:-1]])
+        departures = arrivals + dwell
+        departures[0] = arrivals[0] = start
+        timetables.append(
+            (
+                train_id + 1000,
+                train_types[train_id % len(train_types)],
+                [station_names[s] for s in stops],
+                arrivals % (24 * 60),
+                departures % (24 * 60),
+            )
+        )
+
+    rows = []
+    subtrip_id = 0
+    for date in dates:
+        for train_id, train_type, names, arrivals, departures in timetables:
+            delays = np.maximum(rng.normal(3, 6, size=len(names)).round(), 0)
+            skipped = rng.random(len(names)) < 0.02
+            for sequence, name in enumerate(names, start=1):
+                if skipped[sequence - 1]:
+                    continue
+                subtrip_id += 1
+                arrival, departure = int(arrivals[sequence - 1]), int(
+                    departures[sequence - 1]
+                )
+                delay = int(delays[sequence - 1])
+                rows.append(
+                    {
+                        "id": subtrip_id,
+                        "date": date.strftime("%Y-%m-%d"),
+                        "train_id": train_id,
+                        "train_type": train_type,
+                        "initial_departure_station": names[0],
+                        "final_arrival_station": names[-1],
+                        "station_name": name,
+                        "sequence": sequence,
+                        "scheduled_arrival_time": _clock(arrival),
+                        "scheduled_departure_time": _clock(departure),
+                        "actual_arrival_time": _clock(arrival + delay),
+                        "actual_departure_time": _clock(departure + delay),
+                        "arrival_delay": delay,
+                        "departure_delay": delay,
+                    }
+                )
+    trips = pd.DataFrame(rows).sample(frac=1, random_state=seed)
+
+    pairs = pd.MultiIndex.from_product(
+        [station_names, station_names, train_types],
+        names=["departure_station", "arrival_station", "train_type"],
+    ).to_frame(index=False)
+    pairs["new_distance"] = rng.uniform(5, 150, size=len(pairs))
+
+    hours = pd.date_range(
+        dates[0], dates[-1] + pd.Timedelta(days=1), freq="h", inclusive="left"
+    ).tz_localize("Africa/Casablanca", ambiguous="NaT", nonexistent="NaT")
+    hours = hours[~hours.isna()]
+    weather = pd.DataFrame(
+        {
+            "date": np.tile(hours, stations),
+            "latitude": 0.0,
+            "longitude": 0.0,
+            "station_name": np.repeat(station_names, len(hours)),
+            "timezone": "Africa/Casablanca",
+            "timezone_abbreviation": "GMT+1",
+        }
+    )
+    for variable in WEATHER_VARIABLES:
+        weather[variable] = rng.normal(20, 10, size=len(weather)).astype(np.float32)
+    return trips, pairs, weather
+
+
+def _clock(minutes: int) -> str:
+    minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def build_subtrips_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """Row-by-row subtrip builder from notebooks/00_data_cleaning.ipynb"""
+    df = df.sort_values(by=["date", "train_id", "sequence"])
+    subtrip_rows = []
+    for _, group in df.groupby("train_id"):
+        for i in range(len(group) - 1):
+            row = group.iloc[i]
+            next_row = group.iloc[i + 1]
+            if next_row["sequence"] != row["sequence"] + 1:
+                continue
+            subtrip = row.copy()
+            subtrip["next_station_name"] = next_row["station_name"]
+            subtrip["scheduled_arrival_time"] = next_row["scheduled_arrival_time"]
+            subtrip["actual_arrival_time"] = next_row["actual_arrival_time"]
+            subtrip["arrival_delay"] = next_row["arrival_delay"]
+            subtrip_rows.append(subtrip)
+    return pd.DataFrame(subtrip_rows)
+
+
+def add_subtrip_features_reference(
+    df: pd.DataFrame, subtrip_distances: pd.DataFrame
+) -> pd.DataFrame:
+    """Feature cells of notebooks/00_data_cleaning.ipynb"""
+    df = df.rename(
+        columns={
+            "id": "subtrip_id",
+            "station_name": "current_station",
+            "next_station_name": "next_station",
+        }
+    )
+    df["date"] = pd.to_datetime(df["date"]).dt.date
+    for col in [
+        "scheduled_arrival_time",
+        "scheduled_departure_time",
+        "actual_arrival_time",
+        "actual_departure_time",
+    ]:
+        df[col] = pd.to_datetime(df[col]).dt.time
+    df["arrival_hour"] = pd.to_datetime(
+        df["scheduled_arrival_time"].astype(str), errors="coerce"
+    ).dt.hour
+    df["departure_hour"] = pd.to_datetime(
+        df["scheduled_departure_time"].astype(str), errors="coerce"
+    ).dt.hour
+    df["trip_id"] = df.apply(
+        lambda row: hashlib.sha256(
+            f"{row['date']}_{row['initial_departure_station']}_{row['final_arrival_station']}_{row['train_id']}".encode()
+        ).hexdigest(),
+        axis=1,
+    )
+    df["route"] = df["initial_departure_station"] + " - " + df["final_arrival_station"]
+    df["day_of_week"] = pd.to_datetime(df["date"]).dt.weekday
+    df["number_of_stations"] = (
+        df.groupby("trip_id")["current_station"].transform("nunique") + 1
+    )
+    df["scheduled_arrival_time"] = pd.to_datetime(
+        df["date"].astype(str) + " " + df["scheduled_arrival_time"].astype(str),
+        format="%Y-%m-%d %H:%M:%S",
+    )
+    df["scheduled_departure_time"] = pd.to_datetime(
+        df["date"].astype(str) + " " + df["scheduled_departure_time"].astype(str),
+        format="%Y-%m-%d %H:%M:%S",
+    )
+    first = df.groupby("trip_id")["scheduled_departure_time"].transform("first")
+    mask_arrival = df["scheduled_arrival_time"] - first < pd.Timedelta(0)
+    mask_departure = df["scheduled_departure_time"] - first < pd.Timedelta(0)
+    df.loc[mask_arrival, "scheduled_arrival_time"] += pd.Timedelta(days=1)
+    df.loc[mask_departure, "scheduled_departure_time"] += pd.Timedelta(days=1)
+    first_departure = df.groupby("trip_id")["scheduled_departure_time"].min()
+    last_arrival = df.groupby("trip_id")["scheduled_arrival_time"].max()
+    trip_duration = (last_arrival - first_departure).dt.total_seconds() / 60
+    df["trip_duration"] = df["trip_id"].map(trip_duration)
+    df["subtrip_duration"] = df.apply(
+        lambda row: pd.to_datetime(
+            row["scheduled_arrival_time"].strftime("%H:%M:%S"), format="%H:%M:%S"
+        )
+        - pd.to_datetime(
+            row["scheduled_departure_time"].strftime("%H:%M:%S"), format="%H:%M:%S"
+        ),
+        axis=1,
+    )
+    df["subtrip_duration"] = df["subtrip_duration"].dt.total_seconds() / 60
+    distances = subtrip_distances.set_index(
+        ["departure_station", "arrival_station", "train_type"]
+    )["new_distance"]
+    df["subtrip_distance"] = df.set_index(
+        ["current_station", "next_station", "train_type"]
+    ).index.map(distances.get)
+    df["subtrip_distance"] = df["subtrip_distance"].round(2)
+    df["trip_distance"] = df.groupby("trip_id")["subtrip_distance"].transform("sum")
+    df["scheduled_dwelling_time"] = df["scheduled_departure_time"] - df.groupby(
+        "trip_id"
+    )["scheduled_arrival_time"].shift(1)
+    df["scheduled_dwelling_time"] = (
+        df["scheduled_dwelling_time"].dt.total_seconds() // 60
+    ).fillna(0)
+    df["remaining_distance"] = (
+        df["trip_distance"]
+        - df.groupby("trip_id")["subtrip_distance"].cumsum()
+        + df["subtrip_distance"]
+    ).round(2)
+    df["travelled_distance"] = (
+        df.groupby("trip_id")["subtrip_distance"].cumsum() - df["subtrip_distance"]
+    ).round(2)
+    return df[OUTPUT_COLUMNS]
+
+
+def _timed(label: str, func, *args) -> pd.DataFrame:
+    start = perf_counter()
+    result = func(*args)
+    print(f"{label:<40} {perf_counter() - start:>10.3f} s  ({len(result):,} rows)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--trains", type=int, default=200)
+    parser.add_argument(
+        "--reference-days",
+        type=int,
+        default=7,
+        help="Days on which the notebook implementation is also run and compared",
+    )
+    args = parser.parse_args()
+
+    trips, subtrip_distances, weather = make_synthetic_data(args.days, args.trains)
+    weather = prepare_weather(weather)
+    print(f"Synthetic trips: {len(trips):,} rows over {args.days} days")
+
+    dates = sorted(trips["date"].unique())[: args.reference_days]
+    sample = trips[trips["date"].isin(dates)]
+    expected = _timed("notebook subtrips", build_subtrips_reference, sample)
+    expected = _timed(
+        "notebook features",
+        add_subtrip_features_reference,
+        expected,
+        subtrip_distances,
+    )
+    actual = _timed("vectorized subtrips", build_subtrips, sample)
+    actual = _timed(
+        "vectorized features", add_subtrip_features, actual, subtrip_distances
+    )
+    pd.testing.assert_frame_equal(
+        merge_weather(actual, weather),
+        merge_weather(expected, weather),
+        check_dtype=False,
+    )
+    print(f"Outputs identical on {args.reference_days} days")
+
+    subtrips = _timed("vectorized subtrips (full)", build_subtrips, trips)
+    subtrips = _timed(
+        "vectorized features (full)",
+        add_subtrip_features,
+        subtrips,
+        subtrip_distances,
+    )
+    _timed("weather merge (full)", merge_weather, subtrips, weather)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Parallel, resumable export of Supabase tables to Parquet.
+
+Replaces get_all_data_paginated from notebooks/00_data_cleaning.ipynb:
+- rows are paged with keyset pagination on an indexed column (key > last)
+  instead of deep offsets,
+- the key range is split between several concurrent fetchers,
+- every page is converted to an Arrow table and written as its own Parquet
+  part, so memory stays bounded by workers * page_size,
+- a checkpoint records the last exported key of every range, and an
+  interrupted export resumes from there. Rerunning a finished export fetches
+  the rows added since (keys above the last exported one); updated or deleted
+  rows need a fresh export (--fresh).
+
+Usage:
+    python export_tables.py --tables trips processed_data --output ../data/export
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from supabase import Client, create_client
+
+# Indexed column used for keyset pagination of each table
+TABLE_KEYS = {
+    "trips": "id",
+    "processed_data": "id",
+}
+CHECKPOINT_FILE = "_checkpoint.json"
+SCHEMA_FILE = "_common_metadata"
+
+
+class TableExporter:
+    """Exports one table to a directory of Parquet parts"""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Client],
+        table: str,
+        output_dir: str,
+        key: str = "id",
+        workers: int = 4,
+        page_size: int = 1000,
+        columns: str = "*",
+        filters: Optional[List[Tuple[str, str, Any]]] = None,
+        fresh: bool = False,
+    ) -> None:
+        self.client_factory = client_factory
+        self.table = table
+        self.output_dir = output_dir
+        self.key = key
+        self.workers = workers
+        self.page_size = page_size
+        self.columns = columns
+        # (operator, column, value) triples, e.g. ("gte", "date", "2025-08-01")
+        self.filters = filters or []
+        # Discard a previous export of output_dir instead of resuming it
+        self.fresh = fresh
+        self.schema: Optional[pa.Schema] = None
+        self.checkpoint: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _client(self) -> Client:
+        """One client per fetcher thread"""
+        if not hasattr(self._local, "client"):
+            self._local.client = self.client_factory()
+        return self._local.client
+
+    def _query(self, columns: str):
+        query = self._client.table(self.table).select(columns)
+        for operator, column, value in self.filters:
+            query = getattr(query, operator)(column, value)
+        return query
+
+    def _boundary(self, descending: bool) -> Any:
+        response = (
+            self._query(self.key).order(self.key, desc=descending).limit(1).execute()
+        )
+        return response.data[0][self.key] if response.data else None
+
+    def _plan_ranges(self) -> List[Dict[str, Any]]:
+        """Split the key space in contiguous [start, end) ranges"""
+        first, last = self._boundary(False), self._boundary(True)
+        if first is None:
+            return []
+        if not isinstance(first, int) or not isinstance(last, int):
+            bounds = [first, None]
+        else:
+            count = max(1, min(self.workers, last - first + 1))
+            step = (last - first + 1) / count
+            bounds = [first + round(i * step) for i in range(count)] + [None]
+        # The last range is open so rows added during the export are included
+        return [
+            {"start": start, "end": end, "last": None, "pages": 0, "rows": 0}
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.output_dir, CHECKPOINT_FILE)
+
+    def _identity(self) -> Dict[str, Any]:
+        """Settings an existing export must share to be resumed"""
+        return json.loads(
+            json.dumps(
+                {
+                    "table": self.table,
+                    "key": self.key,
+                    "columns": self.columns,
+                    "filters": [list(f) for f in self.filters],
+                },
+                default=str,
+            )
+        )
+
+    def _load_checkpoint(self) -> bool:
+        path = self._checkpoint_path()
+        if not os.path.exists(path):
+            return False
+        with open(path, "r", encoding="utf-8") as _f:
+            checkpoint = json.load(_f)
+        identity = self._identity()
+        changed = [k for k, v in identity.items() if checkpoint.get(k) != v]
+        if changed:
+            print(
+                f"Checkpoint in {self.output_dir} has a different "
+                f"{', '.join(changed)}, starting a fresh export"
+            )
+            return False
+        self.checkpoint = checkpoint
+        schema_path = os.path.join(self.output_dir, SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            self.schema = pq.read_schema(schema_path)
+        return True
+
+    def _reset(self) -> None:
+        """Remove the parts, schema and checkpoint of a previous export"""
+        for name in os.listdir(self.output_dir):
+            if name.startswith("part-") or name.startswith(CHECKPOINT_FILE):
+                os.remove(os.path.join(self.output_dir, name))
+        schema_path = os.path.join(self.output_dir, SCHEMA_FILE)
+        if os.path.exists(schema_path):
+            os.remove(schema_path)
+        self.schema = None
+
+    def _save_checkpoint(self) -> None:
+        """Atomically persist the checkpoint, the caller holds the lock"""
+        if self.schema is not None:
+            pq.write_metadata(self.schema, os.path.join(self.output_dir, SCHEMA_FILE))
+        path = self._checkpoint_path()
+        with open(f"{path}.tmp", "w", encoding="utf-8") as _f:
+            json.dump(self.checkpoint, _f, indent=2, default=str)
+        os.replace(f"{path}.tmp", path)
+
+    def _fetch_page(self, part: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query = self._query(self.columns)
+        if part["last"] is not None:
+            query = query.gt(self.key, part["last"])
+        else:
+            query = query.gte(self.key, part["start"])
+        if part["end"] is not None:
+            query = query.lt(self.key, part["end"])
+        return query.order(self.key).limit(self.page_size).execute().data
+
+    def _export_range(self, index: int) -> int:
+        part = self.checkpoint["ranges"][index]
+        exported = 0
+        while not part.get("done"):
+            rows = self._fetch_page(part)
+            if not rows:
+                with self._lock:
+                    part["done"] = True
+                    self._save_checkpoint()
+                break
+            batch = pa.Table.from_pylist(rows)
+            del rows
+            # Re-fetching an unrecorded page after a crash overwrites the same part
+            path = os.path.join(
+                self.output_dir, f"part-{index:03d}-{part['pages']:06d}.parquet"
+            )
+            pq.write_table(batch, path)
+            with self._lock:
+                self.schema = (
+                    batch.schema
+                    if self.schema is None
+                    else pa.unify_schemas(
+                        [self.schema, batch.schema], promote_options="permissive"
+                    )
+                )
+                part["last"] = batch.column(self.key)[-1].as_py()
+                part["pages"] += 1
+                part["rows"] += batch.num_rows
+                self._save_checkpoint()
+            exported += batch.num_rows
+        return exported
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Exports the table, resuming from the checkpoint when one exists.
+
+        Every range continues after its last exported key, so a finished
+        export only fetches the rows added since. The checkpoint is discarded
+        when fresh is set or when the table, key, columns or filters changed.
+
+        Returns:
+            dict: Rows exported by this run, total rows and elapsed seconds.
+        """
+        start_time = perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.fresh or not self._load_checkpoint():
+            self._reset()
+            self.checkpoint = {**self._identity(), "ranges": []}
+        if not self.checkpoint["ranges"]:
+            self.checkpoint["ranges"] = self._plan_ranges()
+        for part in self.checkpoint["ranges"]:
+            part["done"] = False
+        self.checkpoint["page_size"] = self.page_size
+        with self._lock:
+            self._save_checkpoint()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            exported = sum(
+                executor.map(self._export_range, range(len(self.checkpoint["ranges"])))
+            )
+
+        return {
+            "table": self.table,
+            "exported_rows": exported,
+            "total_rows": sum(part["rows"] for part in self.checkpoint["ranges"]),
+            "seconds": round(perf_counter() - start_time, 2),
+        }
+
+
+def read_export(output_dir: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads an exported table back as a single DataFrame.
+
+    Args:
+        output_dir (str): Directory written by TableExporter.
+        columns (list): Optional subset of columns to read.
+
+    Returns:
+        pd.DataFrame: Exported rows.
+    """
+    schema_path = os.path.join(output_dir, SCHEMA_FILE)
+    schema = pq.read_schema(schema_path) if os.path.exists(schema_path) else None
+    dataset = ds.dataset(output_dir, schema=schema, format="parquet")
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", nargs="+", default=list(TABLE_KEYS))
+    parser.add_argument("--output", default="../data/export")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument(
+        "--key",
+        default=None,
+        help="Indexed column used for pagination (defaults to TABLE_KEYS)",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Discard previous exports instead of resuming them",
+    )
+    parser.add_argument("--url", default=os.getenv("SUPABASE_URL"))
+    parser.add_argument("--api-key", default=os.getenv("SUPABASE_KEY"))
+    args = parser.parse_args()
+
+    for table in args.tables:
+        exporter = TableExporter(
+            lambda: create_client(args.url, args.api_key),
+            table,
+            os.path.join(args.output, table),
+            key=args.key or TABLE_KEYS.get(table, "id"),
+            workers=args.workers,
+            page_size=args.page_size,
+            fresh=args.fresh,
+        )
+        print(exporter.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Local stand-in for the Open-Meteo forecast API.
+
+Answers /v1/forecast with deterministic synthetic hourly values for every
+requested location, in the JSON layout of the real API (a list when several
+comma separated coordinates are requested). Point WEATHER_API_URL at the
+printed URL to run the API weather cache without network access.
+
+Usage:
+    python forecast_stub.py --port 8081
+"""
+
+import argparse
+import json
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+
+def synthetic_forecast(
+    latitude: float,
+    longitude: float,
+    variables: list,
+    past_days: int = 0,
+    forecast_days: int = 7,
+    today: Optional[date] = None,
+) -> Dict[str, Any]:
+    """
+    Builds the forecast of one location.
+
+    Args:
+        latitude (float): Latitude of the location.
+        longitude (float): Longitude of the location.
+        variables (list): Hourly variables to return.
+        past_days (int): Days before today to include.
+        forecast_days (int): Days from today to include.
+        today (date): First forecast day, defaults to the current date.
+
+    Returns:
+        dict: Open-Meteo response for the location.
+    """
+    start = datetime.combine(today or date.today(), datetime.min.time()) - timedelta(
+        days=past_days
+    )
+    hours = 24 * (past_days + forecast_days)
+    times = [start + timedelta(hours=h) for h in range(hours)]
+    seed = abs(hash((round(latitude, 4), round(longitude, 4)))) % 2**32
+    rng = np.random.default_rng(seed)
+    hourly = {"time": [t.strftime("%Y-%m-%dT%H:%M") for t in times]}
+    for i, variable in enumerate(variables):
+        daily_cycle = np.sin(np.arange(hours) / 24 * 2 * np.pi)
+        values = 10 * (i + 1) + 5 * daily_cycle + rng.normal(0, 1, hours)
+        hourly[variable] = np.round(values, 1).tolist()
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "timezone": "Africa/Casablanca",
+        "hourly": hourly,
+    }
+
+
+class ForecastStub:
+    """Threaded HTTP server answering forecast requests"""
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 0, today: Optional[date] = None
+    ) -> None:
+        self.today = today
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Forecast endpoint to use as WEATHER_API_URL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/forecast"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Forecast request handler"""
+
+            def do_GET(self):  # noqa: N802
+                parts = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                latitudes = [float(v) for v in params["latitude"].split(",")]
+                longitudes = [float(v) for v in params["longitude"].split(",")]
+                forecasts = [
+                    synthetic_forecast(
+                        latitude,
+                        longitude,
+                        params.get("hourly", "").split(","),
+                        int(params.get("past_days", 0)),
+                        int(params.get("forecast_days", 7)),
+                        stub.today,
+                    )
+                    for latitude, longitude in zip(latitudes, longitudes)
+                ]
+                stub.requests += 1
+                body = forecasts if len(forecasts) > 1 else forecasts[0]
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):  # noqa: A002
+                pass
+
+        return Handler
+
+    def start(self) -> "ForecastStub":
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Shut the server down"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "ForecastStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    stub = ForecastStub(args.host, args.port)
+    print(f"Serving forecasts on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
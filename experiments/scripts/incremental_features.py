@@ -0,0 +1,742 @@
+"""Incremental daily refresh of the trips_data and processed_data datasets.
+
+Instead of re-reading every trip, rewriting trips_data.csv and recomputing
+every model feature, each run:
+- fetches only the trips dated from the watermark (minus a short lookback
+  window, to pick up late delay updates) with the keyset exporter,
+- fingerprints every fetched date and rebuilds only new or changed dates,
+  dates of the window without trips anymore are removed,
+- writes one Parquet partition per date (date=YYYY-MM-DD/),
+- recomputes the model features (create_all_features, encoded with the label
+  encoders of the deployed model) of the rows dated from the earliest
+  affected date, whose rolling and EWM windows can include the rebuilt rows,
+  and writes them under processed/date=.../,
+- upserts the rebuilt rows into the serving tables in batches and deletes the
+  rows whose subtrips are gone,
+- advances the watermark once every partition has been written.
+
+The features are computed over the partitions of the lookback window only.
+The history before it is carried in processed/_group_state.joblib: value
+counts of the whole-history statistics (route/station totals, hourly and
+daily patterns), the EWM state of every route/station and the last rows of
+every rolling window group. The recomputed rows get the same features as a
+full build, the rows older than the earliest affected date keep the
+whole-history statistics of the run that wrote them.
+
+Usage:
+    python incremental_features.py --output ../data/trips_data --lookback-days 1
+"""
+
+import argparse
+import json
+import os
+import shutil
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+from supabase import Client, create_client
+
+from export_tables import TABLE_KEYS, TableExporter, read_export
+from model_features import (
+    TARGETS,
+    apply_encoders,
+    create_all_features,
+    format_trips_data,
+)
+from subtrips import (
+    add_subtrip_features,
+    build_subtrips,
+    merge_weather,
+    prepare_weather,
+)
+
+STATE_FILE = "_state.json"
+STAGING_DIR = "_staging"
+PROCESSED_DIR = "processed"
+GROUP_STATE_FILE = "_group_state.joblib"
+
+# Whole-history statistics of create_all_features: group columns, statistics
+# and feature name
+GROUP_STATISTICS = [
+    (
+        ["route", "current_station"],
+        ["avg", "median", "std", "max", "min"],
+        "route_station_{stat}_total_{target:.3}",
+    ),
+    (
+        ["route", "departure_hour"],
+        ["avg", "median", "std"],
+        "route_hour_pattern_{stat}_{target}",
+    ),
+    (
+        ["route", "day_of_week"],
+        ["avg", "median"],
+        "route_day_of_week_pattern_{stat}_{target}",
+    ),
+]
+# Groups of the rolling windows, which read at most ROLLING_REACH previous
+# rows (7 rows on the shifted target, closed="left" for the route/station)
+ROLLING_GROUPS = [["route", "current_station"], ["route", "departure_hour"]]
+ROLLING_REACH = 8
+EWM_GROUP = ["route", "current_station"]
+EWM_DECAY = 1 - 2 / (7 + 1)
+
+
+def date_fingerprint(trips: pd.DataFrame) -> str:
+    """Order-independent hash of the raw trip rows of one date"""
+    rows = trips.sort_values(TABLE_KEYS["trips"]).reset_index(drop=True)
+    rows = rows[sorted(rows.columns)]
+    return str(int(pd.util.hash_pandas_object(rows, index=False).sum()))
+
+
+def to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert rows to JSON-serializable records for the PostgREST API"""
+    return json.loads(
+        df.to_json(orient="records", date_format="iso", default_handler=str)
+    )
+
+
+def encoders_fingerprint(label_encoders: Dict[str, LabelEncoder]) -> str:
+    """Hash of the classes of the label encoders"""
+    classes = {col: [str(c) for c in le.classes_] for col, le in label_encoders.items()}
+    return str(int(pd.util.hash_pandas_object(pd.Series([json.dumps(classes)])).sum()))
+
+
+def value_counts(keys: pd.DataFrame, group_cols: List[str]) -> pd.DataFrame:
+    """Rows of each group, target and target value"""
+    frames = []
+    for target in TARGETS:
+        counted = keys[group_cols].assign(target=target, value=keys[target])
+        frames.append(
+            counted.dropna(subset=["value"])
+            .groupby(group_cols + ["target", "value"], as_index=False)
+            .size()
+            .rename(columns={"size": "count"})
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def merge_counts(counts: List[pd.DataFrame], group_cols: List[str]) -> pd.DataFrame:
+    """Sums value counts of several sets of rows"""
+    counts = [frame for frame in counts if frame is not None and not frame.empty]
+    if not counts:
+        return pd.DataFrame(columns=group_cols + ["target", "value", "count"])
+    return (
+        pd.concat(counts, ignore_index=True)
+        .groupby(group_cols + ["target", "value"], as_index=False)["count"]
+        .sum()
+    )
+
+
+def group_statistics(counts: pd.DataFrame, group_cols: List[str]) -> pd.DataFrame:
+    """
+    Computes the statistics of pandas groupby transforms from value counts.
+
+    Args:
+        counts (pd.DataFrame): Value counts from value_counts/merge_counts.
+        group_cols (list): Group columns of the counts.
+
+    Returns:
+        pd.DataFrame: avg and std rounded to 2 decimals, median, max and min
+            of each group and target.
+    """
+    keys = group_cols + ["target"]
+    counts = counts.sort_values(keys + ["value"], kind="stable").reset_index(drop=True)
+    value = counts["value"].astype(float)
+    grouped = counts.groupby(keys, sort=False)
+    size = grouped["count"].transform("sum")
+    mean = (value * counts["count"]).groupby(
+        [counts[col] for col in keys], sort=False
+    ).transform("sum") / size
+    deviation = (
+        ((value - mean) ** 2 * counts["count"])
+        .groupby([counts[col] for col in keys], sort=False)
+        .transform("sum")
+    )
+    # Values at the middle positions of the sorted rows of each group
+    end = grouped["count"].cumsum()
+    start = end - counts["count"]
+    low, high = (size - 1) // 2, size // 2
+    summary = (
+        counts[keys]
+        .assign(
+            size=size,
+            mean=mean,
+            deviation=deviation,
+            low=value.where((start <= low) & (low < end)),
+            high=value.where((start <= high) & (high < end)),
+            value=value,
+        )
+        .groupby(keys, as_index=False, sort=False)
+        .agg(
+            size=("size", "first"),
+            mean=("mean", "first"),
+            deviation=("deviation", "first"),
+            low=("low", "max"),
+            high=("high", "max"),
+            max=("value", "max"),
+            min=("value", "min"),
+        )
+    )
+    summary["avg"] = summary["mean"].round(2)
+    summary["median"] = (summary["low"] + summary["high"]) / 2
+    summary["std"] = (
+        np.sqrt(summary["deviation"] / (summary["size"] - 1))
+        .where(summary["size"] > 1)
+        .round(2)
+    )
+    return summary[keys + ["avg", "median", "std", "max", "min"]]
+
+
+def tail_rows(rows: pd.DataFrame) -> pd.Series:
+    """
+    Selects the rows the rolling windows of later dates can still read: the
+    latest dates of each rolling window group, until it holds ROLLING_REACH rows.
+
+    Args:
+        rows (pd.DataFrame): Subtrips with the columns of ROLLING_GROUPS.
+
+    Returns:
+        pd.Series: Boolean mask of the rows to keep.
+    """
+    days = pd.to_datetime(rows["date"]).rename("_day")
+    keep = np.zeros(len(rows), dtype=bool)
+    for group_cols in ROLLING_GROUPS:
+        keys = rows[group_cols].astype(str).assign(_day=days)
+        sizes = (
+            keys.groupby(group_cols + ["_day"], as_index=False)
+            .size()
+            .sort_values("_day", ascending=False, kind="stable")
+        )
+        later = sizes.groupby(group_cols)["size"].cumsum() - sizes["size"]
+        latest = sizes.loc[later < ROLLING_REACH, group_cols + ["_day"]]
+        matched = keys.merge(
+            latest, on=group_cols + ["_day"], how="left", indicator=True
+        )
+        keep |= (matched["_merge"] == "both").to_numpy()
+    return pd.Series(keep, index=rows.index)
+
+
+def carry_ewm(
+    keys: pd.DataFrame,
+    ewm_state: Dict[Tuple[str, str, str], Tuple[float, float, float]],
+    cutoff: Optional[str],
+) -> Tuple[
+    Dict[str, pd.Series], Dict[Tuple[str, str, str], Tuple[float, float, float]]
+]:
+    """
+    Continues the route/station EWM of add_ewm_features from a saved state.
+
+    The adjusted EWM of the shifted target is the ratio of two decayed sums
+    (weighted delays and weights), kept with the last delay of each group.
+
+    Args:
+        keys (pd.DataFrame): Group keys, date, departure_hour, sequence and
+            targets of the rows after the state, in the order of the frame.
+        ewm_state (dict): Sums and last delay per route, station and target.
+        cutoff (str): Date before which the rows are folded into the new state.
+
+    Returns:
+        tuple: EWM per target aligned on the rows, and the state after the
+            rows dated before cutoff.
+    """
+    # Rows in the order add_ewm_features sees them inside each group
+    ordered = keys.sort_values(
+        EWM_GROUP + ["date", "departure_hour", "sequence"], kind="stable"
+    )
+    cutoff_date = date.fromisoformat(cutoff) if cutoff is not None else None
+    groups = list(zip(*(ordered[col] for col in EWM_GROUP)))
+    folded = (
+        (ordered["date"] < cutoff_date).to_numpy()
+        if cutoff_date is not None
+        else np.zeros(len(ordered), dtype=bool)
+    )
+    next_state = dict(ewm_state)
+    ewm = {}
+    for target in TARGETS:
+        values = ordered[target].to_numpy(dtype=float)
+        means = np.full(len(ordered), np.nan)
+        current = None
+        for i, group in enumerate(groups):
+            if group != current:
+                current = group
+                total, weight, last = ewm_state.get(
+                    (*group, target), (0.0, 0.0, np.nan)
+                )
+            total *= EWM_DECAY
+            weight *= EWM_DECAY
+            if not np.isnan(last):
+                total += last
+                weight += 1
+            if weight > 0:
+                means[i] = total / weight
+            last = values[i]
+            if folded[i]:
+                next_state[(*group, target)] = (total, weight, last)
+        ewm[target] = pd.Series(means, index=ordered.index).round(2)
+    return ewm, next_state
+
+
+def _assign(features: pd.DataFrame, rows: pd.Index, col: str, values) -> None:
+    """Overwrite a feature on some rows, keeping its dtype when possible"""
+    values = pd.Series(np.asarray(values), index=rows)
+    if not values.isna().any():
+        values = values.astype(features[col].dtype)
+    features.loc[rows, col] = values
+
+
+class IncrementalFeaturePipeline:
+    """Keeps per-date partitioned trips_data and processed_data datasets up to date"""
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Client],
+        output_dir: str,
+        subtrip_distances: pd.DataFrame,
+        weather_loader: Callable[[str, str], pd.DataFrame],
+        label_encoders: Optional[Dict[str, LabelEncoder]] = None,
+        serving_table: Optional[str] = None,
+        processed_table: Optional[str] = None,
+        on_conflict: str = "subtrip_id",
+        lookback_days: int = 1,
+        batch_size: int = 500,
+        workers: int = 4,
+    ) -> None:
+        self.client_factory = client_factory
+        self.output_dir = output_dir
+        self.subtrip_distances = subtrip_distances
+        self.weather_loader = weather_loader
+        # Encoders of the deployed model, processed rows are skipped without
+        self.label_encoders = label_encoders
+        self.serving_table = serving_table
+        self.processed_table = processed_table
+        self.on_conflict = on_conflict
+        self.lookback_days = lookback_days
+        self.batch_size = batch_size
+        self.workers = workers
+        self.state: Dict[str, Any] = {"watermark": None, "dates": {}}
+
+    def _state_path(self) -> str:
+        return os.path.join(self.output_dir, STATE_FILE)
+
+    def _load_state(self) -> None:
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), "r", encoding="utf-8") as _f:
+                self.state = json.load(_f)
+
+    def _save_state(self) -> None:
+        path = self._state_path()
+        with open(f"{path}.tmp", "w", encoding="utf-8") as _f:
+            json.dump(self.state, _f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def _start_date(self) -> Optional[str]:
+        if self.state["watermark"] is None:
+            return None
+        watermark = date.fromisoformat(self.state["watermark"])
+        return (watermark - timedelta(days=self.lookback_days)).isoformat()
+
+    def _fetch_trips(self, start_date: Optional[str]) -> pd.DataFrame:
+        """Export the trips dated from start_date through the keyset exporter"""
+        staging = os.path.join(self.output_dir, STAGING_DIR, start_date or "full")
+        exporter = TableExporter(
+            self.client_factory,
+            "trips",
+            staging,
+            key=TABLE_KEYS["trips"],
+            workers=self.workers,
+            filters=[("gte", "date", start_date)] if start_date else None,
+        )
+        if exporter.run()["total_rows"] == 0:
+            trips = pd.DataFrame()
+        else:
+            trips = read_export(staging)
+        shutil.rmtree(os.path.join(self.output_dir, STAGING_DIR), ignore_errors=True)
+        return trips
+
+    def _partition_path(self, day: str, processed: bool = False) -> str:
+        base = (
+            os.path.join(self.output_dir, PROCESSED_DIR)
+            if processed
+            else self.output_dir
+        )
+        return os.path.join(base, f"date={day}", "part-0.parquet")
+
+    def _write_partition(
+        self, day: str, df: pd.DataFrame, processed: bool = False
+    ) -> List[Any]:
+        """Write the partition of a date, returning the keys it no longer holds"""
+        path = self._partition_path(day, processed)
+        stale = self._remove_partition(day, processed, keep=df[self.on_conflict])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        return stale
+
+    def _remove_partition(
+        self, day: str, processed: bool = False, keep: Optional[pd.Series] = None
+    ) -> List[Any]:
+        """Keys of the stored partition of a date missing from keep"""
+        path = self._partition_path(day, processed)
+        if not os.path.exists(path):
+            return []
+        keys = pd.read_parquet(path, columns=[self.on_conflict])[self.on_conflict]
+        if keep is None:
+            shutil.rmtree(os.path.dirname(path))
+        else:
+            keys = keys[~keys.isin(keep)]
+        return keys.tolist()
+
+    def _upsert(self, table: Optional[str], df: pd.DataFrame) -> int:
+        """Upsert rows into a serving table, batch_size rows per request"""
+        if table is None or df.empty:
+            return 0
+        client = self.client_factory()
+        records = to_records(df)
+        for start in range(0, len(records), self.batch_size):
+            client.table(table).upsert(
+                records[start : start + self.batch_size], on_conflict=self.on_conflict
+            ).execute()
+        return len(records)
+
+    def _delete(self, table: Optional[str], keys: List[Any]) -> int:
+        """Delete rows of a serving table by key, batch_size keys per request"""
+        if table is None or not keys:
+            return 0
+        client = self.client_factory()
+        for start in range(0, len(keys), self.batch_size):
+            client.table(table).delete().in_(
+                self.on_conflict, keys[start : start + self.batch_size]
+            ).execute()
+        return len(keys)
+
+    def _group_state_path(self) -> str:
+        return os.path.join(self.output_dir, PROCESSED_DIR, GROUP_STATE_FILE)
+
+    def _load_group_state(self, since: str) -> Dict[str, Any]:
+        """Group state of the history before since, empty if it covers later dates"""
+        fingerprint = encoders_fingerprint(self.label_encoders)
+        path = self._group_state_path()
+        if os.path.exists(path):
+            group_state = joblib.load(path)
+            if group_state["encoders"] != fingerprint:
+                print("Label encoders changed, recomputing the group state")
+            elif group_state["cutoff"] is not None and since < group_state["cutoff"]:
+                print(
+                    f"Group state is cut off at {group_state['cutoff']}, after "
+                    f"{since}, recomputing it"
+                )
+            else:
+                return group_state
+        return {
+            "cutoff": None,
+            "encoders": fingerprint,
+            "counts": {},
+            "ewm": {},
+            "tails": pd.DataFrame(),
+        }
+
+    def _save_group_state(self, group_state: Dict[str, Any]) -> None:
+        path = self._group_state_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        joblib.dump(group_state, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def _process(self, since: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """
+        Computes the model features of the stored subtrips dated on or after
+        since, from the partitions after the cutoff of the group state.
+
+        Args:
+            since (str): Earliest date to compute features for.
+
+        Returns:
+            tuple: Features of the subtrips, and the group state carried to
+                the start date of the next run.
+        """
+        group_state = self._load_group_state(since)
+        cutoff = group_state["cutoff"]
+        # The next run only fetches dates from its start date on
+        next_cutoff = max(filter(None, [cutoff, self._start_date()]), default=None)
+
+        frame = pd.concat(
+            [group_state["tails"], read_partitions(self.output_dir, since=cutoff)],
+            ignore_index=True,
+        )
+        if frame.empty:
+            return frame, group_state
+        frame = frame.drop_duplicates().reset_index(drop=True)
+        history = format_trips_data(frame)
+        trip_data = apply_encoders(history, self.label_encoders)
+        since_date = date.fromisoformat(since)
+        skipped = (history["date"] >= since_date).sum() - (
+            trip_data["date"] >= since_date
+        ).sum()
+        if skipped:
+            print(
+                f"{skipped} subtrips since {since} have categories unknown to the "
+                "label encoders, they are left out of the processed features"
+            )
+        if trip_data.empty:
+            return trip_data, group_state
+        features = create_all_features(trip_data)
+
+        # Group keys of the encoded rows, the state is kept by label
+        keys = features.loc[
+            trip_data.index,
+            ["date", "departure_hour", "day_of_week", "sequence"] + TARGETS,
+        ]
+        for col in ["route", "current_station"]:
+            keys[col] = history.loc[trip_data.index, col].astype(str)
+        recent = (
+            keys if cutoff is None else keys[keys["date"] >= date.fromisoformat(cutoff)]
+        )
+        folded = (
+            recent.iloc[:0]
+            if next_cutoff is None
+            else recent[recent["date"] < date.fromisoformat(next_cutoff)]
+        )
+        rows = features.index[features["date"] >= since_date]
+
+        next_state = {
+            "cutoff": next_cutoff,
+            "encoders": group_state["encoders"],
+            "counts": {},
+        }
+        for group_cols, stats, name in GROUP_STATISTICS:
+            counts = group_state["counts"].get(tuple(group_cols))
+            summary = group_statistics(
+                merge_counts([counts, value_counts(recent, group_cols)], group_cols),
+                group_cols,
+            )
+            for target in TARGETS:
+                values = keys.loc[rows, group_cols].merge(
+                    summary[summary["target"] == target], on=group_cols, how="left"
+                )
+                for stat in stats:
+                    _assign(
+                        features,
+                        rows,
+                        name.format(stat=stat, target=target),
+                        values[stat],
+                    )
+            next_state["counts"][tuple(group_cols)] = merge_counts(
+                [counts, value_counts(folded, group_cols)], group_cols
+            )
+
+        ewm, next_state["ewm"] = carry_ewm(recent, group_state["ewm"], next_cutoff)
+        for target in TARGETS:
+            _assign(
+                features,
+                rows,
+                f"route_station_ewm_7days_{target}",
+                ewm[target].reindex(rows),
+            )
+
+        tails = pd.concat(
+            [group_state["tails"], frame.loc[folded.index]], ignore_index=True
+        )
+        next_state["tails"] = tails[tail_rows(tails)].reset_index(drop=True)
+        return features.loc[rows], next_state
+
+    def _refresh_processed(self, since: str) -> Dict[str, int]:
+        """Rewrite the processed partitions and rows dated on or after since"""
+        counts = {"rows": 0, "upserted": 0, "removed": 0}
+        features, group_state = self._process(since)
+        feature_days = (
+            features["date"].astype(str).to_numpy()
+            if len(features)
+            else np.array([], dtype=object)
+        )
+        processed_dir = os.path.join(self.output_dir, PROCESSED_DIR)
+        stored = (
+            {
+                name.split("=", 1)[1]
+                for name in os.listdir(processed_dir)
+                if name.startswith("date=")
+            }
+            if os.path.isdir(processed_dir)
+            else set()
+        )
+        for day in sorted(
+            day for day in stored | set(self.state["dates"]) if day >= since
+        ):
+            # Dates without encodable subtrips have no processed partition
+            if day in self.state["dates"] and day in feature_days:
+                rows = features[feature_days == day]
+                stale = self._write_partition(day, rows, processed=True)
+                counts["upserted"] += self._upsert(self.processed_table, rows)
+                counts["rows"] += len(rows)
+            else:
+                stale = self._remove_partition(day, processed=True)
+            counts["removed"] += self._delete(self.processed_table, stale)
+        self._save_group_state(group_state)
+        return counts
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Processes new and changed dates since the last run.
+
+        Returns:
+            dict: Rebuilt and deleted dates, written, upserted and deleted rows
+                of both datasets, watermark and timings.
+        """
+        start_time = perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._load_state()
+
+        start_date = self._start_date()
+        trips = self._fetch_trips(start_date)
+        fetch_time = perf_counter() - start_time
+
+        changed = {}
+        if not trips.empty:
+            days = pd.to_datetime(trips["date"]).dt.date.astype(str)
+            for day, rows in trips.groupby(days.to_numpy()):
+                fingerprint = date_fingerprint(rows)
+                if self.state["dates"].get(day, {}).get("fingerprint") != fingerprint:
+                    changed[day] = (rows, fingerprint)
+            fetched = set(days)
+        else:
+            fetched = set()
+        # Dates of the fetched window whose trips were all deleted
+        deleted = sorted(
+            day
+            for day in self.state["dates"]
+            if (start_date is None or day >= start_date) and day not in fetched
+        )
+
+        affected = sorted(changed) + deleted
+        if affected and self.label_encoders is not None:
+            # Kept until the processed features are rewritten, so that an
+            # interrupted run recomputes them
+            pending = self.state.get("processed_since")
+            self.state["processed_since"] = min([*affected, pending or affected[0]])
+            self._save_state()
+
+        weather = None
+        if changed:
+            weather = prepare_weather(self.weather_loader(min(changed), max(changed)))
+
+        written = upserted = removed = 0
+        for day in sorted(changed):
+            rows, fingerprint = changed[day]
+            subtrips = add_subtrip_features(
+                build_subtrips(rows), self.subtrip_distances
+            )
+            subtrips = merge_weather(subtrips, weather)
+            stale = self._write_partition(day, subtrips)
+            upserted += self._upsert(self.serving_table, subtrips)
+            removed += self._delete(self.serving_table, stale)
+            written += len(subtrips)
+            self.state["dates"][day] = {
+                "fingerprint": fingerprint,
+                "rows": len(subtrips),
+            }
+            self.state["watermark"] = max(self.state["watermark"] or day, day)
+            self._save_state()
+        for day in deleted:
+            removed += self._delete(self.serving_table, self._remove_partition(day))
+            self.state["dates"].pop(day)
+            self.state["watermark"] = max(self.state["dates"], default=None)
+            self._save_state()
+
+        processed = {"rows": 0, "upserted": 0, "removed": 0}
+        if self.label_encoders is not None and self.state.get("processed_since"):
+            processed = self._refresh_processed(self.state["processed_since"])
+            self.state["processed_since"] = None
+            self._save_state()
+
+        return {
+            "dates": sorted(changed),
+            "deleted_dates": deleted,
+            "rows": written,
+            "upserted": upserted,
+            "removed": removed,
+            "processed_rows": processed["rows"],
+            "processed_upserted": processed["upserted"],
+            "processed_removed": processed["removed"],
+            "watermark": self.state["watermark"],
+            "fetch_seconds": round(fetch_time, 2),
+            "seconds": round(perf_counter() - start_time, 2),
+        }
+
+
+def read_partitions(output_dir: str, since: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads the partitioned trips_data dataset.
+
+    Args:
+        output_dir (str): Directory written by IncrementalFeaturePipeline.
+        since (str): Only read partitions dated on or after this date.
+
+    Returns:
+        pd.DataFrame: Concatenated partitions, oldest date first.
+    """
+    days = sorted(
+        name.split("=", 1)[1]
+        for name in os.listdir(output_dir)
+        if name.startswith("date=")
+    )
+    if since is not None:
+        days = [day for day in days if day >= since]
+    frames = [
+        pd.read_parquet(os.path.join(output_dir, f"date={day}", "part-0.parquet"))
+        for day in days
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="../data/trips_data")
+    parser.add_argument("--distances", default="../data/subtrip_distances_new.csv")
+    parser.add_argument(
+        "--encoders",
+        default="../models/label_encoders_v1.0.joblib",
+        help="Label encoders of the deployed model, for the processed features",
+    )
+    parser.add_argument("--lookback-days", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--serving-table",
+        default=None,
+        help="Table receiving batched upserts of the rebuilt rows",
+    )
+    parser.add_argument(
+        "--processed-table",
+        default=None,
+        help="Table receiving batched upserts of the recomputed model features",
+    )
+    parser.add_argument("--url", default=os.getenv("SUPABASE_URL"))
+    parser.add_argument("--api-key", default=os.getenv("SUPABASE_KEY"))
+    args = parser.parse_args()
+
+    from get_weather import fetch_weather_for_all_stations
+
+    pipeline = IncrementalFeaturePipeline(
+        lambda: create_client(args.url, args.api_key),
+        args.output,
+        pd.read_csv(args.distances),
+        fetch_weather_for_all_stations,
+        label_encoders=joblib.load(args.encoders),
+        serving_table=args.serving_table,
+        processed_table=args.processed_table,
+        lookback_days=args.lookback_days,
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+    print(pipeline.run())
+
+
+if __name__ == "__main__":
+    main()
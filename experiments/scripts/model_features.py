@@ -0,0 +1,378 @@
+"""Feature engineering of the model selection notebook.
+
+Each function mirrors a step of notebooks/02_model_selection.ipynb and
+produces the same columns, but per-group rolling and EWM statistics use the
+grouped rolling/ewm of pandas instead of a Python lambda per group.
+"""
+
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from app.services.weather_service import WEATHER_THRESHOLDS  # noqa: E402
+
+TARGETS = ["arrival_delay", "departure_delay"]
+
+CATEGORICAL_COLUMNS = [
+    "train_type",
+    "route",
+    "initial_departure_station",
+    "final_arrival_station",
+    "current_station",
+    "next_station",
+]
+
+# Candidate features of the notebook, before feature importance selection
+FEATURES = [
+    # Basic Features
+    "day_of_week",
+    "route",
+    "current_station",
+    "next_station",
+    "sequence",
+    "number_of_stations",
+    "trip_duration",
+    "subtrip_duration",
+    "trip_distance",
+    "subtrip_distance",
+    "travelled_distance",
+    "remaining_distance",
+    "departure_hour",
+    "arrival_hour",
+    "scheduled_dwelling_time",
+    "day",
+    "is_weekend",
+    # Weather Features On Departure
+    "temperature_on_departure",
+    "relative_humidity_on_departure",
+    "dew_point_on_departure",
+    "apparent_temperature_on_departure",
+    "precipitation_on_departure",
+    "visibility_on_departure",
+    "wind_speed_on_departure",
+    "wind_direction_on_departure",
+    "wind_gusts_on_departure",
+    "uv_index_on_departure",
+    "cloud_cover_on_departure",
+    "surface_pressure_on_departure",
+    "moderate_rain",
+    "strong_wind",
+    "poor_visibility",
+    "extreme_temp",
+    # Weather Features On Arrival
+    "temperature_on_arrival",
+    "relative_humidity_on_arrival",
+    "dew_point_on_arrival",
+    "apparent_temperature_on_arrival",
+    "precipitation_on_arrival",
+    "visibility_on_arrival",
+    "wind_speed_on_arrival",
+    "wind_direction_on_arrival",
+    "wind_gusts_on_arrival",
+    "uv_index_on_arrival",
+    "cloud_cover_on_arrival",
+    "surface_pressure_on_arrival",
+    # Progress Features
+    "route_progress",
+    "stations_remaining",
+    "distance_progress",
+    # Trip Sequence Features
+    "is_first_trip",
+    "is_last_trip",
+    # Route-Station Historical Features
+    "route_station_ewm_7days_arrival_delay",
+    "route_station_ewm_7days_departure_delay",
+    "route_station_avg_total_arr",
+    "route_station_median_total_arr",
+    "route_station_std_total_arr",
+    "route_station_max_total_arr",
+    "route_station_min_total_arr",
+    "route_station_avg_total_dep",
+    "route_station_median_total_dep",
+    "route_station_std_total_dep",
+    "route_station_max_total_dep",
+    "route_station_min_total_dep",
+    "route_station_avg_7day_arrival_delay",
+    "route_station_median_7day_arrival_delay",
+    "route_station_std_7day_arrival_delay",
+    "route_station_max_7day_arrival_delay",
+    "route_station_min_7day_arrival_delay",
+    "route_station_avg_7day_departure_delay",
+    "route_station_median_7day_departure_delay",
+    "route_station_std_7day_departure_delay",
+    "route_station_max_7day_departure_delay",
+    "route_station_min_7day_departure_delay",
+    # Hourly and Daily Patterns
+    "route_hour_pattern_avg_arrival_delay",
+    "route_hour_pattern_median_arrival_delay",
+    "route_hour_pattern_rolling_arrival_delay",
+    "route_hour_pattern_std_arrival_delay",
+    "route_day_of_week_pattern_avg_arrival_delay",
+    "route_day_of_week_pattern_median_arrival_delay",
+    "route_hour_pattern_avg_departure_delay",
+    "route_hour_pattern_median_departure_delay",
+    "route_hour_pattern_rolling_departure_delay",
+    "route_hour_pattern_std_departure_delay",
+    "route_day_of_week_pattern_avg_departure_delay",
+    "route_day_of_week_pattern_median_departure_delay",
+]
+
+
+def load_trips_data(path: str) -> pd.DataFrame:
+    """
+    Loads trips_data and formats its columns like the notebook.
+
+    Args:
+        path (str): trips_data.csv or a directory of per-date partitions.
+
+    Returns:
+        pd.DataFrame: Deduplicated subtrips with year, month and day columns.
+    """
+    if os.path.isdir(path):
+        from incremental_features import read_partitions
+
+        trip_data = read_partitions(path)
+    else:
+        trip_data = pd.read_csv(path)
+    return format_trips_data(trip_data)
+
+
+def format_trips_data(trip_data: pd.DataFrame) -> pd.DataFrame:
+    """Deduplicates subtrips and splits their date like the notebook"""
+    trip_data = trip_data.drop_duplicates().reset_index(drop=True)
+
+    dates = pd.to_datetime(trip_data["date"])
+    trip_data["date"] = dates.dt.date
+    trip_data["year"] = dates.dt.year
+    trip_data["month"] = dates.dt.month
+    trip_data["day"] = dates.dt.day
+    return trip_data
+
+
+def encode_categoricals(
+    trip_data: pd.DataFrame, columns: Optional[List[str]] = None
+) -> Dict[str, LabelEncoder]:
+    """
+    Label encodes the categorical columns in place.
+
+    Args:
+        trip_data (pd.DataFrame): Subtrips to encode.
+        columns (list): Columns to encode, defaults to CATEGORICAL_COLUMNS.
+
+    Returns:
+        dict: Fitted LabelEncoder per column, as loaded by the API.
+    """
+    label_encoders = {}
+    for col in columns or CATEGORICAL_COLUMNS:
+        le = LabelEncoder()
+        trip_data[col] = le.fit_transform(trip_data[col].astype(str))
+        label_encoders[col] = le
+    return label_encoders
+
+
+def apply_encoders(
+    trip_data: pd.DataFrame, label_encoders: Dict[str, LabelEncoder]
+) -> pd.DataFrame:
+    """
+    Label encodes the categorical columns with already fitted encoders.
+
+    Args:
+        trip_data (pd.DataFrame): Subtrips to encode.
+        label_encoders (dict): LabelEncoder per column, from encode_categoricals.
+
+    Returns:
+        pd.DataFrame: Encoded copy of the subtrips whose categories are all
+            known to the encoders, the other rows need a retrained model.
+    """
+    known = pd.Series(True, index=trip_data.index)
+    for col, le in label_encoders.items():
+        known &= trip_data[col].astype(str).isin(le.classes_)
+    encoded = trip_data[known].copy()
+    for col, le in label_encoders.items():
+        encoded[col] = le.transform(encoded[col].astype(str))
+    return encoded
+
+
+def _grouped_shifted(
+    df: pd.DataFrame, group_cols: List[str], target: str
+) -> Tuple[pd.Series, List[pd.Series]]:
+    """Target shifted by one row inside each group, with the group keys"""
+    shifted = df.groupby(group_cols)[target].shift(1)
+    return shifted, [df[col] for col in group_cols]
+
+
+def _ungroup(result: pd.Series, group_cols: List[str], index: pd.Index) -> pd.Series:
+    """Align a grouped rolling/ewm result back on the rows of the frame"""
+    return result.droplevel(list(range(len(group_cols)))).reindex(index)
+
+
+def add_rolling_features(
+    df: pd.DataFrame,
+    group_cols: List[str],
+    target: str,
+    windows: List[int],
+    prefix: str,
+) -> pd.DataFrame:
+    """
+    Adds rolling window statistics of the previous rows of each group.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        group_cols (list): Columns to group by.
+        target (str): Target column for feature creation.
+        windows (list): Window sizes in rows.
+        prefix (str): Prefix for created feature names.
+
+    Returns:
+        pd.DataFrame: Input dataframe with the new columns, sorted by group
+            and date as in the notebook.
+    """
+    shifted, keys = _grouped_shifted(df, group_cols, target)
+    for window in windows:
+        rolling = shifted.groupby(keys).rolling(window, min_periods=1, closed="left")
+        for stat, decimals in [
+            ("avg", 2),
+            ("median", None),
+            ("std", 2),
+            ("max", None),
+            ("min", None),
+        ]:
+            method = "mean" if stat == "avg" else stat
+            values = _ungroup(getattr(rolling, method)(), group_cols, df.index)
+            if decimals is not None:
+                values = values.round(decimals)
+            df[f"{prefix}_{stat}_{window}day_{target}"] = values
+    return df.sort_values(group_cols + ["date"])
+
+
+def add_ewm_features(
+    df: pd.DataFrame, group_cols: List[str], target: str, prefix: str
+) -> pd.DataFrame:
+    """Adds the 7 rows exponential weighted mean of the previous rows of each group"""
+    shifted, keys = _grouped_shifted(df, group_cols, target)
+    ewm = shifted.groupby(keys).ewm(span=7, min_periods=1).mean()
+    df[f"{prefix}_ewm_7days_{target}"] = _ungroup(ewm, group_cols, df.index).round(2)
+    return df.sort_values(group_cols + ["date"])
+
+
+def add_hourly_daily_patterns(
+    df: pd.DataFrame, group_cols: List[str], target: str, prefix: str
+) -> pd.DataFrame:
+    """
+    Adds hourly and daily delay patterns of each group.
+
+    Args:
+        df (pd.DataFrame): Input dataframe.
+        group_cols (list): Columns to group by.
+        target (str): Target column for feature creation.
+        prefix (str): Prefix for created feature names.
+
+    Returns:
+        pd.DataFrame: Input dataframe with the new columns.
+    """
+    hourly = df.groupby(group_cols + ["departure_hour"])[target]
+    df[f"{prefix}_hour_pattern_avg_{target}"] = hourly.transform("mean").round(2)
+    df[f"{prefix}_hour_pattern_median_{target}"] = hourly.transform("median")
+
+    hour_cols = group_cols + ["departure_hour"]
+    ordered = df.sort_values(hour_cols + ["date"], kind="stable")
+    shifted, keys = _grouped_shifted(ordered, hour_cols, target)
+    rolling = shifted.groupby(keys).rolling(7, min_periods=1).mean()
+    df[f"{prefix}_hour_pattern_rolling_{target}"] = _ungroup(
+        rolling, hour_cols, df.index
+    ).round(2)
+    df[f"{prefix}_hour_pattern_std_{target}"] = hourly.transform("std").round(2)
+
+    daily = df.groupby(group_cols + ["day_of_week"])[target]
+    df[f"{prefix}_day_of_week_pattern_avg_{target}"] = daily.transform("mean").round(2)
+    df[f"{prefix}_day_of_week_pattern_median_{target}"] = daily.transform("median")
+    return df
+
+
+def create_weather_features(
+    df: pd.DataFrame, thresholds: Dict[str, float] = WEATHER_THRESHOLDS
+) -> pd.DataFrame:
+    """Adds binary weather condition features"""
+    df["moderate_rain"] = (
+        df["precipitation_on_departure"] > thresholds["moderate_rain"]
+    ).astype(int)
+    df["strong_wind"] = (
+        df["wind_speed_on_departure"] > thresholds["strong_wind"]
+    ).astype(int)
+    df["poor_visibility"] = (
+        df["visibility_on_departure"] < thresholds["poor_visibility"]
+    ).astype(int)
+    df["extreme_temp"] = (
+        (df["temperature_on_departure"] < thresholds["extreme_temp_low"])
+        | (df["temperature_on_departure"] > thresholds["extreme_temp_high"])
+    ).astype(int)
+    return df
+
+
+def add_historical_patterns(df: pd.DataFrame, group_cols: List[str]) -> pd.DataFrame:
+    """Adds whole-history delay statistics by route and station"""
+    df = df.sort_values(["date", "route", "departure_hour", "sequence"])
+    for target in TARGETS:
+        prefix = "route_station"
+        grouped = df.groupby(group_cols)[target]
+        df[f"{prefix}_avg_total_{target[:3]}"] = grouped.transform("mean").round(2)
+        df[f"{prefix}_median_total_{target[:3]}"] = grouped.transform("median")
+        df[f"{prefix}_std_total_{target[:3]}"] = grouped.transform("std").round(2)
+        df[f"{prefix}_max_total_{target[:3]}"] = grouped.transform("max")
+        df[f"{prefix}_min_total_{target[:3]}"] = grouped.transform("min")
+    return df
+
+
+def create_all_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Creates all the features of the notebook.
+
+    Args:
+        df (pd.DataFrame): Encoded subtrips from load_trips_data.
+
+    Returns:
+        pd.DataFrame: Copy of the subtrips with the engineered features.
+    """
+    result = df.copy()
+
+    # 1. Basic temporal features
+    result["day_of_week"] = pd.to_datetime(result["date"]).dt.dayofweek
+    result["is_weekend"] = result["day_of_week"].isin([6, 7]).astype(int)
+
+    # 2. Progress features
+    result["route_progress"] = (
+        result["sequence"] / result["number_of_stations"]
+    ).round(2)
+    result["stations_remaining"] = (
+        result["number_of_stations"] - result["sequence"]
+    ).round(2)
+    result["distance_progress"] = (
+        result["travelled_distance"] / result["trip_distance"]
+    ).round(2)
+
+    # 3. Weather features
+    result = create_weather_features(result)
+
+    # 4. Historical patterns
+    group_cols = ["route", "current_station"]
+    result = add_historical_patterns(result, group_cols)
+
+    # 5. Rolling window features
+    for target in TARGETS:
+        result = add_rolling_features(result, group_cols, target, [7], "route_station")
+        result = add_ewm_features(result, group_cols, target, "route_station")
+
+    # 6. Trip sequence features
+    result["is_first_trip"] = (result["sequence"] == 1).astype(int)
+    result["is_last_trip"] = (
+        result["sequence"] == result.groupby("trip_id")["sequence"].transform("max")
+    ).astype(int)
+
+    # 7. Hourly and daily patterns
+    for target in TARGETS:
+        result = add_hourly_daily_patterns(result, ["route"], target, "route")
+    return result
@@ -0,0 +1,263 @@
+"""Local PostgREST-compatible stand-in for the Supabase tables.
+
+Serves pandas DataFrames under /rest/v1/<table> and understands the subset of
+the PostgREST query syntax used by the project: select, eq/neq/gt/gte/lt/lte/in
+filters, order, limit and offset, plus inserts, upserts (on_conflict) and
+filtered deletes.
+Point create_client at the printed URL to run the export and feature scripts
+without a Supabase project.
+
+Usage:
+    python postgrest_stub.py --table trips=../data/trips.csv --port 54321
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "neq": lambda column, value: column != value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
+RESERVED_PARAMS = {"select", "order", "limit", "offset"}
+
+
+def _typed(column: pd.Series, value: str):
+    """Convert a filter value to the type of the filtered column"""
+    if pd.api.types.is_bool_dtype(column):
+        return value.lower() == "true"
+    if pd.api.types.is_integer_dtype(column):
+        return int(value)
+    if pd.api.types.is_float_dtype(column):
+        return float(value)
+    return value
+
+
+def filter_mask(df: pd.DataFrame, params: list) -> pd.Series:
+    """Rows matching the filters of decoded PostgREST query parameters"""
+    mask = pd.Series(True, index=df.index)
+    for name, value in params:
+        if name in RESERVED_PARAMS:
+            continue
+        operator, _, operand = value.partition(".")
+        column = df[name]
+        if operator == "in":
+            values = [
+                _typed(column, v.strip('"')) for v in operand.strip("()").split(",")
+            ]
+            mask &= column.isin(values)
+        elif operator == "is" and operand == "null":
+            mask &= column.isna()
+        else:
+            mask &= OPERATORS[operator](column, _typed(column, operand))
+    return mask
+
+
+def query_table(df: pd.DataFrame, params: list) -> pd.DataFrame:
+    """
+    Applies PostgREST query parameters to a DataFrame.
+
+    Args:
+        df (pd.DataFrame): Table content.
+        params (list): Decoded (name, value) query parameters.
+
+    Returns:
+        pd.DataFrame: Selected rows and columns.
+    """
+    options = {name: value for name, value in params if name in RESERVED_PARAMS}
+    result = df[filter_mask(df, params)]
+
+    if "order" in options:
+        columns, ascending = [], []
+        for term in options["order"].split(","):
+            name, _, direction = term.partition(".")
+            columns.append(name)
+            ascending.append(not direction.startswith("desc"))
+        result = result.sort_values(columns, ascending=ascending, kind="stable")
+    offset = int(options.get("offset", 0))
+    limit = options.get("limit")
+    result = result.iloc[offset : offset + int(limit) if limit is not None else None]
+
+    select = options.get("select", "*")
+    if select != "*":
+        columns = [column.strip() for column in select.split(",")]
+        result = result[list(dict.fromkeys(columns))]
+    return result
+
+
+def upsert_rows(
+    df: pd.DataFrame, rows: pd.DataFrame, on_conflict: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Inserts rows, replacing the existing rows with the same on_conflict key.
+
+    Args:
+        df (pd.DataFrame): Table content.
+        rows (pd.DataFrame): Rows to insert.
+        on_conflict (str): Comma separated key columns, None for plain inserts.
+
+    Returns:
+        pd.DataFrame: Updated table content.
+    """
+    if df.empty:
+        return rows.reset_index(drop=True)
+    if on_conflict:
+        keys = [column.strip() for column in on_conflict.split(",")]
+        existing = pd.MultiIndex.from_frame(df[keys].astype(str))
+        incoming = pd.MultiIndex.from_frame(rows[keys].astype(str))
+        df = df[~existing.isin(incoming)]
+    return pd.concat([df, rows], ignore_index=True)
+
+
+class PostgrestStub:
+    """Threaded HTTP server exposing DataFrames through the PostgREST API"""
+
+    def __init__(
+        self,
+        tables: Dict[str, pd.DataFrame],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+    ) -> None:
+        self.tables = tables
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass to create_client"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """PostgREST request handler"""
+
+            def do_GET(self):  # noqa: N802
+                parts = urlsplit(self.path)
+                table = parts.path.rstrip("/").rsplit("/", 1)[-1]
+                if not parts.path.startswith("/rest/v1/") or table not in stub.tables:
+                    self._reply(404, {"message": f"relation {table} does not exist"})
+                    return
+                try:
+                    result = query_table(stub.tables[table], parse_qsl(parts.query))
+                except (KeyError, ValueError) as _e:
+                    self._reply(400, {"message": str(_e)})
+                    return
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = result.to_json(orient="records", date_format="iso")
+                self._reply(200, body)
+
+            def do_POST(self):  # noqa: N802
+                parts = urlsplit(self.path)
+                table = parts.path.rstrip("/").rsplit("/", 1)[-1]
+                if table not in stub.tables:
+                    self._reply(404, {"message": f"relation {table} does not exist"})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                records = json.loads(self.rfile.read(length) or b"[]")
+                if isinstance(records, dict):
+                    records = [records]
+                params = dict(parse_qsl(parts.query))
+                with stub.lock:
+                    stub.tables[table] = upsert_rows(
+                        stub.tables[table],
+                        pd.DataFrame(records),
+                        params.get("on_conflict"),
+                    )
+                stub.requests += 1
+                self._reply(201, records)
+
+            def do_DELETE(self):  # noqa: N802
+                parts = urlsplit(self.path)
+                table = parts.path.rstrip("/").rsplit("/", 1)[-1]
+                if table not in stub.tables:
+                    self._reply(404, {"message": f"relation {table} does not exist"})
+                    return
+                with stub.lock:
+                    df = stub.tables[table]
+                    try:
+                        mask = filter_mask(df, parse_qsl(parts.query))
+                    except (KeyError, ValueError) as _e:
+                        self._reply(400, {"message": str(_e)})
+                        return
+                    stub.tables[table] = df[~mask].reset_index(drop=True)
+                stub.requests += 1
+                self._reply(200, df[mask].to_json(orient="records", date_format="iso"))
+
+            def _reply(self, status: int, body) -> None:
+                payload = (body if isinstance(body, str) else json.dumps(body)).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):  # noqa: A002
+                pass
+
+        return Handler
+
+    def start(self) -> "PostgrestStub":
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Shut the server down"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "PostgrestStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--table",
+        action="append",
+        default=[],
+        help="name=path of a CSV or Parquet file, can be repeated",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    tables = {}
+    for spec in args.table:
+        name, _, path = spec.partition("=")
+        reader = pd.read_parquet if path.endswith(".parquet") else pd.read_csv
+        tables[name] = reader(path)
+    stub = PostgrestStub(tables, args.host, args.port, args.latency)
+    print(f"Serving {', '.join(tables) or 'no tables'} on {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
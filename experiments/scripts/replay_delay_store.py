@@ -0,0 +1,204 @@
+"""Rebuild the online delay aggregate store from history and verify it.
+
+Subtrips are replayed in chronological order: for every row the features
+served by the store are read first, then the row's delays are ingested, which
+is what happens in production. The served values are compared with the
+rolling, EWM and hourly rolling features of model_features, the code building
+the training set, run on the same ordering. Served features the training set
+does not have (counts, station and train hour windows) are compared with a
+pandas rolling computation instead. The store is then saved for the API
+(DELAY_STORE_PATH).
+
+Usage:
+    python replay_delay_store.py --history ../data/trips_data --output ../models/delay_store.joblib
+"""
+
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from app.services.delay_store import (  # noqa: E402
+    ROUNDED_STATS,
+    TARGETS,
+    DelayAggregateStore,
+    RollingSpec,
+)
+from model_features import (  # noqa: E402
+    add_ewm_features,
+    add_hourly_daily_patterns,
+    add_rolling_features,
+)
+
+OFFLINE_STATS = {
+    "avg": "mean",
+    "median": "median",
+    "std": "std",
+    "max": "max",
+    "min": "min",
+    "count": "count",
+}
+
+
+def load_history(path: str) -> pd.DataFrame:
+    """
+    Loads trips_data in chronological order.
+
+    Args:
+        path (str): trips_data.csv or a directory of per-date partitions.
+
+    Returns:
+        pd.DataFrame: Subtrips sorted by trip date then scheduled departure
+            time, the order of the training features (subtrips after midnight
+            stay with the trips of the previous day).
+    """
+    if os.path.isdir(path):
+        from incremental_features import read_partitions
+
+        history = read_partitions(path)
+    else:
+        history = pd.read_csv(path)
+    history["_departure"] = pd.to_datetime(history["scheduled_departure_time"])
+    history["_date"] = pd.to_datetime(history["date"])
+    history = history.sort_values(["_date", "_departure"], kind="stable")
+    return history.drop(columns=["_date", "_departure"]).reset_index(drop=True)
+
+
+def training_features(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rolling features computed by model_features as in create_all_features.
+
+    Args:
+        history (pd.DataFrame): Subtrips in chronological order.
+
+    Returns:
+        pd.DataFrame: History with the feature columns, aligned with history.
+    """
+    # The functions sort their output, but compute on the order they are given
+    group_cols = ["route", "current_station"]
+    df = history.copy()
+    for target in TARGETS:
+        df = add_rolling_features(df, group_cols, target, [7], "route_station")
+        df = add_ewm_features(
+            df.loc[history.index], group_cols, target, "route_station"
+        )
+        df = add_hourly_daily_patterns(
+            df.loc[history.index], ["route"], target, "route"
+        )
+        df = df.loc[history.index]
+    return df
+
+
+def reference_features(history: pd.DataFrame, spec: RollingSpec) -> pd.DataFrame:
+    """
+    Rolling features of a spec computed with pandas, for the features the
+    training set does not have.
+
+    Args:
+        history (pd.DataFrame): Subtrips in chronological order.
+        spec (RollingSpec): Spec to compute.
+
+    Returns:
+        pd.DataFrame: One column per feature, aligned with history.
+    """
+    result = pd.DataFrame(index=history.index)
+    groups = history.groupby(list(spec.keys), sort=False, dropna=True)
+    for target in TARGETS:
+        for stat in spec.stats:
+            result[spec.feature_name(stat, target)] = groups[target].transform(
+                lambda x: getattr(
+                    x.shift(spec.lag).rolling(spec.window, min_periods=1),
+                    OFFLINE_STATS[stat],
+                )()
+            )
+        if spec.ewm_span:
+            result[spec.feature_name("ewm", target)] = groups[target].transform(
+                lambda x: x.shift(1).ewm(span=spec.ewm_span, min_periods=1).mean()
+            )
+    for column in result.columns:
+        for stat, decimals in ROUNDED_STATS.items():
+            if column in {spec.feature_name(stat, t) for t in TARGETS}:
+                result[column] = result[column].round(decimals)
+    return result
+
+
+def replay(history: pd.DataFrame, store: DelayAggregateStore) -> pd.DataFrame:
+    """Serve then ingest every subtrip, returning the served features"""
+    columns = sorted(
+        {column for spec in store.specs for column in spec.keys} | set(TARGETS)
+    )
+    served = []
+    for record in history[columns].to_dict("records"):
+        served.append(store.features(record))
+        store.ingest(record)
+    return pd.DataFrame(served, index=history.index)
+
+
+def verify(history: pd.DataFrame, served: pd.DataFrame, store: DelayAggregateStore):
+    """
+    Compare served features with the training and reference computations.
+
+    Returns:
+        tuple: Mismatching rows per feature and the features checked against
+            the training code.
+    """
+    training = training_features(history)
+    mismatches, checked = {}, []
+    for spec in store.specs:
+        reference = reference_features(history, spec)
+        for column in reference.columns:
+            if column in training.columns:
+                expected = training[column]
+                checked.append(column)
+            else:
+                expected = reference[column]
+            actual = served[column].to_numpy(dtype=float)
+            wanted = expected.to_numpy(dtype=float)
+            if column.endswith(tuple(f"_count_{spec.window}day_{t}" for t in TARGETS)):
+                wanted = np.nan_to_num(wanted)
+            close = np.isclose(actual, wanted, rtol=1e-5, atol=1e-6, equal_nan=True)
+            if not close.all():
+                mismatches[column] = int((~close).sum())
+    return mismatches, checked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", default="../data/trips_data.csv")
+    parser.add_argument("--output", default="../models/delay_store.joblib")
+    parser.add_argument(
+        "--no-verify",
+        action="store_true",
+        help="Only ingest the history, without comparing with pandas",
+    )
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    store = DelayAggregateStore()
+    start_time = perf_counter()
+    if args.no_verify:
+        store.ingest_frame(history)
+    else:
+        served = replay(history, store)
+    print(f"Replayed {len(history):,} subtrips in {perf_counter() - start_time:.1f} s")
+
+    if not args.no_verify:
+        mismatches, checked = verify(history, served, store)
+        if mismatches:
+            print(f"Mismatching features: {mismatches}")
+            sys.exit(1)
+        print(
+            f"All {served.shape[1]} features match, {len(checked)} of them "
+            "against model_features"
+        )
+
+    store.save(args.output)
+    print(f"Store saved to {args.output}: {store.stats()}")
+
+
+if __name__ == "__main__":
+    main()
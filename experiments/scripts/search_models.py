@@ -0,0 +1,476 @@
+"""Successive-halving search over hyperparameters and feature subsets.
+
+Replaces the exhaustive GridSearchCV and the SelectFromModel threshold loop of
+notebooks/02_model_selection.ipynb with one budgeted search. Candidates pair a
+config of the train_models grid with the top-k features of a reference model,
+where k takes every distinct importance threshold of the notebook loop.
+
+All candidates start with a small number of boosting rounds; after each rung
+only the best 1/eta (lowest cross-validated MSE, then fewest features) go on
+with eta times more rounds, up to --max-rounds. Evaluations run in a process
+pool on fold datasets cached on disk as .npy files, columns in importance
+order so that every subset is a column prefix of the same arrays. Each
+evaluation is appended to results.jsonl as it completes; running the command
+again on the same --search-dir resumes where it stopped without reloading
+the data.
+
+The chosen features and parameters are written to features.json and
+params.json (inputs of train_models.py --features/--params), and --export-dir
+fits and exports the final model, whose booster feature_names are the chosen
+features picked up by the API.
+
+Usage:
+    python search_models.py --data ../data/trips_data.csv --search-dir ../models/search --workers 4 --export-dir ../models
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import TimeSeriesSplit
+
+from model_features import FEATURES, TARGETS
+from train_models import (
+    EARLY_STOPPING_ROUNDS,
+    MAX_ROUNDS,
+    PARAM_GRID,
+    SEED,
+    StageProfiler,
+    booster_params,
+    evaluate,
+    export_artifacts,
+    fit_final,
+    grid_configs,
+    prepare_data,
+)
+
+SEARCH_FILE = "search.json"
+RESULTS_FILE = "results.jsonl"
+FOLDS_DIR = "folds"
+
+# Model of the notebook used to rank the features
+REFERENCE_PARAMS = {
+    "max_depth": 9,
+    "learning_rate": 0.1,
+    "subsample": 1.0,
+    "colsample_bytree": 0.8,
+}
+REFERENCE_ROUNDS = 300
+
+
+def rank_features(
+    X: pd.DataFrame, y: pd.DataFrame, nthread: int = -1, max_bin: int = 256
+) -> List[Tuple[str, float]]:
+    """
+    Ranks features by the gain importance of the notebook reference model.
+
+    Args:
+        X (pd.DataFrame): Training features.
+        y (pd.DataFrame): Training targets.
+        nthread (int): Number of threads.
+        max_bin (int): Number of histogram bins.
+
+    Returns:
+        list: (feature, normalized importance), most important first.
+    """
+    dtrain = xgb.QuantileDMatrix(
+        X, y.to_numpy(np.float32), max_bin=max_bin, nthread=nthread
+    )
+    booster = xgb.train(
+        booster_params(REFERENCE_PARAMS, nthread, max_bin), dtrain, REFERENCE_ROUNDS
+    )
+    gain = booster.get_score(importance_type="gain")
+    total = sum(gain.values()) or 1.0
+    importance = [(feature, gain.get(feature, 0.0) / total) for feature in X.columns]
+    return sorted(importance, key=lambda item: -item[1])
+
+
+def subset_sizes(importance: List[float]) -> List[int]:
+    """Number of features kept by each distinct SelectFromModel threshold"""
+    values = np.asarray(importance)
+    return sorted({int((values >= threshold).sum()) for threshold in values})
+
+
+def write_fold_cache(
+    cache_dir: str, X: pd.DataFrame, y: pd.DataFrame, n_splits: int
+) -> int:
+    """
+    Writes the train and validation arrays of every fold as .npy files.
+
+    Args:
+        cache_dir (str): Directory of the cache.
+        X (pd.DataFrame): Training features, in importance order.
+        y (pd.DataFrame): Training targets.
+        n_splits (int): Number of TimeSeriesSplit folds.
+
+    Returns:
+        int: Number of folds.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    values = X.to_numpy(np.float32)
+    targets = y.to_numpy(np.float32)
+    splits = TimeSeriesSplit(n_splits=n_splits).split(values)
+    for fold, (train_index, val_index) in enumerate(splits):
+        for part, index in [("train", train_index), ("val", val_index)]:
+            np.save(os.path.join(cache_dir, f"fold{fold}_{part}_X.npy"), values[index])
+            np.save(os.path.join(cache_dir, f"fold{fold}_{part}_y.npy"), targets[index])
+    return n_splits
+
+
+# State of a pool worker, set by _init_worker
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(
+    cache_dir: str, n_folds: int, features: List[str], nthread: int, max_bin: int
+) -> None:
+    _WORKER.update(
+        cache_dir=cache_dir,
+        n_folds=n_folds,
+        features=features,
+        nthread=nthread,
+        max_bin=max_bin,
+        matrices=OrderedDict(),
+    )
+
+
+def _fold_matrices(
+    n_features: int,
+) -> List[Tuple[xgb.QuantileDMatrix, xgb.QuantileDMatrix]]:
+    """Quantized folds of the top n_features, the last two subsets stay cached"""
+    matrices = _WORKER["matrices"]
+    if n_features in matrices:
+        matrices.move_to_end(n_features)
+        return matrices[n_features]
+
+    def load(fold: int, part: str) -> Tuple[np.ndarray, np.ndarray]:
+        path = os.path.join(_WORKER["cache_dir"], f"fold{fold}_{part}")
+        X = np.load(f"{path}_X.npy", mmap_mode="r")[:, :n_features]
+        return np.ascontiguousarray(X), np.load(f"{path}_y.npy")
+
+    names = _WORKER["features"][:n_features]
+    folds = []
+    for fold in range(_WORKER["n_folds"]):
+        X, y = load(fold, "train")
+        dtrain = xgb.QuantileDMatrix(
+            X,
+            y,
+            feature_names=names,
+            max_bin=_WORKER["max_bin"],
+            nthread=_WORKER["nthread"],
+        )
+        X, y = load(fold, "val")
+        dval = xgb.QuantileDMatrix(
+            X,
+            y,
+            feature_names=names,
+            ref=dtrain,
+            max_bin=_WORKER["max_bin"],
+            nthread=_WORKER["nthread"],
+        )
+        folds.append((dtrain, dval))
+    matrices[n_features] = folds
+    if len(matrices) > 2:
+        matrices.popitem(last=False)
+    return folds
+
+
+def _evaluate(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Cross-validates one candidate with a budget of boosting rounds"""
+    start_time = time.perf_counter()
+    params = booster_params(task["params"], _WORKER["nthread"], _WORKER["max_bin"])
+    scores, rounds = [], []
+    for dtrain, dval in _fold_matrices(task["n_features"]):
+        booster = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=task["budget"],
+            evals=[(dval, "val")],
+            early_stopping_rounds=task["early_stopping_rounds"],
+            verbose_eval=False,
+        )
+        scores.append(booster.best_score**2)
+        rounds.append(booster.best_iteration + 1)
+    return {
+        "id": task["id"],
+        "budget": task["budget"],
+        "mse": float(np.mean(scores)),
+        "fold_mse": [float(score) for score in scores],
+        "rounds": rounds,
+        "seconds": round(time.perf_counter() - start_time, 2),
+    }
+
+
+def make_candidates(
+    grid: Dict[str, List[Any]], sizes: List[int], n_candidates: int, seed: int = SEED
+) -> List[Dict[str, Any]]:
+    """Random sample of (config, number of features) pairs"""
+    pairs = [
+        {"params": config, "n_features": size}
+        for config in grid_configs(grid)
+        for size in sizes
+    ]
+    rng = np.random.default_rng(seed)
+    if n_candidates < len(pairs):
+        pairs = [pairs[i] for i in sorted(rng.choice(len(pairs), n_candidates, False))]
+    return [{"id": i, **pair} for i, pair in enumerate(pairs)]
+
+
+def rung_budgets(min_rounds: int, max_rounds: int, eta: int) -> List[int]:
+    """Boosting rounds of each rung, multiplied by eta up to max_rounds"""
+    budgets = []
+    budget = min_rounds
+    while budget < max_rounds:
+        budgets.append(budget)
+        budget *= eta
+    return budgets + [max_rounds]
+
+
+def load_results(search_dir: str) -> Dict[Tuple[int, int], Dict[str, Any]]:
+    """Completed evaluations by (candidate id, budget)"""
+    results = {}
+    path = os.path.join(search_dir, RESULTS_FILE)
+    if not os.path.exists(path):
+        return results
+    with open(path, "r") as _f:
+        for line in _f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut by an interrupted run
+                continue
+            results[(result["id"], result["budget"])] = result
+    return results
+
+
+def successive_halving(
+    search_dir: str,
+    search: Dict[str, Any],
+    workers: int,
+    nthread: int,
+    max_bin: int,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Runs the rungs of a search, skipping evaluations already in results.jsonl.
+
+    Args:
+        search_dir (str): Directory of the search.
+        search (dict): Content of search.json.
+        workers (int): Number of worker processes.
+        nthread (int): Total thread budget, split between the workers.
+        max_bin (int): Number of histogram bins.
+
+    Returns:
+        tuple: Best candidate and its result at the last rung.
+    """
+    candidates = search["candidates"]
+    done = load_results(search_dir)
+    survivors = [candidate["id"] for candidate in candidates]
+    initargs = (
+        os.path.join(search_dir, FOLDS_DIR),
+        search["n_folds"],
+        [feature for feature, _ in search["ranking"]],
+        max(1, nthread // workers),
+        max_bin,
+    )
+    results_path = os.path.join(search_dir, RESULTS_FILE)
+    if os.path.exists(results_path) and os.path.getsize(results_path):
+        with open(results_path, "rb+") as _f:
+            _f.seek(-1, os.SEEK_END)
+            if _f.read(1) != b"\n":
+                # Close the line cut by an interrupted run
+                _f.write(b"\n")
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=initargs
+    ) as pool, open(results_path, "a") as results_file:
+        for rung, budget in enumerate(search["budgets"]):
+            pending = [i for i in survivors if (i, budget) not in done]
+            print(
+                f"Rung {rung}: {len(survivors)} candidates, {budget} rounds, "
+                f"{len(survivors) - len(pending)} already evaluated"
+            )
+            # Same subsets next to each other, so workers reuse their matrices
+            pending.sort(key=lambda i: candidates[i]["n_features"])
+            futures = [
+                pool.submit(
+                    _evaluate,
+                    {
+                        **candidates[i],
+                        "budget": budget,
+                        "early_stopping_rounds": search["early_stopping_rounds"],
+                    },
+                )
+                for i in pending
+            ]
+            for count, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                done[(result["id"], budget)] = result
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+                candidate = candidates[result["id"]]
+                print(
+                    f"  [{count}/{len(pending)}] {candidate['params']} "
+                    f"top {candidate['n_features']} features: "
+                    f"mse={result['mse']:.2f} ({result['seconds']:.1f} s)"
+                )
+
+            survivors.sort(
+                key=lambda i: (done[(i, budget)]["mse"], candidates[i]["n_features"])
+            )
+            if rung < len(search["budgets"]) - 1:
+                survivors = survivors[
+                    : max(1, math.ceil(len(survivors) / search["eta"]))
+                ]
+
+    best = survivors[0]
+    return candidates[best], done[(best, search["budgets"][-1])]
+
+
+def create_search(
+    search_dir: str,
+    train_data: pd.DataFrame,
+    features: List[str],
+    grid: Dict[str, List[Any]],
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    """Ranks the features, caches the folds and writes search.json"""
+    X, y = train_data[features], train_data[TARGETS]
+    ranking = rank_features(X, y, args.nthread, args.max_bin)
+    ordered = [feature for feature, _ in ranking]
+    n_folds = write_fold_cache(
+        os.path.join(search_dir, FOLDS_DIR), X[ordered], y, args.n_splits
+    )
+    search = {
+        "data": args.data,
+        "ranking": ranking,
+        "n_folds": n_folds,
+        "eta": args.eta,
+        "budgets": rung_budgets(args.min_rounds, args.max_rounds, args.eta),
+        "early_stopping_rounds": args.early_stopping_rounds,
+        "candidates": make_candidates(
+            grid, subset_sizes([value for _, value in ranking]), args.n_candidates
+        ),
+    }
+    # Written last: the search is only resumable once the fold cache is complete
+    path = os.path.join(search_dir, SEARCH_FILE)
+    with open(f"{path}.tmp", "w") as _f:
+        json.dump(search, _f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    return search
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data",
+        default="../data/trips_data.csv",
+        help="trips_data.csv or a directory of per-date partitions",
+    )
+    parser.add_argument("--search-dir", default="../models/search")
+    parser.add_argument(
+        "--features", help="JSON list of candidate features, defaults to FEATURES"
+    )
+    parser.add_argument("--grid", help="JSON parameter grid, defaults to PARAM_GRID")
+    parser.add_argument("--n-candidates", type=int, default=256)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--min-rounds", type=int, default=30)
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS)
+    parser.add_argument(
+        "--early-stopping-rounds", type=int, default=EARLY_STOPPING_ROUNDS
+    )
+    parser.add_argument("--n-splits", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--nthread", type=int, default=os.cpu_count(), help="Total thread budget"
+    )
+    parser.add_argument("--max-bin", type=int, default=256)
+    parser.add_argument(
+        "--export-dir", help="Fit the chosen model and export the API artifacts"
+    )
+    parser.add_argument("--version", default="v1.0")
+    parser.add_argument(
+        "--no-default",
+        action="store_true",
+        help="Keep the current registry default model instead of the exported one",
+    )
+    args = parser.parse_args()
+
+    profiler = StageProfiler()
+    os.makedirs(args.search_dir, exist_ok=True)
+    search_path = os.path.join(args.search_dir, SEARCH_FILE)
+    data: Optional[Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Any], int]] = None
+    if os.path.exists(search_path):
+        with open(search_path, "r") as _f:
+            search = json.load(_f)
+        print(f"Resuming the search in {args.search_dir}, search options are ignored")
+    else:
+        features = FEATURES
+        if args.features:
+            with open(args.features, "r") as _f:
+                features = json.load(_f)
+        grid = PARAM_GRID
+        if args.grid:
+            with open(args.grid, "r") as _f:
+                grid = json.load(_f)
+        data = prepare_data(args.data, profiler)
+        with profiler.stage("rank and cache"):
+            search = create_search(args.search_dir, data[0], features, grid, args)
+
+    with profiler.stage(f"search ({len(search['candidates'])} candidates)"):
+        best, result = successive_halving(
+            args.search_dir, search, args.workers, args.nthread, args.max_bin
+        )
+    chosen = [feature for feature, _ in search["ranking"][: best["n_features"]]]
+    n_rounds = int(round(np.mean(result["rounds"])))
+    print(
+        f"Best: {best['params']}, {len(chosen)} features, {n_rounds} rounds, "
+        f"mse={result['mse']:.2f}"
+    )
+    with open(os.path.join(args.search_dir, "features.json"), "w") as _f:
+        json.dump(chosen, _f, indent=2)
+    with open(os.path.join(args.search_dir, "params.json"), "w") as _f:
+        json.dump(best["params"], _f, indent=2)
+
+    if args.export_dir:
+        if data is None:
+            data = prepare_data(search["data"], profiler)
+        train_data, test_data, label_encoders, period_days = data
+        with profiler.stage("fit"):
+            dtrain = xgb.QuantileDMatrix(
+                train_data[chosen],
+                train_data[TARGETS].to_numpy(np.float32),
+                max_bin=args.max_bin,
+                nthread=args.nthread,
+            )
+            model = fit_final(
+                dtrain, best["params"], n_rounds, args.nthread, args.max_bin
+            )
+        with profiler.stage("evaluate"):
+            metrics = evaluate(model, test_data[chosen], test_data[TARGETS])
+        export_artifacts(
+            args.export_dir,
+            args.version,
+            model,
+            label_encoders,
+            {
+                **metrics,
+                "samples": len(train_data) + len(test_data),
+                "features": len(chosen),
+                "period_days": period_days,
+                "params": {**best["params"], "n_estimators": n_rounds},
+            },
+            default=not args.no_default,
+        )
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Vectorized subtrip pipeline used to build the trips_data dataset.
+
+Each function mirrors a step of notebooks/00_data_cleaning.ipynb, but works on
+whole columns instead of iterating over rows.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Columns taken from the next station of the trip when building a subtrip
+NEXT_STATION_COLUMNS = [
+    "scheduled_arrival_time",
+    "actual_arrival_time",
+    "arrival_delay",
+]
+
+OUTPUT_COLUMNS = [
+    "trip_id",
+    "subtrip_id",
+    "date",
+    "day_of_week",
+    "train_id",
+    "train_type",
+    "initial_departure_station",
+    "final_arrival_station",
+    "route",
+    "current_station",
+    "next_station",
+    "sequence",
+    "number_of_stations",
+    "trip_duration",
+    "subtrip_duration",
+    "trip_distance",
+    "subtrip_distance",
+    "travelled_distance",
+    "remaining_distance",
+    "scheduled_departure_time",
+    "scheduled_arrival_time",
+    "actual_departure_time",
+    "actual_arrival_time",
+    "departure_delay",
+    "arrival_delay",
+    "departure_hour",
+    "arrival_hour",
+    "scheduled_dwelling_time",
+]
+
+WEATHER_KEY_COLUMNS = ["date", "hour", "station_name"]
+
+# Formats of the trips table, given explicitly to skip the per-value inference
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%H:%M:%S"
+
+
+def build_subtrips(trips: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pairs every station of a trip with the next one to build subtrips.
+
+    A subtrip keeps the row of the current station, takes the arrival
+    information of the next station and is only kept when both stations
+    are consecutive in the trip sequence.
+
+    Args:
+        trips (pd.DataFrame): Raw rows of the trips table.
+
+    Returns:
+        pd.DataFrame: One row per subtrip, ordered by train, date and sequence.
+    """
+    df = trips.sort_values(by=["date", "train_id", "sequence"])
+    # groupby('train_id') keeps the (date, sequence) order inside each train
+    df = df.sort_values(by="train_id", kind="stable")
+
+    train_ids = df["train_id"].to_numpy()
+    sequences = df["sequence"].to_numpy()
+    same_train = train_ids[:-1] == train_ids[1:]
+    consecutive = sequences[1:] == sequences[:-1] + 1
+    current = np.flatnonzero(same_train & consecutive)
+    following = current + 1
+
+    subtrips = df.iloc[current].copy()
+    subtrips["next_station_name"] = df["station_name"].to_numpy()[following]
+    for col in NEXT_STATION_COLUMNS:
+        subtrips[col] = df[col].to_numpy()[following]
+    return subtrips
+
+
+def _trip_ids(df: pd.DataFrame) -> pd.Series:
+    """Hash the trip key once per distinct trip instead of once per row"""
+    key_columns = [
+        "date",
+        "initial_departure_station",
+        "final_arrival_station",
+        "train_id",
+    ]
+    codes = df.groupby(key_columns, sort=False, dropna=False).ngroup().to_numpy()
+    firsts = df[key_columns].iloc[np.unique(codes, return_index=True)[1]]
+    hashes = np.array(
+        [
+            hashlib.sha256("_".join(str(value) for value in key).encode()).hexdigest()
+            for key in firsts.itertuples(index=False)
+        ],
+        dtype=object,
+    )
+    return pd.Series(hashes[codes], index=df.index)
+
+
+def _parse_unique(values: pd.Series, attribute: str = None, **kwargs) -> pd.Series:
+    """
+    pd.to_datetime on the distinct values only, then broadcast back to rows.
+
+    When attribute is given (e.g. "date" or "time"), the matching .dt accessor
+    is also evaluated on the distinct values only.
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = pd.DatetimeIndex(pd.to_datetime(pd.Series(uniques), **kwargs))
+    if attribute is None:
+        return pd.Series(
+            parsed.take(codes, allow_fill=True, fill_value=pd.NaT), index=values.index
+        )
+    converted = np.append(np.asarray(getattr(parsed, attribute), dtype=object), pd.NaT)
+    return pd.Series(converted[codes], index=values.index)
+
+
+def _time_of_day(values: pd.Series) -> pd.Series:
+    """Time elapsed since midnight, truncated to the second"""
+    values = values.dt.floor("s")
+    return values - values.dt.normalize()
+
+
+def add_subtrip_features(
+    df: pd.DataFrame, subtrip_distances: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Adds the trip, schedule, distance and dwelling features to subtrips.
+
+    Args:
+        df (pd.DataFrame): Subtrips returned by build_subtrips.
+        subtrip_distances (pd.DataFrame): Distances between consecutive
+            stations with departure_station, arrival_station, train_type
+            and new_distance columns.
+
+    Returns:
+        pd.DataFrame: Subtrips restricted to OUTPUT_COLUMNS.
+    """
+    df = df.rename(
+        columns={
+            "id": "subtrip_id",
+            "station_name": "current_station",
+            "next_station_name": "next_station",
+        }
+    )
+
+    # Convert date and time columns to appropriate formats
+    dates = _parse_unique(df["date"], format=DATE_FORMAT)
+    scheduled_arrival = _parse_unique(df["scheduled_arrival_time"], format=TIME_FORMAT)
+    scheduled_departure = _parse_unique(
+        df["scheduled_departure_time"], format=TIME_FORMAT
+    )
+    df["date"] = _parse_unique(df["date"], "date", format=DATE_FORMAT)
+    df["actual_arrival_time"] = _parse_unique(
+        df["actual_arrival_time"], "time", format=TIME_FORMAT
+    )
+    df["actual_departure_time"] = _parse_unique(
+        df["actual_departure_time"], "time", format=TIME_FORMAT
+    )
+    df["arrival_hour"] = scheduled_arrival.dt.hour
+    df["departure_hour"] = scheduled_departure.dt.hour
+
+    # add additional columns
+    df["trip_id"] = _trip_ids(df)
+    df["route"] = df["initial_departure_station"] + " - " + df["final_arrival_station"]
+    df["day_of_week"] = dates.dt.weekday  # Monday=0, Sunday=6
+    df["number_of_stations"] = (
+        df.groupby("trip_id")["current_station"].transform("nunique") + 1
+    )  # +1 for the final station
+
+    # combine scheduled arrival and departure times with the date column
+    df["scheduled_arrival_time"] = dates + _time_of_day(scheduled_arrival)
+    df["scheduled_departure_time"] = dates + _time_of_day(scheduled_departure)
+    first_departure = df.groupby("trip_id")["scheduled_departure_time"].transform(
+        "first"
+    )
+    mask_arrival = df["scheduled_arrival_time"] - first_departure < pd.Timedelta(0)
+    mask_departure = df["scheduled_departure_time"] - first_departure < pd.Timedelta(0)
+    df.loc[mask_arrival, "scheduled_arrival_time"] += pd.Timedelta(days=1)
+    df.loc[mask_departure, "scheduled_departure_time"] += pd.Timedelta(days=1)
+
+    # Add trip duration in minutes
+    trips = df.groupby("trip_id")
+    trip_duration = (
+        trips["scheduled_arrival_time"].transform("max")
+        - trips["scheduled_departure_time"].transform("min")
+    ).dt.total_seconds() / 60
+    df["trip_duration"] = trip_duration
+
+    subtrip_duration = _time_of_day(df["scheduled_arrival_time"]) - _time_of_day(
+        df["scheduled_departure_time"]
+    )
+    df["subtrip_duration"] = subtrip_duration.dt.total_seconds() / 60
+
+    # Calculate subtrip distance
+    distances = subtrip_distances.set_index(
+        ["departure_station", "arrival_station", "train_type"]
+    )["new_distance"]
+    positions = distances.index.get_indexer(
+        pd.MultiIndex.from_frame(df[["current_station", "next_station", "train_type"]])
+    )
+    subtrip_distance = distances.to_numpy(dtype=float)[positions]
+    subtrip_distance[positions == -1] = np.nan
+    df["subtrip_distance"] = np.round(subtrip_distance, 2)
+
+    # use subtrip distance to calculate trip distance
+    df["trip_distance"] = df.groupby("trip_id")["subtrip_distance"].transform("sum")
+
+    # add dwelling time
+    previous_arrival = df.groupby("trip_id")["scheduled_arrival_time"].shift(1)
+    dwelling_time = df["scheduled_departure_time"] - previous_arrival
+    df["scheduled_dwelling_time"] = (dwelling_time.dt.total_seconds() // 60).fillna(0)
+
+    # add travelled and remaining distance
+    cumulative_distance = df.groupby("trip_id")["subtrip_distance"].cumsum()
+    df["remaining_distance"] = (
+        df["trip_distance"] - cumulative_distance + df["subtrip_distance"]
+    ).round(2)
+    df["travelled_distance"] = (cumulative_distance - df["subtrip_distance"]).round(2)
+
+    return df[OUTPUT_COLUMNS]
+
+
+def prepare_weather(weather: pd.DataFrame) -> pd.DataFrame:
+    """
+    Splits the weather timestamp into date and hour keys.
+
+    Args:
+        weather (pd.DataFrame): Output of fetch_weather_for_all_stations.
+
+    Returns:
+        pd.DataFrame: Weather data keyed by date, hour and station_name.
+    """
+    weather = weather.copy()
+    timestamps = pd.to_datetime(weather["date"])
+    weather["hour"] = timestamps.dt.hour
+    weather["date"] = timestamps.dt.date
+    return weather.drop(
+        columns=["latitude", "longitude", "timezone", "timezone_abbreviation"]
+    )
+
+
+def merge_weather(df: pd.DataFrame, weather: pd.DataFrame) -> pd.DataFrame:
+    """
+    Attaches the weather on departure and on arrival to every subtrip.
+
+    Args:
+        df (pd.DataFrame): Output of add_subtrip_features.
+        weather (pd.DataFrame): Output of prepare_weather.
+
+    Returns:
+        pd.DataFrame: Subtrips with *_on_departure and *_on_arrival columns.
+    """
+    df = df.merge(
+        weather.add_suffix("_on_departure"),
+        left_on=["date", "departure_hour", "current_station"],
+        right_on=[f"{col}_on_departure" for col in WEATHER_KEY_COLUMNS],
+        how="left",
+    )
+    df = df.merge(
+        weather.add_suffix("_on_arrival"),
+        left_on=["date", "arrival_hour", "next_station"],
+        right_on=[f"{col}_on_arrival" for col in WEATHER_KEY_COLUMNS],
+        how="left",
+    )
+    return df.drop(
+        columns=[f"{col}_on_departure" for col in WEATHER_KEY_COLUMNS]
+        + [f"{col}_on_arrival" for col in WEATHER_KEY_COLUMNS]
+    )
+
+
+def build_trips_data(
+    trips: pd.DataFrame,
+    subtrip_distances: pd.DataFrame,
+    weather: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Runs the full cleaning pipeline from raw trips to trips_data.
+
+    Args:
+        trips (pd.DataFrame): Raw rows of the trips table.
+        subtrip_distances (pd.DataFrame): Distances between consecutive stations.
+        weather (pd.DataFrame): Output of fetch_weather_for_all_stations.
+
+    Returns:
+        pd.DataFrame: The trips_data dataset.
+    """
+    df = build_subtrips(trips)
+    df = add_subtrip_features(df, subtrip_distances)
+    return merge_weather(df, prepare_weather(weather))
@@ -0,0 +1,387 @@
+"""Train the distilled tier of the API model cascade and report its trade-off.
+
+The production model (hundreds of deep trees, two targets) is expensive per
+row while most subtrips have a near-zero delay. This script distills it into
+a compact model over the same features (a few shallow trees, or a linear
+model with --linear) trained on the full model's outputs, and into an error
+model predicting how far the compact model is from the full one. In cascade
+mode the API answers with the compact model and escalates to the full model
+the rows whose predicted error is above a threshold or whose route/station
+bucket is flagged as poorly distilled, in one batched second pass.
+
+The test set is replayed for a range of escalation rates, reporting MAE and
+R² against the observed delays, MAE against the full model and throughput in
+rows/s at --nthread threads. The threshold kept is the one escalating the
+fewest rows whose MAE is within --max-mae-increase of the full model.
+
+Usage:
+    python train_cascade.py --data ../data/trips_data.csv --model ../models/TripsDelayXGBoostModel_v1.0.joblib --manifest ../models/TripsDelayXGBoostModel_v1.0.manifest.json
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from xgboost import XGBRegressor
+
+from model_features import TARGETS
+from train_models import SEED, StageProfiler, prepare_data
+
+ESCALATION_RATES = [0.0, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0]
+BUCKET_COLUMNS = ["route", "current_station"]
+
+
+def fit_fast(
+    X: pd.DataFrame,
+    y: np.ndarray,
+    n_trees: int = 30,
+    max_depth: int = 4,
+    linear: bool = False,
+    nthread: int = 1,
+) -> XGBRegressor:
+    """
+    Fits the compact model on the outputs of the full model.
+
+    Args:
+        X (pd.DataFrame): Features of the full model.
+        y (np.ndarray): Full model predictions, one column per target.
+        n_trees (int): Number of trees, or of boosting rounds when linear.
+        max_depth (int): Depth of the trees.
+        linear (bool): Fit a linear booster instead of trees.
+        nthread (int): Number of threads.
+
+    Returns:
+        XGBRegressor: Compact model.
+    """
+    if linear:
+        model = XGBRegressor(
+            booster="gblinear",
+            n_estimators=n_trees,
+            learning_rate=0.5,
+            n_jobs=nthread,
+            random_state=SEED,
+        )
+    else:
+        model = XGBRegressor(
+            n_estimators=n_trees,
+            max_depth=max_depth,
+            learning_rate=0.3,
+            tree_method="hist",
+            n_jobs=nthread,
+            random_state=SEED,
+        )
+    return model.fit(X, y)
+
+
+def flag_buckets(
+    X: pd.DataFrame, deviation: np.ndarray, factor: float, min_rows: int
+) -> Dict[str, List[int]]:
+    """
+    Route and station codes where the compact model is far from the full one.
+
+    Args:
+        X (pd.DataFrame): Calibration features.
+        deviation (np.ndarray): Largest absolute gap between the models per row.
+        factor (float): Flag buckets whose mean gap is factor times the overall.
+        min_rows (int): Minimum rows of a bucket to be flagged.
+
+    Returns:
+        dict: Flagged codes per column.
+    """
+    flagged = {}
+    limit = factor * deviation.mean()
+    for col in BUCKET_COLUMNS:
+        if col not in X.columns:
+            continue
+        stats = pd.DataFrame({col: X[col].to_numpy(), "deviation": deviation})
+        stats = stats.groupby(col)["deviation"].agg(["mean", "count"])
+        codes = stats[(stats["mean"] > limit) & (stats["count"] >= min_rows)].index
+        flagged[col] = [int(code) for code in codes]
+    return flagged
+
+
+def cascade_predict(
+    cascade: Dict[str, Any], full: XGBRegressor, X: pd.DataFrame
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Predictions of the cascade, like SingleStationPredictor.cascade_predict.
+
+    Args:
+        cascade (dict): Cascade artifact.
+        full (XGBRegressor): Full model.
+        X (pd.DataFrame): Features.
+
+    Returns:
+        tuple: Clipped predictions and the mask of escalated rows.
+    """
+    values = X.to_numpy(dtype=np.float32)
+    predictions = cascade["fast"].predict(values, validate_features=False)
+    escalate = (
+        cascade["error"].predict(values, validate_features=False)
+        > cascade["error_threshold"]
+    )
+    for col, codes in cascade["flagged"].items():
+        if col in X.columns:
+            escalate |= X[col].isin(codes).to_numpy()
+    if escalate.any():
+        predictions[escalate] = full.predict(values[escalate], validate_features=False)
+    return np.maximum(predictions, 0), escalate
+
+
+def throughput(predict, X: pd.DataFrame, batch_size: int) -> float:
+    """Rows per second of a prediction function called on batches of X"""
+    start = time.perf_counter()
+    for offset in range(0, len(X), batch_size):
+        predict(X.iloc[offset : offset + batch_size])
+    return len(X) / (time.perf_counter() - start)
+
+
+def trade_off(
+    cascade: Dict[str, Any],
+    full: XGBRegressor,
+    X: pd.DataFrame,
+    y: pd.DataFrame,
+    rates: List[float],
+    batch_size: int,
+) -> List[Dict[str, Any]]:
+    """
+    Accuracy and throughput of the cascade for several escalation rates.
+
+    Args:
+        cascade (dict): Cascade artifact, its threshold is overwritten.
+        full (XGBRegressor): Full model.
+        X (pd.DataFrame): Test features.
+        y (pd.DataFrame): Observed delays.
+        rates (list): Share of rows escalated on predicted error alone.
+        batch_size (int): Rows per prediction call when timing.
+
+    Returns:
+        list: One row per rate, after the full model fed with DataFrames (as
+            served without the cascade) and with arrays (as in the cascade).
+    """
+    full_predictions = np.maximum(full.predict(X), 0)
+    full_row = {
+        "error_threshold": None,
+        "escalated": 1.0,
+        "mae": float(mean_absolute_error(y, full_predictions)),
+        "r2": float(r2_score(y, full_predictions)),
+        "mae_vs_full": 0.0,
+    }
+    rows = [
+        {
+            "tier": "full",
+            **full_row,
+            "rows_per_s": throughput(full.predict, X, batch_size),
+        },
+        {
+            "tier": "full (arrays)",
+            **full_row,
+            "rows_per_s": throughput(
+                lambda batch: full.predict(
+                    batch.to_numpy(dtype=np.float32), validate_features=False
+                ),
+                X,
+                batch_size,
+            ),
+        },
+    ]
+    predicted_error = cascade["error"].predict(X)
+    for rate in rates:
+        if rate <= 0:
+            threshold = float("inf")
+        elif rate >= 1:
+            threshold = float("-inf")
+        else:
+            threshold = float(np.quantile(predicted_error, 1 - rate))
+        cascade["error_threshold"] = threshold
+        predictions, escalated = cascade_predict(cascade, full, X)
+        rows.append(
+            {
+                "tier": f"cascade@{rate:.0%}",
+                "error_threshold": threshold,
+                "escalated": float(escalated.mean()),
+                "mae": float(mean_absolute_error(y, predictions)),
+                "r2": float(r2_score(y, predictions)),
+                "mae_vs_full": float(
+                    mean_absolute_error(full_predictions, predictions)
+                ),
+                "rows_per_s": throughput(
+                    lambda batch: cascade_predict(cascade, full, batch),
+                    X,
+                    batch_size,
+                ),
+            }
+        )
+    return rows
+
+
+def choose(rows: List[Dict[str, Any]], max_mae_increase: float) -> Dict[str, Any]:
+    """Cascade row escalating the fewest rows within the MAE budget"""
+    limit = rows[0]["mae"] * (1 + max_mae_increase)
+    candidates = [
+        row for row in rows if row["tier"].startswith("cascade") and row["mae"] <= limit
+    ]
+    if not candidates:
+        print("No threshold within the MAE budget, escalating every row")
+        return rows[-1]
+    return min(candidates, key=lambda row: row["escalated"])
+
+
+def report(rows: List[Dict[str, Any]]) -> str:
+    """Trade-off table"""
+    lines = [
+        f"{'tier':<16}{'escalated':>10}{'MAE':>8}{'R²':>8}{'vs full':>9}{'rows/s':>10}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['tier']:<16}{row['escalated']:>10.1%}{row['mae']:>8.3f}"
+            f"{row['r2']:>8.3f}{row['mae_vs_full']:>9.3f}{row['rows_per_s']:>10,.0f}"
+        )
+    return "\n".join(lines)
+
+
+def update_manifest(path: str, cascade_path: str) -> None:
+    """Point a registry manifest at the cascade artifact"""
+    with open(path, "r", encoding="utf-8") as _f:
+        manifest = json.load(_f)
+    manifest["cascade_path"] = os.path.relpath(
+        cascade_path, os.path.dirname(os.path.abspath(path))
+    )
+    with open(path, "w", encoding="utf-8") as _f:
+        json.dump(manifest, _f, indent=2)
+
+
+def manifest_encoders(path: str) -> str:
+    """Label encoders file of a registry manifest"""
+    with open(path, "r", encoding="utf-8") as _f:
+        manifest = json.load(_f)
+    if not manifest.get("encoders_path"):
+        raise ValueError(f"Manifest {path} has no encoders_path")
+    return os.path.join(
+        os.path.dirname(os.path.abspath(path)), manifest["encoders_path"]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data",
+        default="../data/trips_data.csv",
+        help="trips_data.csv or a directory of per-date partitions",
+    )
+    parser.add_argument("--model", required=True, help="Full model joblib file")
+    parser.add_argument(
+        "--output", help="Cascade joblib file, defaults to <model>_cascade.joblib"
+    )
+    parser.add_argument("--manifest", help="Registry manifest to point at the cascade")
+    parser.add_argument(
+        "--encoders",
+        help="Label encoders of the full model, defaults to the encoders_path "
+        "of --manifest",
+    )
+    parser.add_argument("--trees", type=int, default=30)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--linear", action="store_true")
+    parser.add_argument("--error-trees", type=int, default=20)
+    parser.add_argument("--bucket-factor", type=float, default=2.0)
+    parser.add_argument("--min-bucket-rows", type=int, default=20)
+    parser.add_argument("--max-mae-increase", type=float, default=0.02)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--nthread", type=int, default=1)
+    args = parser.parse_args()
+    if args.encoders is None and args.manifest is None:
+        parser.error("the label encoders of the model need --encoders or --manifest")
+
+    output = args.output or os.path.splitext(args.model)[0] + "_cascade.joblib"
+    full: XGBRegressor = joblib.load(args.model)
+    full.set_params(n_jobs=args.nthread)
+    features = full.get_booster().feature_names
+
+    # Refitting the encoders could give the categories other codes than the
+    # full model was trained on
+    encoders_path = args.encoders or manifest_encoders(args.manifest)
+
+    profiler = StageProfiler()
+    train_data, test_data, _, _ = prepare_data(
+        args.data, profiler, joblib.load(encoders_path)
+    )
+    X_train = train_data[features]
+    X_test, y_test = test_data[features], test_data[TARGETS]
+    del train_data, test_data
+
+    with profiler.stage("distill"):
+        teacher = np.maximum(full.predict(X_train), 0)
+        X_fit, X_cal, y_fit, y_cal = train_test_split(
+            X_train, teacher, test_size=0.25, random_state=SEED
+        )
+        fast = fit_fast(X_fit, y_fit, args.trees, args.depth, args.linear, args.nthread)
+        deviation = np.abs(np.maximum(fast.predict(X_cal), 0) - y_cal).max(axis=1)
+        error = XGBRegressor(
+            n_estimators=args.error_trees,
+            max_depth=3,
+            tree_method="hist",
+            n_jobs=args.nthread,
+            random_state=SEED,
+        ).fit(X_cal, deviation)
+        flagged = flag_buckets(
+            X_cal, deviation, args.bucket_factor, args.min_bucket_rows
+        )
+    print(
+        "Flagged buckets: "
+        + ", ".join(f"{col} {len(codes)}" for col, codes in flagged.items())
+    )
+
+    cascade = {
+        "fast": fast,
+        "error": error,
+        "error_threshold": float("inf"),
+        "flagged": flagged,
+        "features": list(features),
+    }
+    with profiler.stage("trade-off"):
+        rows = trade_off(
+            cascade, full, X_test, y_test, ESCALATION_RATES, args.batch_size
+        )
+    print(report(rows))
+    chosen = choose(rows, args.max_mae_increase)
+    print(f"Chosen: {chosen['tier']}, {chosen['escalated']:.1%} rows escalated")
+
+    cascade["error_threshold"] = chosen["error_threshold"]
+    cascade["metrics"] = chosen
+    joblib.dump(cascade, output)
+    print(f"Cascade written to {output}")
+    if args.manifest:
+        update_manifest(args.manifest, output)
+        print(f"Manifest {args.manifest} updated")
+
+    # Thresholds of 0% and 100% escalation are infinite, null in JSON
+    rows = [
+        {
+            key: None if isinstance(value, float) and not np.isfinite(value) else value
+            for key, value in row.items()
+        }
+        for row in rows
+    ]
+    with open(os.path.splitext(output)[0] + "_report.json", "w") as _f:
+        json.dump(
+            {
+                "rows": rows,
+                "chosen": rows[[r["tier"] for r in rows].index(chosen["tier"])],
+                "args": vars(args),
+                "stages": profiler.stages,
+            },
+            _f,
+            indent=2,
+        )
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
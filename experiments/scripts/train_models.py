@@ -0,0 +1,510 @@
+"""Train the single-station delay model on CPU and export the API artifacts.
+
+Runs the steps of notebooks/02_model_selection.ipynb end to end: feature
+engineering, hyperparameter search, final fit and export of the model,
+label encoders, feature importance and metrics.json consumed by the API
+(SINGLE_STATION_MODEL_PATH, ENCODER_PATH and METRICS_JSON).
+
+Training data is quantized once: the histogram cuts are sketched on the whole
+training set and every fold matrix reuses them, so the search only pays for
+tree construction. Each config is boosted up to --max-rounds with early
+stopping on the validation fold, which replaces the n_estimators axis of the
+notebook grid. The final model is fitted on the whole training set with the
+mean best number of rounds of the selected config.
+
+Usage:
+    python train_models.py --data ../data/trips_data.csv --output-dir ../models --nthread 8
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit, train_test_split
+from sklearn.preprocessing import LabelEncoder
+from xgboost import XGBRegressor
+
+from model_features import (
+    FEATURES,
+    TARGETS,
+    apply_encoders,
+    create_all_features,
+    encode_categoricals,
+    load_trips_data,
+)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from app.services.profiler import rss_bytes  # noqa: E402
+
+# Grid of the notebook, n_estimators is replaced by early stopping
+PARAM_GRID = {
+    "max_depth": [3, 6, 9],
+    "learning_rate": [0.01, 0.1, 0.2],
+    "subsample": [0.6, 0.8, 1.0],
+    "colsample_bytree": [0.6, 0.8, 1.0],
+}
+MAX_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 50
+SEED = 42
+
+
+class StageProfiler:
+    """Wall time and peak resident memory of named pipeline stages"""
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.interval = interval
+        self.stages: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure the enclosed block, sampling RSS in a background thread"""
+        start_rss = rss_bytes()
+        peak = [start_rss]
+        done = threading.Event()
+
+        def sample() -> None:
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], rss_bytes())
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            done.set()
+            sampler.join()
+            peak[0] = max(peak[0], rss_bytes())
+            self.stages.append(
+                {
+                    "stage": name,
+                    "seconds": round(seconds, 2),
+                    "peak_rss_mb": round(peak[0] / 2**20, 1),
+                    "rss_delta_mb": round((peak[0] - start_rss) / 2**20, 1),
+                }
+            )
+            print(
+                f"[{name}] {seconds:.1f} s, peak RSS {peak[0] / 2**20:.0f} MB "
+                f"(+{(peak[0] - start_rss) / 2**20:.0f} MB)"
+            )
+
+    def report(self) -> str:
+        """Stages as a text table"""
+        lines = [f"{'stage':<24}{'seconds':>10}{'peak MB':>10}{'delta MB':>10}"]
+        for s in self.stages:
+            lines.append(
+                f"{s['stage']:<24}{s['seconds']:>10.1f}"
+                f"{s['peak_rss_mb']:>10.0f}{s['rss_delta_mb']:>10.0f}"
+            )
+        return "\n".join(lines)
+
+
+def grid_configs(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """All combinations of a parameter grid"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def booster_params(
+    config: Dict[str, Any], nthread: int, max_bin: int
+) -> Dict[str, Any]:
+    """xgb.train parameters of a config, on CPU with the hist tree method"""
+    return {
+        "objective": "reg:squarederror",
+        "tree_method": "hist",
+        "max_bin": max_bin,
+        "nthread": nthread,
+        "seed": SEED,
+        **config,
+    }
+
+
+class QuantizedFolds:
+    """
+    Training matrices quantized once and reused by every config.
+
+    The histogram cuts are sketched on the whole training set; fold matrices
+    are built from the same cuts and kept in memory for the whole search.
+    """
+
+    def __init__(
+        self,
+        X: pd.DataFrame,
+        y: pd.DataFrame,
+        n_splits: int = 5,
+        nthread: int = -1,
+        max_bin: int = 256,
+    ) -> None:
+        self.nthread = nthread
+        self.max_bin = max_bin
+        self.full = xgb.QuantileDMatrix(
+            X, y.to_numpy(np.float32), max_bin=max_bin, nthread=nthread
+        )
+        self.folds: List[Tuple[xgb.QuantileDMatrix, xgb.QuantileDMatrix]] = []
+        for train_index, val_index in TimeSeriesSplit(n_splits=n_splits).split(X):
+            dtrain = self._matrix(X, y, train_index, self.full)
+            # Evaluation matrices must reference the matrix they are evaluated with
+            dval = self._matrix(X, y, val_index, dtrain)
+            self.folds.append((dtrain, dval))
+
+    def _matrix(
+        self,
+        X: pd.DataFrame,
+        y: pd.DataFrame,
+        index: np.ndarray,
+        ref: xgb.QuantileDMatrix,
+    ) -> xgb.QuantileDMatrix:
+        return xgb.QuantileDMatrix(
+            X.iloc[index],
+            y.iloc[index].to_numpy(np.float32),
+            ref=ref,
+            max_bin=self.max_bin,
+            nthread=self.nthread,
+        )
+
+
+def evaluate_config(
+    folds: QuantizedFolds,
+    config: Dict[str, Any],
+    max_rounds: int = MAX_ROUNDS,
+    early_stopping_rounds: int = EARLY_STOPPING_ROUNDS,
+) -> Dict[str, Any]:
+    """
+    Cross-validates a config with early stopping on each validation fold.
+
+    Args:
+        folds (QuantizedFolds): Quantized fold matrices.
+        config (dict): Hyperparameters of the config.
+        max_rounds (int): Maximum number of boosting rounds.
+        early_stopping_rounds (int): Rounds without improvement before stopping.
+
+    Returns:
+        dict: Config, mean validation MSE and best number of rounds per fold.
+    """
+    params = booster_params(config, folds.nthread, folds.max_bin)
+    scores, rounds = [], []
+    for dtrain, dval in folds.folds:
+        booster = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=max_rounds,
+            evals=[(dval, "val")],
+            early_stopping_rounds=early_stopping_rounds,
+            verbose_eval=False,
+        )
+        # RMSE over both targets, squared to the notebook scoring (MSE)
+        scores.append(booster.best_score**2)
+        rounds.append(booster.best_iteration + 1)
+    return {
+        "params": config,
+        "mse": float(np.mean(scores)),
+        "fold_mse": [float(score) for score in scores],
+        "rounds": rounds,
+    }
+
+
+def search(
+    folds: QuantizedFolds,
+    configs: List[Dict[str, Any]],
+    max_rounds: int = MAX_ROUNDS,
+    early_stopping_rounds: int = EARLY_STOPPING_ROUNDS,
+) -> List[Dict[str, Any]]:
+    """Evaluates every config, best (lowest MSE) first"""
+    results = []
+    for i, config in enumerate(configs, 1):
+        start_time = time.perf_counter()
+        result = evaluate_config(folds, config, max_rounds, early_stopping_rounds)
+        result["seconds"] = round(time.perf_counter() - start_time, 2)
+        results.append(result)
+        print(
+            f"[{i}/{len(configs)}] {config} mse={result['mse']:.2f} "
+            f"rounds={result['rounds']} ({result['seconds']:.1f} s)"
+        )
+    return sorted(results, key=lambda result: result["mse"])
+
+
+def fit_final(
+    dtrain: xgb.QuantileDMatrix,
+    config: Dict[str, Any],
+    n_rounds: int,
+    nthread: int = -1,
+    max_bin: int = 256,
+) -> XGBRegressor:
+    """
+    Fits a config on a whole training matrix.
+
+    Args:
+        dtrain (xgb.QuantileDMatrix): Quantized training data.
+        config (dict): Hyperparameters of the config.
+        n_rounds (int): Number of boosting rounds.
+        nthread (int): Number of threads.
+        max_bin (int): Number of histogram bins of the matrix.
+
+    Returns:
+        XGBRegressor: Model loadable by the API, its booster feature_names
+            are the training columns.
+    """
+    booster = xgb.train(booster_params(config, nthread, max_bin), dtrain, n_rounds)
+    model = XGBRegressor(
+        n_estimators=n_rounds, random_state=SEED, tree_method="hist", **config
+    )
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    return model
+
+
+def prepare_data(
+    path: str,
+    profiler: StageProfiler,
+    label_encoders: Optional[Dict[str, LabelEncoder]] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Any], int]:
+    """
+    Loads, encodes and splits trips_data like the notebook.
+
+    Args:
+        path (str): trips_data.csv or a directory of per-date partitions.
+        profiler (StageProfiler): Profiler recording the load and features stages.
+        label_encoders (dict): Encoders of an exported model to encode with,
+            fitted on the data if not given.
+
+    Returns:
+        tuple: Train and test subtrips with all features, label encoders and
+            the number of days covered.
+    """
+    with profiler.stage("load"):
+        trip_data = load_trips_data(path)
+        if label_encoders is None:
+            label_encoders = encode_categoricals(trip_data)
+        else:
+            encoded = apply_encoders(trip_data, label_encoders)
+            if len(encoded) < len(trip_data):
+                raise ValueError(
+                    f"{len(trip_data) - len(encoded)} subtrips have categories "
+                    "unknown to the label encoders, retrain the model on this data"
+                )
+            trip_data = encoded
+    with profiler.stage("features"):
+        trip_data = create_all_features(trip_data)
+    period_days = (trip_data["date"].max() - trip_data["date"].min()).days
+
+    train_data, test_data = train_test_split(
+        trip_data, test_size=0.2, random_state=SEED, shuffle=True
+    )
+    print(f"Train samples: {len(train_data)}, Test samples: {len(test_data)}")
+    return train_data, test_data, label_encoders, period_days
+
+
+def evaluate(
+    model: XGBRegressor, X_test: pd.DataFrame, y_test: pd.DataFrame
+) -> Dict[str, float]:
+    """MSE, R² and MAE on the test set, averaged over both targets"""
+    y_pred = model.predict(X_test)
+    metrics = {
+        "mse": float(mean_squared_error(y_test, y_pred)),
+        "r2": float(r2_score(y_test, y_pred)),
+        "mae": float(mean_absolute_error(y_test, y_pred)),
+    }
+    print(
+        f"MSE: {metrics['mse']:.2f}, R²: {metrics['r2']:.3f}, "
+        f"MAE: {metrics['mae']:.2f} minutes"
+    )
+    return metrics
+
+
+def export_artifacts(
+    output_dir: str,
+    version: str,
+    model: XGBRegressor,
+    label_encoders: Dict[str, Any],
+    metrics: Dict[str, Any],
+    default: bool = True,
+) -> None:
+    """
+    Writes the model, label encoders, feature importance, metrics.json and the
+    registry manifest.
+
+    Args:
+        output_dir (str): Directory of the artifacts.
+        version (str): Model version, part of the file names.
+        model (XGBRegressor): Fitted model.
+        label_encoders (dict): LabelEncoder per categorical column.
+        metrics (dict): Test metrics and training details.
+        default (bool): Make the model the registry default, in place of the
+            other manifests of output_dir.
+    """
+    file_name = f"TripsDelayXGBoostModel_{version}"
+    os.makedirs(output_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(output_dir, f"{file_name}.joblib"))
+    joblib.dump(
+        label_encoders, os.path.join(output_dir, f"label_encoders_{version}.joblib")
+    )
+    feature_importance = pd.DataFrame(
+        {
+            "feature": model.get_booster().feature_names,
+            "importance": model.feature_importances_,
+        }
+    ).sort_values("importance", ascending=False)
+    feature_importance.to_json(
+        os.path.join(
+            output_dir, f"TripsDelayXGBoostModel_feature_importance_{version}.json"
+        ),
+        orient="records",
+    )
+    with open(
+        os.path.join(output_dir, f"TripsDelayXGBoostModel_metrics_{version}.json"), "w"
+    ) as _f:
+        json.dump(
+            {
+                "model": "XGBRegressor",
+                "file_name": file_name,
+                "version": version,
+                **metrics,
+            },
+            _f,
+            indent=2,
+        )
+    # Lets the API model registry discover the model (MODEL_REGISTRY_DIR)
+    manifest_path = os.path.join(output_dir, f"{file_name}.manifest.json")
+    if default:
+        # The registry accepts a single default model
+        for path in glob.glob(os.path.join(output_dir, "*.manifest.json")):
+            with open(path, "r", encoding="utf-8") as _f:
+                other = json.load(_f)
+            if other.get("default") and path != manifest_path:
+                other["default"] = False
+                with open(path, "w", encoding="utf-8") as _f:
+                    json.dump(other, _f, indent=2)
+                print(f"{other['name']} is no longer the default model")
+    with open(manifest_path, "w", encoding="utf-8") as _f:
+        json.dump(
+            {
+                "name": f"single-{version}",
+                "version": version,
+                "model_path": f"{file_name}.joblib",
+                "encoders_path": f"label_encoders_{version}.joblib",
+                "metrics_path": f"TripsDelayXGBoostModel_metrics_{version}.json",
+                "default": default,
+            },
+            _f,
+            indent=2,
+        )
+    # Row of the metrics history table in experiments/README.md
+    print(
+        f"| {version} | {date.today()} | {metrics['samples']:,} "
+        f"| {metrics['features']} | {metrics['period_days']} | {metrics['mse']:.2f} "
+        f"| {metrics['r2']:.3f} | {metrics['mae']:.2f} |"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data",
+        default="../data/trips_data.csv",
+        help="trips_data.csv or a directory of per-date partitions",
+    )
+    parser.add_argument("--output-dir", default="../models")
+    parser.add_argument("--version", default="v1.0")
+    parser.add_argument(
+        "--no-default",
+        action="store_true",
+        help="Keep the current registry default model instead of this one",
+    )
+    parser.add_argument(
+        "--features", help="JSON list of features, defaults to the notebook features"
+    )
+    parser.add_argument("--grid", help="JSON parameter grid, defaults to PARAM_GRID")
+    parser.add_argument(
+        "--params", help="JSON parameters to fit directly, skipping the search"
+    )
+    parser.add_argument("--nthread", type=int, default=os.cpu_count())
+    parser.add_argument("--max-bin", type=int, default=256)
+    parser.add_argument("--n-splits", type=int, default=5)
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS)
+    parser.add_argument(
+        "--early-stopping-rounds", type=int, default=EARLY_STOPPING_ROUNDS
+    )
+    args = parser.parse_args()
+
+    features = FEATURES
+    if args.features:
+        with open(args.features, "r") as _f:
+            features = json.load(_f)
+    grid = PARAM_GRID
+    if args.grid:
+        with open(args.grid, "r") as _f:
+            grid = json.load(_f)
+    if args.params:
+        with open(args.params, "r") as _f:
+            grid = {name: [value] for name, value in json.load(_f).items()}
+
+    profiler = StageProfiler()
+    train_data, test_data, label_encoders, period_days = prepare_data(
+        args.data, profiler
+    )
+    X_train, y_train = train_data[features], train_data[TARGETS]
+    X_test, y_test = test_data[features], test_data[TARGETS]
+    del train_data, test_data
+
+    with profiler.stage("quantize"):
+        folds = QuantizedFolds(
+            X_train, y_train, args.n_splits, args.nthread, args.max_bin
+        )
+    configs = grid_configs(grid)
+    with profiler.stage(f"search ({len(configs)} configs)"):
+        results = search(folds, configs, args.max_rounds, args.early_stopping_rounds)
+    best = results[0]
+    n_rounds = int(round(np.mean(best["rounds"])))
+    print(f"Best parameters: {best['params']}, {n_rounds} rounds")
+
+    with profiler.stage("fit"):
+        model = fit_final(
+            folds.full, best["params"], n_rounds, args.nthread, args.max_bin
+        )
+    with profiler.stage("evaluate"):
+        metrics = evaluate(model, X_test, y_test)
+    with profiler.stage("export"):
+        export_artifacts(
+            args.output_dir,
+            args.version,
+            model,
+            label_encoders,
+            {
+                **metrics,
+                "samples": len(X_train) + len(X_test),
+                "features": len(features),
+                "period_days": period_days,
+                "params": {**best["params"], "n_estimators": n_rounds},
+            },
+            default=not args.no_default,
+        )
+
+    print(profiler.report())
+    with open(
+        os.path.join(
+            args.output_dir, f"TripsDelayXGBoostModel_training_{args.version}.json"
+        ),
+        "w",
+    ) as _f:
+        json.dump(
+            {"nthread": args.nthread, "stages": profiler.stages, "search": results},
+            _f,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()